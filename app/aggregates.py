@@ -0,0 +1,231 @@
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+
+# Query parameters of /api/aggregates with the customer profile column they filter
+RANGE_FILTERS = {'age': 'age', 'income': 'income', 'since': 'customer_since'}
+
+# Width of the histogram bins per column, overridable with the age_bin and income_bin parameters
+HISTOGRAM_BINS = {'age': 10, 'income': 10000}
+
+# Offer types of the spend and transaction columns of the customer profiles
+OFFER_TYPES = ['discount', 'bogo', 'informational', 'no_offer']
+
+# Customer profile columns read by the aggregates
+AGGREGATE_COLUMNS = ['gender', 'age', 'income', 'customer_since', '#bogos', '#discounts'] + \
+                    ['transaction_{}_value'.format(offer) for offer in OFFER_TYPES] + \
+                    ['#transaction_{}'.format(offer) for offer in OFFER_TYPES]
+
+
+def parse_range(value):
+    '''
+    INPUT
+    value - range such as '30-40', '30-' or '-40', or a single number
+
+    OUTPUT
+    low, high - inclusive bounds of the range, None for an open end
+    '''
+    low, separator, high = value.partition('-')
+    low = float(low) if low.strip() else None
+    high = (float(high) if high.strip() else None) if separator else low
+    if low is not None and high is not None and low > high:
+        raise ValueError('empty range {}'.format(value))
+    return low, high
+
+
+def parse_filters(args):
+    '''
+    INPUT
+    args - query parameters of the request
+
+    OUTPUT
+    filters - dictionary of column to a tuple of genders or to the (low, high) bounds
+    bins - dictionary of histogram column to its bin width
+
+    Raises a ValueError for parameters which do not parse. The filters are normalised,
+    so equivalent requests share a cache entry.
+    '''
+    filters = {}
+    if args.get('gender'):
+        filters['gender'] = tuple(sorted(set(value.strip() for value in args['gender'].split(','))))
+    for parameter, column in RANGE_FILTERS.items():
+        if args.get(parameter):
+            filters[column] = parse_range(args[parameter])
+
+    bins = {}
+    for column, width in HISTOGRAM_BINS.items():
+        bins[column] = float(args.get(column + '_bin', width))
+        if bins[column] <= 0:
+            raise ValueError('{}_bin must be positive'.format(column))
+    return filters, bins
+
+
+def bin_values(values, width):
+    '''
+    INPUT
+    values - array of the values of a numeric column
+    width - width of the bins
+
+    OUTPUT
+    edges - array of the bin edges, one more than the counts, on multiples of the width
+    counts - array of the number of values per bin
+
+    Missing values are left out. The bins match the histograms of /api/aggregates.
+    '''
+    values = np.asarray(values, dtype='float64')
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return np.array([0.0]), np.array([], dtype='int64')
+    first, last = np.floor(values.min() / width), np.floor(values.max() / width) + 1
+    edges = np.arange(first, last + 1) * width
+    counts, _ = np.histogram(values, bins=edges)
+    return edges, counts
+
+
+def build_where(filters):
+    '''
+    INPUT
+    filters - dictionary returned by parse_filters
+
+    OUTPUT
+    where - SQL WHERE clause (empty without filters) with ? placeholders
+    params - list of the values of the placeholders
+    '''
+    conditions, params = [], []
+    for column, value in filters.items():
+        if column == 'gender':
+            conditions.append('"gender" IN ({})'.format(', '.join('?' * len(value))))
+            params.extend(value)
+            continue
+        low, high = value
+        if low is not None:
+            conditions.append('"{}" >= ?'.format(column))
+            params.append(low)
+        if high is not None:
+            conditions.append('"{}" <= ?'.format(column))
+            params.append(high)
+    return ('WHERE ' + ' AND '.join(conditions)) if conditions else '', params
+
+
+def query_sqlite(data_filepath, filters, bins):
+    '''
+    INPUT
+    data_filepath - SQLite database written by process_data.py
+    filters - dictionary returned by parse_filters
+    bins - dictionary of histogram column to its bin width
+
+    OUTPUT
+    aggregates - dictionary of the aggregates, see format_aggregates
+
+    Every aggregate is one SQL query over the filtered rows, so SQLite filters with the
+    indexes on the demographic columns and only the aggregated rows leave the database.
+    '''
+    where, params = build_where(filters)
+    spend = ' + '.join('"transaction_{}_value"'.format(offer) for offer in OFFER_TYPES)
+
+    connection = sqlite3.connect('file:{}?mode=ro'.format(data_filepath), uri=True)
+    try:
+        totals = connection.execute('SELECT COUNT(*), {}, {} FROM customer_profiles {}'.format(
+            ', '.join('COALESCE(SUM("transaction_{}_value"), 0)'.format(offer) for offer in OFFER_TYPES),
+            ', '.join('COALESCE(SUM("#transaction_{}"), 0)'.format(offer) for offer in OFFER_TYPES),
+            where), params).fetchone()
+        by_gender = connection.execute(
+            'SELECT "gender", COUNT(*), AVG({}), SUM("#bogos"), SUM("#discounts") FROM customer_profiles {} '
+            'GROUP BY "gender" ORDER BY "gender"'.format(spend, where), params).fetchall()
+        histograms = {}
+        for column, width in bins.items():
+            histograms[column] = connection.execute(
+                'SELECT CAST("{0}" / ? AS INTEGER) AS bin, COUNT(*) FROM customer_profiles {1} '
+                'GROUP BY bin ORDER BY bin'.format(column, where), [width] + params).fetchall()
+    finally:
+        connection.close()
+
+    return format_aggregates(filters, bins, totals, by_gender, histograms)
+
+
+def query_parquet(data_filepath, filters, bins):
+    '''
+    INPUT
+    data_filepath - parquet file or parquet directory written by process_data.py
+    filters - dictionary returned by parse_filters
+    bins - dictionary of histogram column to its bin width
+
+    OUTPUT
+    aggregates - dictionary of the aggregates, see format_aggregates
+
+    The filters are handed to the parquet reader, which skips the row groups outside
+    of them, and the aggregates are computed on the remaining rows.
+    '''
+    if os.path.isdir(data_filepath):
+        data_filepath = os.path.join(data_filepath, 'customer_profiles.parquet')
+    parquet_filters = []
+    for column, value in filters.items():
+        if column == 'gender':
+            parquet_filters.append(('gender', 'in', list(value)))
+            continue
+        low, high = value
+        if low is not None:
+            parquet_filters.append((column, '>=', low))
+        if high is not None:
+            parquet_filters.append((column, '<=', high))
+    df = pd.read_parquet(data_filepath, columns=AGGREGATE_COLUMNS, filters=parquet_filters or None)
+
+    totals = [len(df)] + [df['transaction_{}_value'.format(offer)].sum() for offer in OFFER_TYPES] + \
+             [df['#transaction_{}'.format(offer)].sum() for offer in OFFER_TYPES]
+    spend = sum(df['transaction_{}_value'.format(offer)] for offer in OFFER_TYPES)
+    grouped = pd.DataFrame({'gender': df['gender'], 'spend': spend, '#bogos': df['#bogos'],
+                            '#discounts': df['#discounts']}).groupby('gender', sort=True)
+    by_gender = [(gender, len(group), group['spend'].mean(), group['#bogos'].sum(), group['#discounts'].sum())
+                 for gender, group in grouped]
+    histograms = {}
+    for column, width in bins.items():
+        counts = (df[column] // width).astype('int64').value_counts().sort_index()
+        histograms[column] = list(counts.items())
+
+    return format_aggregates(filters, bins, totals, by_gender, histograms)
+
+
+def format_aggregates(filters, bins, totals, by_gender, histograms):
+    '''
+    INPUT
+    filters - dictionary returned by parse_filters
+    bins - dictionary of histogram column to its bin width
+    totals - customer count followed by the spend and the transaction totals per offer type
+    by_gender - rows of gender, customers, mean total spend, completed bogos and discounts
+    histograms - dictionary of column to (bin number, count) rows
+
+    OUTPUT
+    aggregates - JSON serialisable dictionary with the filters, the customer count, the spend
+                 and transaction totals per offer type, the spends and completed offers per
+                 gender and the histograms as left bin edges and counts
+    '''
+    n_offers = len(OFFER_TYPES)
+    return {'filters': {column: list(value) for column, value in filters.items()},
+            'customers': int(totals[0]),
+            'spend_by_offer': dict(zip(OFFER_TYPES, map(float, totals[1:1 + n_offers]))),
+            'transactions_by_offer': dict(zip(OFFER_TYPES, map(int, totals[1 + n_offers:]))),
+            'by_gender': [{'gender': gender, 'customers': int(customers),
+                           'mean_total_spend': float(mean) if mean is not None and not np.isnan(mean) else None,
+                           'bogos': int(bogos or 0), 'discounts': int(discounts or 0)}
+                          for gender, customers, mean, bogos, discounts in by_gender],
+            'histograms': {column: {'width': bins[column],
+                                    'edges': [float(bin_number * bins[column]) for bin_number, _ in rows],
+                                    'counts': [int(count) for _, count in rows]}
+                           for column, rows in histograms.items()}}
+
+
+def query_aggregates(data_filepath, filters, bins):
+    '''
+    INPUT
+    data_filepath - SQLite database, parquet file or parquet directory written by process_data.py
+    filters - dictionary returned by parse_filters
+    bins - dictionary of histogram column to its bin width
+
+    OUTPUT
+    aggregates - dictionary of the aggregates of the filtered customer profiles
+    '''
+    if os.path.isdir(data_filepath) or data_filepath.endswith('.parquet'):
+        return query_parquet(data_filepath, filters, bins)
+    return query_sqlite(data_filepath, filters, bins)
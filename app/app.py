@@ -1,59 +1,204 @@
-from flask import Flask
-from flask import render_template, request, jsonify
-from plotly.graph_objs import Bar,Pie,Histogram
-import joblib
+from flask import Flask, Blueprint, current_app
+from flask import render_template, request, jsonify, Response, stream_with_context, make_response
+from plotly.graph_objs import Bar,Pie
 from sqlalchemy import create_engine
+import io
+import gzip
+import hashlib
+import os
+import sys
+import threading
 import json
 import plotly
 import pandas as pd
 
-app = Flask(__name__)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'model'))
+from scoring import build_profile_features, score_features, iter_scored_profiles, check_profiles, coerce_profiles, \
+    load_models, parse_numbers
+from prediction_cache import PredictionCache
+from propensity_table import PropensityTable
+from feature_cache import hash_files
+from aggregates import HISTOGRAM_BINS, bin_values, parse_filters, query_aggregates
 
-models = joblib.load("..\model\classifiers.pkl")
+# Default locations of the classifiers and of the data relative to this file
+APP_DIRPATH = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MODEL_FILEPATH = os.path.join(APP_DIRPATH, '..', 'model', 'classifiers.pkl')
+DEFAULT_DATA_FILEPATH = os.path.join(APP_DIRPATH, '..', 'data', 'StarbucksOffers.db')
 
-engine = create_engine('sqlite:///../data/StarbucksOffers.db')
-df = pd.read_sql_table('customer_profiles', engine)
+views = Blueprint('views', __name__)
 
-@app.route('/')
-@app.route('/index')
-def index():
-    
-    # extract data needed for visuals
-    # TODO: Below is an example - modify to extract data for your own visuals
 
+def get_model_version(model_filepath):
+    '''
+    INPUT
+    model_filepath - file path of the classifiers pickle or of their compact npz export
+
+    OUTPUT
+    version - modification time and size of the file, changes whenever the classifiers are saved
+    '''
+    stat = os.stat(model_filepath)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def load_served_models(model_filepath, propensity_dirpath=None, logger=None):
+    '''
+    INPUT
+    model_filepath - file path of the classifiers pickle or of their compact npz export
+    propensity_dirpath - optional propensity table precomputed from the classifiers by propensity_table.py
+    logger - logger to warn about a propensity table of other classifiers
+
+    OUTPUT
+    models - dictionary of offer type to the classifier, or to the propensity table lookup
+             when a table built from these classifiers is configured
+    encoder - the fitted feature encoder of the classifiers
+    '''
+    models, encoder = load_models(model_filepath)
+    if propensity_dirpath:
+        table = PropensityTable.load(propensity_dirpath)
+        if table.meta['model_sha256'] == hash_files([model_filepath]):
+            models = table.wrap(models)
+            encoder.check_models(models)
+        elif logger is not None:
+            logger.warning('Propensity table %s was built from other classifiers, serving %s directly',
+                           propensity_dirpath, model_filepath)
+    return models, encoder
+
+
+# Customer profile columns used by the dashboard
+DASHBOARD_COLUMNS = ['gender', 'age', 'income', '#bogos', '#discounts',
+                     'transaction_discount_value', 'transaction_bogo_value',
+                     'transaction_informational_value', 'transaction_no_offer_value',
+                     '#transaction_discount', '#transaction_bogo',
+                     '#transaction_informational', '#transaction_no_offer']
+
+# Positions of the invalid profiles listed in the error of /api/predict/batch
+MAX_INVALID_ROWS = 20
+
+
+def load_data(data_filepath):
+    '''
+    INPUT
+    data_filepath - SQLite database, parquet file or parquet directory written by process_data.py
+
+    OUTPUT
+    df - pandas dataframe with the dashboard columns of the customer profiles
+    '''
+    if os.path.isdir(data_filepath):
+        data_filepath = os.path.join(data_filepath, 'customer_profiles.parquet')
+    if data_filepath.endswith('.parquet'):
+        return pd.read_parquet(data_filepath, columns=DASHBOARD_COLUMNS, memory_map=True)
+
+    engine = create_engine('sqlite:///' + data_filepath)
+    query = 'SELECT {} FROM customer_profiles'.format(', '.join('"{}"'.format(column) for column in DASHBOARD_COLUMNS))
+    return pd.read_sql_query(query, engine)
+
+
+def get_data_version(data_filepath):
+    '''
+    INPUT
+    data_filepath - SQLite database, parquet file or parquet directory written by process_data.py
+
+    OUTPUT
+    version - modification times and sizes of the data files, changes whenever the data is rewritten
+    '''
+    if os.path.isdir(data_filepath):
+        data_filepath = os.path.join(data_filepath, 'customer_profiles.parquet')
+
+    # SQLite in WAL mode writes to the -wal file until the next checkpoint. An empty -wal file
+    # holds no data, read only connections leave one behind without changing anything
+    version = []
+    for path in [data_filepath, data_filepath + '-wal']:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            if path == data_filepath or stat.st_size > 0:
+                version.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(version)
+
+
+def compute_aggregates(df):
+    '''
+    INPUT
+    df - pandas dataframe with the dashboard columns of the customer profiles
+
+    OUTPUT
+    aggregates - dictionary with the spend and transaction totals per offer type, the
+                 spends and completed offers per gender and the age and income histograms
+    '''
     value_counts = [df['transaction_discount_value'].sum(),df['transaction_bogo_value'].sum(),\
                     df['transaction_informational_value'].sum(),df['transaction_no_offer_value'].sum()]
-    value_names = ['Discount','Bogo','Informational','No Offer']
 
     count_counts = [df['#transaction_discount'].sum(),df['#transaction_bogo'].sum(),\
                     df['#transaction_informational'].sum(),df['#transaction_no_offer'].sum()]
+
+    # Derived columns are added to a copy so the loaded data is never modified
+    spends = df[['gender', '#bogos', '#discounts']].copy()
+    spends['offer_spends']=df['transaction_discount_value']+df['transaction_bogo_value']+df['transaction_informational_value']
+    spends['total_spends']=spends['offer_spends']+df['transaction_no_offer_value']
+    spends_by_gender=spends.groupby(['gender']).agg({'total_spends':'mean','#bogos':sum,'#discounts':sum}).reset_index()
+
+    # The histograms are binned here once, so the page carries one bar per bin instead of
+    # one value per customer for the browser to bin
+    histograms = {column: bin_values(df[column], HISTOGRAM_BINS[column]) for column in ['age', 'income']}
+
+    return {'value_counts': value_counts, 'count_counts': count_counts, 'spends_by_gender': spends_by_gender,
+            'histograms': histograms}
+
+
+def histogram_bar(edges, counts):
+    '''
+    INPUT
+    edges - array of the bin edges
+    counts - array of the number of values per bin
+
+    OUTPUT
+    bar - plotly bar trace drawing the bins like a histogram
+    '''
+    return Bar(
+        x=((edges[:-1] + edges[1:]) / 2).tolist(),
+        y=counts.tolist(),
+        width=float(edges[1] - edges[0]) if len(edges) > 1 else None,
+        hovertext=['{:g} - {:g}'.format(low, high) for low, high in zip(edges[:-1], edges[1:])]
+    )
+
+
+def build_graphs(aggregates):
+    '''
+    INPUT
+    aggregates - dictionary returned by compute_aggregates
+
+    OUTPUT
+    graphs - list of plotly figures shown on the dashboard
+    '''
+    value_counts = aggregates['value_counts']
+    value_names = ['Discount','Bogo','Informational','No Offer']
+
+    count_counts = aggregates['count_counts']
     count_names = ['Discount','Bogo','Informational','No Offer']
 
-    df['offer_spends']=df['transaction_discount_value']+df['transaction_bogo_value']+df['transaction_informational_value']
-    df['total_spends']=df['offer_spends']+df['transaction_no_offer_value']
-    spends_by_gender=df.groupby(['gender']).agg({'total_spends':'mean','#bogos':sum,'#discounts':sum}).reset_index()
+    spends_by_gender = aggregates['spends_by_gender']
+
+    age_edges, age_counts = aggregates['histograms']['age']
+    income_edges, income_counts = aggregates['histograms']['income']
 
     graphs = [
         {
             'data': [
-                Histogram(
-                    x=df['age']
-                )
+                histogram_bar(age_edges, age_counts)
             ],
 
             'layout': {
-                'title': 'Age distribution of Starbucks customers'
+                'title': 'Age distribution of Starbucks customers',
+                'bargap': 0
             }
         },
         {
             'data': [
-                Histogram(
-                    x=df['income']
-                )
+                histogram_bar(income_edges, income_counts)
             ],
 
             'layout': {
-                'title': 'Income distribution of Starbucks customers'
+                'title': 'Income distribution of Starbucks customers',
+                'bargap': 0
             }
         },
         {
@@ -136,15 +281,144 @@ def index():
         }
     ]
 
-    # encode plotly graphs in JSON
-    ids = ["graph-{}".format(i) for i, _ in enumerate(graphs)]
-    graphJSON = json.dumps(graphs, cls=plotly.utils.PlotlyJSONEncoder)
-    
-    # render web page with plotly graphs
-    return render_template('master.html', ids=ids, graphJSON=graphJSON)
+    return graphs
+
+
+class ServingState:
+    '''
+    Classifiers, dashboard and prediction cache of one app. Nothing is loaded until the
+    first request needs it, or until preload is called by a server which loads everything
+    once before forking its workers so they share the pages copy on write. The classifiers
+    and the dashboard are reloaded when their files change.
+    '''
+
+    def __init__(self, config, logger=None):
+        '''
+        INPUT
+        config - the Flask config with the STARBUCKS_* settings
+        logger - logger of the app
+        '''
+        self.model_filepath = config['STARBUCKS_MODEL']
+        self.data_filepath = config['STARBUCKS_DATA']
+        self.propensity_dirpath = config['STARBUCKS_PROPENSITY']
+        self.logger = logger
+
+        # Loaded classifiers and rendered dashboard of the file versions they were read from,
+        # each replaced as a whole on reload
+        self.model_state = {'version': None, 'models': None, 'encoder': None}
+        self.model_lock = threading.Lock()
+        self.dashboard = {'version': None, 'ids': [], 'graphJSON': '[]', 'etag': None, 'pages': {}}
+        self.dashboard_lock = threading.Lock()
+
+        # Predictions of /go keyed on the encoded profile, dropped when the classifiers change
+        self.prediction_cache = PredictionCache(maxsize=config['STARBUCKS_CACHE_SIZE'],
+                                                ttl=config['STARBUCKS_CACHE_TTL'],
+                                                store_filepath=config['STARBUCKS_CACHE_DB'])
+
+        # Filtered dashboard aggregates keyed on the normalised filters, dropped when the data changes
+        self.aggregates_cache = PredictionCache(maxsize=config['STARBUCKS_AGGREGATES_CACHE_SIZE'],
+                                                ttl=config['STARBUCKS_CACHE_TTL'])
+
+    def get_models(self):
+        '''
+        INPUT
+        NONE
 
+        OUTPUT
+        model_state - dictionary with the version, the classifiers and the encoder
 
-@app.route('/go')
+        Reloads the classifiers when the model file changed since they were loaded.
+        '''
+        version = get_model_version(self.model_filepath)
+        if self.model_state['version'] != version:
+            with self.model_lock:
+                if self.model_state['version'] != version:
+                    models, encoder = load_served_models(self.model_filepath, self.propensity_dirpath, self.logger)
+                    self.model_state = {'version': version, 'models': models, 'encoder': encoder}
+
+        return self.model_state
+
+    def get_dashboard(self):
+        '''
+        INPUT
+        NONE
+
+        OUTPUT
+        dashboard - dictionary with the graph ids, the plotly graphs encoded as JSON, their
+                    ETag and the rendered pages per content encoding
+
+        This function does the following:
+        1. Returns the cached dashboard while the data files are unchanged
+        2. Otherwise reloads the data, recomputes the aggregates and encodes the graphs once
+        '''
+        version = get_data_version(self.data_filepath)
+        if self.dashboard['version'] != version:
+            with self.dashboard_lock:
+                if self.dashboard['version'] != version:
+                    df = load_data(self.data_filepath)
+                    graphs = build_graphs(compute_aggregates(df))
+
+                    # encode plotly graphs in JSON
+                    ids = ["graph-{}".format(i) for i, _ in enumerate(graphs)]
+                    graphJSON = json.dumps(graphs, cls=plotly.utils.PlotlyJSONEncoder)
+                    etag = hashlib.sha1(graphJSON.encode()).hexdigest()
+                    self.dashboard = {'version': version, 'ids': ids, 'graphJSON': graphJSON, 'etag': etag,
+                                      'pages': {}}
+
+        return self.dashboard
+
+    def get_aggregates(self, filters, bins):
+        '''
+        INPUT
+        filters - dictionary of column to the genders or the bounds, see aggregates.parse_filters
+        bins - dictionary of histogram column to its bin width
+
+        OUTPUT
+        aggregates - dictionary of the aggregates of the filtered customer profiles
+        '''
+        key = (tuple(sorted(filters.items())), tuple(sorted(bins.items())))
+        return self.aggregates_cache.get(key, get_data_version(self.data_filepath),
+                                         lambda: query_aggregates(self.data_filepath, filters, bins))
+
+    def preload(self):
+        '''
+        Loads the classifiers and renders the dashboard ahead of the first request.
+        '''
+        self.get_models()
+        self.get_dashboard()
+
+
+def get_state():
+    # Serving state of the app handling the current request
+    return current_app.extensions['starbucks']
+
+
+@views.route('/')
+@views.route('/index')
+def index():
+    current = get_state().get_dashboard()
+    encoding = 'gzip' if 'gzip' in request.accept_encodings else 'identity'
+
+    # render web page with plotly graphs, once per dashboard and content encoding
+    page = current['pages'].get(encoding)
+    if page is None:
+        page = render_template('master.html', ids=current['ids'], graphJSON=current['graphJSON']).encode()
+        if encoding == 'gzip':
+            page = gzip.compress(page, compresslevel=6)
+        current['pages'][encoding] = page
+
+    # The ETag changes with the graphs, so a repeat visit revalidates and gets a 304 without a body
+    response = make_response(page)
+    response.content_type = 'text/html; charset=utf-8'
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    if encoding == 'gzip':
+        response.content_encoding = 'gzip'
+    response.set_etag('{}-{}'.format(current['etag'], encoding))
+    return response.make_conditional(request)
+
+
+@views.route('/go')
 def go():
     # save user input in query
     gender = request.args.get('gender', '')
@@ -152,34 +426,24 @@ def go():
     income = request.args.get('income', '')
     since = request.args.get('since', '')
 
-    #print(gender)
-    #print(age)
-    #print(income)
-    #print(since)
-    gm=0
-    go=1
-
-    if gender=='male':
-        gm=1
-        go=0
-    elif gender=='female':
-        gm=0
-        go=0
-    df=pd.DataFrame([{'age':age,'income':income,'customer_since':since,'gender_M':gm,'gender_O':go}])
-
-    #print(df)
+    # An empty or non numeric value would reach the classifiers as NaN
+    numbers = parse_numbers(age=age, income=income, since=since)
+    if numbers is None:
+        return Response('age, income and since must be numbers', status=400, mimetype='text/plain')
+
+    state = get_state()
+    current = state.get_models()
+    features = build_profile_features(gender, *numbers, encoder=current['encoder'])
+
     # use model to predict classification for query
-    classification_labels={}
-    for k,v in models.items():
-        label = v.predict(df)[0]
-        if label=='yes':
-            prob= round(max(v.predict_proba(df)[0])*100,1)
-        else:
-            prob= round(100-max(v.predict_proba(df)[0])*100,1)
-        classification_labels[k] = {'label':label,'prob':prob}
-        print(label)
-        print(prob)
-        #classification_results = dict(zip(df.columns[4:], classification_labels))
+    def predict():
+        classification_labels={}
+        for k,(labels,probs) in score_features(current['models'], features).items():
+            classification_labels[k] = {'label':str(labels[0]),'prob':float(probs[0])}
+        return classification_labels
+
+    # The encoded features are the cache key, so 'male' and 'M' or '40' and '40.0' share an entry
+    classification_labels = state.prediction_cache.get(tuple(features[0].tolist()), current['version'], predict)
 
     # This will render the go.html Please see that file. 
     return render_template(
@@ -188,6 +452,120 @@ def go():
         classification_result=classification_labels
     )
 
+
+@views.route('/api/predict/batch', methods=['POST'])
+def predict_batch():
+    '''
+    Scores many profiles at once. The profiles are posted as a JSON array of objects,
+    as a CSV request body or as a CSV file upload named file, each with gender, age,
+    income and since (or customer_since) fields. The profiles are returned with an
+    <offer>_label and <offer>_prob field per offer type, streamed as a JSON array for
+    JSON input and as CSV otherwise.
+    '''
+    if 'file' in request.files:
+        profiles = pd.read_csv(request.files['file'])
+        output = 'csv'
+    elif request.mimetype == 'text/csv':
+        profiles = pd.read_csv(io.BytesIO(request.get_data()))
+        output = 'csv'
+    elif request.is_json and isinstance(request.get_json(silent=True), list):
+        profiles = pd.DataFrame(request.get_json())
+        output = 'json'
+    else:
+        return jsonify({'error': 'expected a JSON array of profiles or a CSV upload'}), 400
+
+    if len(profiles) == 0 and output == 'json':
+        return jsonify([])
+
+    missing = check_profiles(profiles)
+    if missing:
+        return jsonify({'error': 'missing profile fields: {}'.format(', '.join(missing))}), 400
+    # Bad values are rejected before the response starts, a streamed response can not turn into an error
+    profiles, invalid = coerce_profiles(profiles)
+    if invalid:
+        return jsonify({'error': 'age, income and since must be numbers in every profile',
+                        'invalid_rows': invalid[:MAX_INVALID_ROWS], 'invalid_count': len(invalid)}), 400
+
+    current = get_state().get_models()
+
+    def generate_csv():
+        for i, scored in enumerate(iter_scored_profiles(current['models'], profiles, encoder=current['encoder'])):
+            yield scored.to_csv(index=False, header=(i == 0))
+
+    def generate_json():
+        yield '['
+        for i, scored in enumerate(iter_scored_profiles(current['models'], profiles, encoder=current['encoder'])):
+            records = scored.to_json(orient='records')[1:-1]
+            if records:
+                yield (',' if i > 0 else '') + records
+        yield ']'
+
+    if output == 'csv':
+        return Response(stream_with_context(generate_csv()), mimetype='text/csv')
+    return Response(stream_with_context(generate_json()), mimetype='application/json')
+
+@views.route('/api/aggregates')
+def aggregates():
+    '''
+    Returns the dashboard aggregates of a slice of the customers. The optional gender
+    parameter takes comma separated genders, and the age, income and since (membership
+    days) parameters take inclusive ranges such as 30-40 or 50000-. The histogram bin
+    widths are set with age_bin and income_bin. The filters and aggregations run in
+    SQLite (or in the parquet reader), and the results are cached until the data changes.
+    '''
+    try:
+        filters, bins = parse_filters(request.args)
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+
+    return jsonify(get_state().get_aggregates(filters, bins))
+
+
+@views.route('/api/cache/stats')
+def cache_stats():
+    '''
+    Returns the hit and miss counters and the sizes of the /go prediction cache and of the
+    dashboard aggregates cache.
+    '''
+    state = get_state()
+    return jsonify({'predictions': state.prediction_cache.stats(), 'aggregates': state.aggregates_cache.stats()})
+
+
+def create_app(config=None, preload=False):
+    '''
+    INPUT
+    config - optional dictionary of settings overriding the environment: STARBUCKS_MODEL,
+             STARBUCKS_DATA, STARBUCKS_PROPENSITY, STARBUCKS_CACHE_SIZE, STARBUCKS_CACHE_TTL,
+             STARBUCKS_CACHE_DB and STARBUCKS_AGGREGATES_CACHE_SIZE
+    preload - load the classifiers and the dashboard now instead of on the first request
+
+    OUTPUT
+    app - the Flask app
+
+    WSGI servers can call the factory directly, for example
+    gunicorn --preload -w 4 -b 0.0.0.0:3001 'app:create_app(preload=True)'
+    '''
+    app = Flask(__name__)
+    app.config.update(STARBUCKS_MODEL=os.environ.get('STARBUCKS_MODEL', DEFAULT_MODEL_FILEPATH),
+                      STARBUCKS_DATA=os.environ.get('STARBUCKS_DATA', DEFAULT_DATA_FILEPATH),
+                      STARBUCKS_PROPENSITY=os.environ.get('STARBUCKS_PROPENSITY'),
+                      STARBUCKS_CACHE_SIZE=int(os.environ.get('STARBUCKS_CACHE_SIZE', 4096)),
+                      STARBUCKS_CACHE_TTL=float(os.environ.get('STARBUCKS_CACHE_TTL', 3600)),
+                      STARBUCKS_CACHE_DB=os.environ.get('STARBUCKS_CACHE_DB'),
+                      STARBUCKS_AGGREGATES_CACHE_SIZE=int(os.environ.get('STARBUCKS_AGGREGATES_CACHE_SIZE', 256)))
+    app.config.update(config or {})
+
+    app.extensions['starbucks'] = ServingState(app.config, app.logger)
+    app.register_blueprint(views)
+    if preload:
+        app.extensions['starbucks'].preload()
+    return app
+
+
+# Nothing is loaded until the first request, see create_app for the production servers
+app = create_app()
+
+
 def main():
     app.run(host='0.0.0.0', port=3001, debug=True)
 
@@ -0,0 +1,195 @@
+import os
+import json
+import asyncio
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from app import create_app
+from scoring import score_features, get_profile_values, parse_numbers
+
+# Largest number of /go requests scored with one predict_proba call per model
+MAX_BATCH_SIZE = int(os.environ.get('STARBUCKS_BATCH_SIZE', 64))
+
+# Longest time in milliseconds a request waits for others to share its batch
+MAX_LATENCY_MS = float(os.environ.get('STARBUCKS_BATCH_LATENCY_MS', 5))
+
+
+class MicroBatcher:
+    '''
+    Collects the profiles of concurrent requests and scores them together. A batch is
+    scored when it is full or when its first profile waited max_latency seconds. The
+    scoring runs on one background thread, and profiles arriving meanwhile gather
+    into the next batch, so the event loop never blocks on the classifiers.
+    '''
+
+    def __init__(self, state, max_batch_size=MAX_BATCH_SIZE, max_latency=MAX_LATENCY_MS / 1000):
+        '''
+        INPUT
+        state - ServingState of the Flask app with the classifiers
+        max_batch_size - largest number of profiles scored at once
+        max_latency - seconds the first profile of a batch waits for more profiles
+        '''
+        self.state = state
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = []
+        self.timer = None
+        self.batches = 0
+        self.profiles = 0
+
+    async def score(self, profile):
+        '''
+        INPUT
+        profile - dictionary of the encoder columns to the values of one customer, see
+                  scoring.get_profile_values
+
+        OUTPUT
+        classification - dictionary of offer type to its label and probability in percent
+        '''
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((profile, future))
+        if len(self.pending) >= self.max_batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_latency, self.flush)
+        return await future
+
+    def flush(self):
+        # Hands the pending profiles to the scoring thread as one batch
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            asyncio.ensure_future(self.run_batch(batch))
+
+    async def run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, self.score_batch, [profile for profile, _ in batch])
+        except Exception as error:
+            results = [error] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def score_batch(self, profiles):
+        '''
+        INPUT
+        profiles - list of profile dictionaries
+
+        OUTPUT
+        results - list of classification dictionaries in the order of the profiles, or of
+                  the exception of a profile which could not be encoded
+
+        Encodes every profile into its row of one array with the encoder of the current
+        classifiers and runs predict_proba once per model for the whole batch. A profile
+        which does not encode to finite features fails on its own, the others of the
+        batch are still scored.
+        '''
+        current = self.state.get_models()
+        encoder = current['encoder']
+        features = np.empty((len(profiles), len(encoder.feature_names)), dtype='float64')
+        results = [None] * len(profiles)
+        for i, profile in enumerate(profiles):
+            try:
+                encoder.transform_row(profile, out=features[i:i + 1])
+                if not np.isfinite(features[i]).all():
+                    raise ValueError('profile {} has a missing or non numeric value'.format(profile))
+            except Exception as error:
+                results[i] = error
+
+        valid = [i for i, result in enumerate(results) if result is None]
+        if valid:
+            scores = score_features(current['models'], features[valid])
+            for j, i in enumerate(valid):
+                results[i] = {offer: {'label': str(labels[j]), 'prob': float(probs[j])}
+                              for offer, (labels, probs) in scores.items()}
+        self.batches += 1
+        self.profiles += len(profiles)
+        return results
+
+
+class ScoringApp:
+    '''
+    ASGI app serving /go and /api/predict with micro batched scoring. The dashboard and
+    the other routes stay with the Flask app, whose classifiers and templates it shares.
+    Run it with any ASGI server, for example uvicorn asgi:app --workers 4
+    '''
+
+    def __init__(self, flask_app, max_batch_size=MAX_BATCH_SIZE, max_latency=MAX_LATENCY_MS / 1000):
+        '''
+        INPUT
+        flask_app - Flask app returned by create_app
+        max_batch_size - largest number of profiles scored at once
+        max_latency - seconds the first profile of a batch waits for more profiles
+        '''
+        self.flask_app = flask_app
+        self.state = flask_app.extensions['starbucks']
+        self.batcher = MicroBatcher(self.state, max_batch_size, max_latency)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        query = {key: values[0] for key, values in parse_qs(scope['query_string'].decode()).items()}
+        gender, age, income, since = [query.get(field, '') for field in ['gender', 'age', 'income', 'since']]
+        if scope['path'] in ['/go', '/api/predict']:
+            numbers = parse_numbers(age=age, income=income, since=since)
+            if numbers is None:
+                error = 'age, income and since must be numbers'
+                if scope['path'] == '/go':
+                    await self.respond(send, 400, 'text/plain', error)
+                else:
+                    await self.respond(send, 400, 'application/json', json.dumps({'error': error}))
+                return
+            profile = get_profile_values(gender, *numbers)
+
+        if scope['path'] == '/go':
+            classification = await self.batcher.score(profile)
+            body = self.flask_app.jinja_env.get_template('go.html').render(
+                profile={'age': age, 'income': income, 'customer_since': since, 'gender': gender},
+                classification_result=classification)
+            await self.respond(send, 200, 'text/html; charset=utf-8', body)
+        elif scope['path'] == '/api/predict':
+            classification = await self.batcher.score(profile)
+            await self.respond(send, 200, 'application/json', json.dumps(classification))
+        elif scope['path'] == '/api/batching/stats':
+            stats = {'batches': self.batcher.batches, 'profiles': self.batcher.profiles,
+                     'max_batch_size': self.batcher.max_batch_size, 'max_latency': self.batcher.max_latency}
+            await self.respond(send, 200, 'application/json', json.dumps(stats))
+        else:
+            await self.respond(send, 404, 'text/plain', 'Not Found')
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Loads the classifiers before the first request instead of during it
+                await asyncio.get_running_loop().run_in_executor(None, self.state.get_models)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.batcher.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def respond(send, status, content_type, body):
+        body = body.encode()
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', content_type.encode()),
+                                (b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+
+app = ScoringApp(create_app())
@@ -0,0 +1,98 @@
+import numpy as np
+
+
+class CompactModel:
+    '''
+    Numpy predictor for a classifier exported by model/export_models.py. It offers the
+    classes_ and predict_proba/predict interface of the sklearn models it replaces.
+    '''
+
+    def __init__(self, arrays):
+        '''
+        INPUT
+        arrays - dictionary of the exported numpy arrays of one model
+        '''
+        self.kind = str(arrays['kind'])
+        self.classes_ = arrays['classes']
+        self.feature_names_in_ = arrays['features']
+        if self.kind == 'trees':
+            self.roots = arrays['roots']
+            self.left = arrays['left']
+            self.right = arrays['right']
+            self.feature = arrays['feature']
+            self.threshold = arrays['threshold']
+            self.proba = arrays['proba']
+            self.depth = int(arrays['depth'])
+        elif self.kind == 'linear':
+            self.coef = arrays['coef']
+            self.intercept = arrays['intercept']
+        else:
+            raise ValueError('Unknown compact model kind: {}'.format(self.kind))
+
+    def _matrix(self, X):
+        # Reorder dataframe columns to the training layout, arrays are taken as they are
+        if hasattr(X, 'columns'):
+            X = X[list(self.feature_names_in_)]
+        return np.asarray(X, dtype='float64')
+
+    def predict_proba(self, X):
+        '''
+        INPUT
+        X - pandas dataframe or 2d array of features in the training layout
+
+        OUTPUT
+        proba - 2d array of class probabilities in the order of classes_
+        '''
+        X = self._matrix(X)
+
+        if self.kind == 'linear':
+            decision = X @ self.coef.T + self.intercept
+            if decision.shape[1] == 1:
+                positive = 1 / (1 + np.exp(-decision[:, 0]))
+                return np.column_stack([1 - positive, positive])
+            decision = np.exp(decision - decision.max(axis=1, keepdims=True))
+            return decision / decision.sum(axis=1, keepdims=True)
+
+        # The sklearn trees compare float32 feature values against the thresholds
+        X = X.astype('float32')
+        n_trees = len(self.roots)
+        node = np.tile(self.roots, len(X))
+        row = np.repeat(np.arange(len(X)), n_trees)
+        # Every (row, tree) pair descends one level per step, pairs which reached a leaf drop out
+        active = np.arange(len(node))
+        for _ in range(self.depth):
+            current = node[active]
+            left = self.left[current]
+            inner = left >= 0
+            active, current, left = active[inner], current[inner], left[inner]
+            if len(active) == 0:
+                break
+            go_left = X[row[active], self.feature[current]] <= self.threshold[current]
+            node[active] = np.where(go_left, left, self.right[current])
+        return self.proba[node].reshape(len(X), n_trees, -1).mean(axis=1)
+
+    def predict(self, X):
+        '''
+        INPUT
+        X - pandas dataframe or 2d array of features in the training layout
+
+        OUTPUT
+        labels - array of the most probable class of every row
+        '''
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+def load_compact_models(export_filepath):
+    '''
+    INPUT
+    export_filepath - npz file written by model/export_models.py
+
+    OUTPUT
+    models - dictionary of offer type to CompactModel
+    '''
+    grouped = {}
+    with np.load(export_filepath, allow_pickle=False) as arrays:
+        for key in arrays.files:
+            offer, name = key.split('/', 1)
+            grouped.setdefault(offer, {})[name] = arrays[key]
+    return {offer: CompactModel(model_arrays) for offer, model_arrays in grouped.items()}
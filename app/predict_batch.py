@@ -0,0 +1,58 @@
+import sys
+import pandas as pd
+
+from scoring import BATCH_SIZE, iter_scored_profiles, check_profiles, coerce_profiles, load_models
+
+
+def load_profiles(profiles_filepath):
+    '''
+    INPUT
+    profiles_filepath - CSV file, JSON array file or line delimited JSON file of profiles
+
+    OUTPUT
+    profiles - pandas dataframe of the profiles to score
+    '''
+    if profiles_filepath.endswith('.csv'):
+        return pd.read_csv(profiles_filepath)
+    with open(profiles_filepath) as file:
+        lines = file.read(64).lstrip()[:1] != '['
+    return pd.read_json(profiles_filepath, orient='records', lines=lines)
+
+
+def main():
+    if len(sys.argv) in (4, 5):
+        model_filepath, profiles_filepath, output_filepath = sys.argv[1:4]
+        batch_size = int(sys.argv[4]) if len(sys.argv) == 5 else BATCH_SIZE
+
+        print('Loading model...\n    MODEL: {}'.format(model_filepath))
+        models, encoder = load_models(model_filepath)
+
+        print('Loading profiles...\n    PROFILES: {}'.format(profiles_filepath))
+        profiles = load_profiles(profiles_filepath)
+        missing = check_profiles(profiles)
+        if missing:
+            print('Missing profile fields: {}'.format(', '.join(missing)))
+            sys.exit(1)
+        profiles, invalid = coerce_profiles(profiles)
+        if invalid:
+            print('{} profiles have a missing or non numeric age, income or since, such as rows {}'
+                  .format(len(invalid), ', '.join(map(str, invalid[:10]))))
+            sys.exit(1)
+
+        print('Scoring {} profiles...'.format(len(profiles)))
+        with open(output_filepath, 'w', newline='') as file:
+            for i, scored in enumerate(iter_scored_profiles(models, profiles, batch_size, encoder)):
+                scored.to_csv(file, index=False, header=(i == 0))
+
+        print('Scores saved to {}'.format(output_filepath))
+
+    else:
+        print('Please provide the filepath of the classifiers pickle as the first argument, '\
+              'the filepath of the profiles to score (CSV or JSON with gender, age, income '\
+              'and since columns) as the second argument and the filepath of the output CSV '\
+              'as the third argument, optionally followed by the batch size. \n\nExample: '\
+              'python predict_batch.py ../model/classifiers.pkl profiles.csv scores.csv')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Seconds between two deletions of the expired predictions of the shared store by one process
+PURGE_INTERVAL = 60
+
+
+class PredictionCache:
+    '''
+    LRU cache with a time to live for the predictions of single profiles. Entries belong to
+    the version of the classifiers which computed them and the whole cache is dropped when
+    another version asks for a prediction. The optional SQLite store lets the worker
+    processes of one server share their predictions.
+    '''
+
+    def __init__(self, maxsize=4096, ttl=3600, store_filepath=None):
+        '''
+        INPUT
+        maxsize - maximum number of predictions held in memory, 0 disables the cache
+        ttl - seconds a prediction stays valid
+        store_filepath - optional SQLite database shared by the worker processes
+        '''
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.store_filepath = store_filepath
+        self.entries = OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.next_purge = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        # sqlite3 connections can not be shared between threads, every thread opens its own
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.store_filepath, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute('CREATE TABLE IF NOT EXISTS predictions '
+                               '(key TEXT PRIMARY KEY, version TEXT, expires REAL, value TEXT)')
+            self.local.connection = connection
+        return connection
+
+    def _check_version(self, version):
+        # Called with the lock held, drops the predictions of other classifiers
+        if version != self.version:
+            self.entries.clear()
+            if self.store_filepath and self.version is not None:
+                with self._connect() as connection:
+                    connection.execute('DELETE FROM predictions WHERE version != ?', (str(version),))
+            self.version = version
+
+    def _store(self, key, version, value, expires):
+        # Called with the lock held, adds the prediction and evicts the least recently used
+        self._check_version(version)
+        self.entries[key] = (expires, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def get(self, key, version, compute):
+        '''
+        INPUT
+        key - tuple of the normalised inputs of the prediction
+        version - version of the classifiers, such as the modification time of the pickle
+        compute - function without arguments returning the JSON serialisable prediction
+
+        OUTPUT
+        value - the cached or the computed prediction
+
+        This function does the following:
+        1. Returns the in memory prediction of the key while it is not expired
+        2. Otherwise returns the prediction of the shared store, if one is configured
+        3. Otherwise computes the prediction and stores it in memory and in the shared store
+        '''
+        if self.maxsize <= 0:
+            return compute()
+
+        now = time.time()
+        with self.lock:
+            self._check_version(version)
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        shared = self._get_shared(key, version, now)
+        if shared is not None:
+            value, expires = shared
+            with self.lock:
+                self.shared_hits += 1
+                self._store(key, version, value, expires)
+            return value
+
+        value = compute()
+        if self.store_filepath:
+            with self._connect() as connection:
+                connection.execute('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)',
+                                   (json.dumps(key), str(version), now + self.ttl, json.dumps(value)))
+                # Expired rows are skipped on read, without the purge the store would keep growing
+                if now >= self.next_purge:
+                    self.next_purge = now + PURGE_INTERVAL
+                    connection.execute('DELETE FROM predictions WHERE expires <= ?', (now,))
+        with self.lock:
+            self.misses += 1
+            self._store(key, version, value, now + self.ttl)
+        return value
+
+    def _get_shared(self, key, version, now):
+        # Returns the unexpired prediction of the shared store with its expiry time
+        if not self.store_filepath:
+            return None
+        row = self._connect().execute('SELECT expires, value FROM predictions WHERE key = ? AND version = ?',
+                                      (json.dumps(key), str(version))).fetchone()
+        if row is None or row[0] <= now:
+            return None
+        return json.loads(row[1]), row[0]
+
+    def stats(self):
+        '''
+        OUTPUT
+        stats - dictionary with the hit and miss counters and the size of the cache
+        '''
+        with self.lock:
+            return {'hits': self.hits, 'shared_hits': self.shared_hits, 'misses': self.misses,
+                    'size': len(self.entries), 'maxsize': self.maxsize, 'ttl': self.ttl,
+                    'shared': bool(self.store_filepath)}
@@ -0,0 +1,294 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'model'))
+from scoring import iter_model_proba, score_proba, load_models
+from feature_cache import hash_files
+
+
+# Range of every numeric feature covered by the table as (first value, last value, step)
+DEFAULT_RANGES = {'age': (18, 101, 1), 'income': (30000, 120000, 1000), 'customer_since': (0, 1830, 10)}
+
+# Grid cells scored with one predict_proba call per model while the table is built
+BUILD_BATCH_SIZE = 100000
+
+
+class PropensityTable:
+    '''
+    Class probabilities of every offer type precomputed over a grid of the encoded features.
+    Every numeric feature is an axis of evenly spaced values and every categorical feature
+    an axis of its categories. The probabilities of a grid cell are stored per offer type in
+    a memory mapped .npy file, so a lookup is an index computation and the worker processes
+    of a server share the pages of the table.
+    '''
+
+    def __init__(self, meta, proba):
+        '''
+        INPUT
+        meta - dictionary with the axes, the offer types and their classes (see meta.json)
+        proba - dictionary of offer type to the 2d array of class probabilities per grid cell
+        '''
+        self.meta = meta
+        self.proba = proba
+        self.feature_names = meta['feature_names']
+        self.numeric_axes = meta['numeric_axes']
+        self.categorical_axes = meta['categorical_axes']
+        self.shape = tuple([axis['count'] for axis in self.numeric_axes] +
+                           [len(axis['categories']) for axis in self.categorical_axes])
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def cell_features(self, cells):
+        '''
+        INPUT
+        cells - array of flat grid cell indexes
+
+        OUTPUT
+        features - float64 array of the encoded features of the grid cells
+        '''
+        index = np.unravel_index(cells, self.shape)
+        features = np.zeros((len(cells), len(self.feature_names)), dtype='float64')
+        for axis, axis_index in zip(self.numeric_axes, index):
+            features[:, self.feature_names.index(axis['column'])] = axis['start'] + axis_index * axis['step']
+        for axis, axis_index in zip(self.categorical_axes, index[len(self.numeric_axes):]):
+            for k, category in enumerate(axis['categories'][1:]):
+                features[:, self.feature_names.index('{}_{}'.format(axis['column'], category))] = axis_index == k + 1
+        return features
+
+    def locate(self, features):
+        '''
+        INPUT
+        features - 2d array of encoded features in the layout of the table
+
+        OUTPUT
+        cells - array of the flat index of the nearest grid cell of every row
+        inside - boolean array, False for rows outside of the grid or with missing values
+        '''
+        features = np.asarray(features, dtype='float64')
+        index = []
+        inside = np.ones(len(features), dtype=bool)
+        for axis in self.numeric_axes:
+            values = features[:, self.feature_names.index(axis['column'])]
+            with np.errstate(invalid='ignore'):
+                position = np.rint((values - axis['start']) / axis['step'])
+                inside &= (position >= 0) & (position < axis['count'])
+            index.append(np.where(inside, position, 0).astype('int64'))
+        for axis in self.categorical_axes:
+            columns = [self.feature_names.index('{}_{}'.format(axis['column'], category))
+                       for category in axis['categories'][1:]]
+            dummies = features[:, columns]
+            # All dummies zero is the first category, like pd.get_dummies(drop_first=True)
+            index.append(np.where(dummies.any(axis=1), dummies.argmax(axis=1) + 1, 0))
+        cells = np.ravel_multi_index(index, self.shape)
+        return cells, inside
+
+    def wrap(self, models):
+        '''
+        INPUT
+        models - dictionary of offer type (or tuple of offer types) to the classifiers the
+                 table was built from
+
+        OUTPUT
+        models - dictionary of offer type to PropensityModel answering from the table
+        '''
+        wrapped = {}
+        for offers, model in models.items():
+            if isinstance(offers, tuple):
+                for output, offer in enumerate(offers):
+                    wrapped[offer] = PropensityModel(self, offer, model, output)
+            else:
+                wrapped[offers] = PropensityModel(self, offers, model)
+        return wrapped
+
+    @classmethod
+    def load(cls, table_dirpath):
+        '''
+        INPUT
+        table_dirpath - directory written by build_propensity_table
+
+        OUTPUT
+        table - PropensityTable with memory mapped probabilities
+        '''
+        with open(os.path.join(table_dirpath, 'meta.json')) as file:
+            meta = json.load(file)
+        proba = {offer: np.load(os.path.join(table_dirpath, offer + '.npy'), mmap_mode='r')
+                 for offer in meta['offers']}
+        return cls(meta, proba)
+
+
+class PropensityModel:
+    '''
+    Classifier interface (classes_, feature_names_in_, predict_proba) of one offer type of a
+    PropensityTable. Rows outside of the grid are scored by the classifier the table was
+    built from.
+    '''
+
+    def __init__(self, table, offer, fallback, output=None):
+        '''
+        INPUT
+        table - the PropensityTable
+        offer - offer type answered by the model
+        fallback - classifier the table was built from
+        output - offer type position when the fallback predicts several offer types
+        '''
+        self.table = table
+        self.offer = offer
+        self.fallback = fallback
+        self.output = output
+        self.classes_ = np.asarray(table.meta['offers'][offer])
+        self.feature_names_in_ = np.asarray(table.feature_names)
+
+    def predict_proba(self, X):
+        '''
+        INPUT
+        X - 2d array of encoded features
+
+        OUTPUT
+        proba - 2d array of class probabilities in the order of classes_
+        '''
+        X = np.asarray(X, dtype='float64')
+        cells, inside = self.table.locate(X)
+        proba = np.asarray(self.table.proba[self.offer][cells])
+        if not inside.all():
+            outside = self.fallback.predict_proba(X[~inside])
+            proba[~inside] = outside if self.output is None else outside[self.output]
+        return proba
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+def build_propensity_table(models, encoder, ranges, table_dirpath, model_sha256):
+    '''
+    INPUT
+    models - dictionary of offer type (or tuple of offer types) to trained classifier
+    encoder - the fitted feature encoder of the classifiers
+    ranges - dictionary of numeric feature to its (first value, last value, step) on the grid
+    table_dirpath - directory to write the table to
+    model_sha256 - hash of the model file, the app only uses the table with these classifiers
+
+    OUTPUT
+    table - the PropensityTable
+
+    This function does the following:
+    1. Lays out a grid over the numeric ranges and the categories of the encoder
+    2. Scores the grid cells in batches with the classifiers
+    3. Writes the class probabilities of every offer type as .npy files and the axes to meta.json
+    '''
+    os.makedirs(table_dirpath, exist_ok=True)
+    meta = {'feature_names': encoder.feature_names,
+            'numeric_axes': [{'column': column, 'start': ranges[column][0], 'step': ranges[column][2],
+                              'count': int((ranges[column][1] - ranges[column][0]) // ranges[column][2]) + 1}
+                             for column in encoder.numeric_columns],
+            'categorical_axes': [{'column': column, 'categories': categories}
+                                 for column, categories in encoder.categories.items()],
+            'offers': {},
+            'model_sha256': model_sha256}
+    table = PropensityTable(meta, {})
+
+    for start in range(0, table.size, BUILD_BATCH_SIZE):
+        cells = np.arange(start, min(start + BUILD_BATCH_SIZE, table.size))
+        for offer, proba, classes in iter_model_proba(models, table.cell_features(cells)):
+            if offer not in table.proba:
+                meta['offers'][offer] = [str(c) for c in classes]
+                table.proba[offer] = np.lib.format.open_memmap(os.path.join(table_dirpath, offer + '.npy'),
+                                                               mode='w+', dtype='float64',
+                                                               shape=(table.size, len(classes)))
+            table.proba[offer][cells] = proba
+
+    for proba in table.proba.values():
+        proba.flush()
+    with open(os.path.join(table_dirpath, 'meta.json'), 'w') as file:
+        json.dump(meta, file, indent=1)
+    return table
+
+
+def measure_error(table, models, encoder, n_samples, seed=42):
+    '''
+    INPUT
+    table - PropensityTable built from the models
+    models - dictionary of offer type (or tuple of offer types) to trained classifier
+    encoder - the fitted feature encoder of the classifiers
+    n_samples - number of random profiles to compare
+    seed - random seed
+
+    OUTPUT
+    error - dictionary of offer type to the maximum, 99th percentile and mean absolute
+            difference of the 'yes' probability in percentage points and the share of
+            different labels between the table and live inference
+
+    The profiles are drawn with whole numbers anywhere inside the ranges of the grid, so
+    they fall between the grid values unlike the cells the table was built from.
+    '''
+    rng = np.random.RandomState(seed)
+    columns = {axis['column']: rng.randint(int(axis['start']), int(axis['start'] + (axis['count'] - 1) * axis['step']) + 1,
+                                           n_samples)
+               for axis in table.numeric_axes}
+    for axis in table.categorical_axes:
+        columns[axis['column']] = rng.choice(axis['categories'], n_samples)
+    features = encoder.transform(columns, out=np.empty((n_samples, len(encoder.feature_names))))
+
+    live = {offer: score_proba(proba, classes) for offer, proba, classes in iter_model_proba(models, features)}
+    lookup = {offer: score_proba(proba, classes)
+              for offer, proba, classes in iter_model_proba(table.wrap(models), features)}
+    error = {}
+    for offer, (labels, probs) in live.items():
+        difference = np.abs(probs - lookup[offer][1])
+        error[offer] = {'max_abs_pct': float(difference.max()),
+                        'p99_abs_pct': float(np.percentile(difference, 99)),
+                        'mean_abs_pct': float(difference.mean()),
+                        'label_mismatch_rate': float(np.mean(labels != lookup[offer][0]))}
+    return error
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Precompute the offer propensities over a grid of the demographics',
+                                     epilog='Example: python propensity_table.py ../model/classifiers.pkl '
+                                            '../model/propensity --since-step 30')
+    parser.add_argument('model_filepath', help='classifiers pickle or their compact npz export')
+    parser.add_argument('table_dirpath', help='directory to write the table to')
+    for column, (first, last, step) in DEFAULT_RANGES.items():
+        # The membership days are called since like in the web form
+        option = '--' + column.replace('customer_', '')
+        parser.add_argument(option + '-range', dest=column + '_range', type=float, nargs=2, default=(first, last),
+                            metavar=('FIRST', 'LAST'), help='{} range of the grid (default: {} {})'.format(column, first, last))
+        parser.add_argument(option + '-step', dest=column + '_step', type=float, default=step,
+                            help='{} resolution of the grid (default: {})'.format(column, step))
+    parser.add_argument('--samples', type=int, default=10000,
+                        help='random profiles compared against live inference for the error bound (default: 10000)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    ranges = {column: tuple(getattr(args, column + '_range')) + (getattr(args, column + '_step'),)
+              for column in DEFAULT_RANGES}
+
+    print('Loading model...\n    MODEL: {}'.format(args.model_filepath))
+    models, encoder = load_models(args.model_filepath)
+
+    start = time.perf_counter()
+    table = build_propensity_table(models, encoder, ranges, args.table_dirpath,
+                                   hash_files([args.model_filepath]))
+    print('Scored {} grid cells in {:.1f}s\n    TABLE: {}'.format(table.size, time.perf_counter() - start,
+                                                               args.table_dirpath))
+
+    print('Comparing {} random profiles with live inference...'.format(args.samples))
+    table.meta['error'] = measure_error(table, models, encoder, args.samples)
+    for offer, error in table.meta['error'].items():
+        print('    {}: max {:.1f}, p99 {:.1f}, mean {:.2f} percentage points, {:.2%} labels differ'.format(
+            offer, error['max_abs_pct'], error['p99_abs_pct'], error['mean_abs_pct'], error['label_mismatch_rate']))
+    with open(os.path.join(args.table_dirpath, 'meta.json'), 'w') as file:
+        json.dump(table.meta, file, indent=1)
+
+    print('Propensity table saved!')
+
+
+if __name__ == '__main__':
+    main()
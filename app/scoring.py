@@ -0,0 +1,254 @@
+import os
+import sys
+import warnings
+import joblib
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'model'))
+from feature_encoder import FeatureEncoder, get_encoder_filepath
+from compact_models import load_compact_models
+
+
+# Encoder of the classifiers saved without their fitted encoder by older training runs
+DEFAULT_ENCODER = FeatureEncoder(['age', 'income', 'customer_since'], {'gender': ['F', 'M', 'O']})
+
+# Feature layout of the classifiers trained by train_classifiers.py
+FEATURE_COLUMNS = DEFAULT_ENCODER.feature_names
+
+# Gender values of the web form and of the profile data, anything else is other
+GENDERS = {'male': 'M', 'M': 'M', 'female': 'F', 'F': 'F'}
+
+# Number of profiles scored with one predict_proba call per model
+BATCH_SIZE = 10000
+
+# The encoded arrays are passed to the classifiers without column names, load_encoder
+# checks once that their layout is the one the classifiers were trained on
+warnings.filterwarnings('ignore', message='X does not have valid feature names')
+
+
+def load_encoder(model_filepath, models):
+    '''
+    INPUT
+    model_filepath - file path of the classifiers pickle or of their compact npz export
+    models - dictionary of offer type to the loaded classifier
+
+    OUTPUT
+    encoder - the FeatureEncoder saved next to the classifiers, or DEFAULT_ENCODER for
+              classifiers saved without one
+
+    Raises a ValueError when the classifiers were trained on another feature layout.
+    '''
+    encoder_filepath = get_encoder_filepath(model_filepath)
+    if os.path.exists(encoder_filepath):
+        encoder = FeatureEncoder.load(encoder_filepath)
+    else:
+        encoder = DEFAULT_ENCODER
+    encoder.check_models(models)
+    return encoder
+
+
+def load_models(model_filepath):
+    '''
+    INPUT
+    model_filepath - file path of the classifiers pickle or of their compact npz export
+
+    OUTPUT
+    models - dictionary of offer type to classifier
+    encoder - the fitted feature encoder of the classifiers
+    '''
+    # The compact npz export of the classifiers is served with the numpy predictor
+    if model_filepath.endswith('.npz'):
+        models = load_compact_models(model_filepath)
+    else:
+        models = joblib.load(model_filepath)
+
+    # Fitted feature encoder saved next to the classifiers, checked against their feature layout
+    return models, load_encoder(model_filepath, models)
+
+
+def build_features(profiles, encoder=DEFAULT_ENCODER):
+    '''
+    INPUT
+    profiles - pandas dataframe with gender, age, income and since (or customer_since) columns
+    encoder - FeatureEncoder of the classifiers
+
+    OUTPUT
+    features - float64 array with the feature layout used to train the classifiers
+
+    This function does the following:
+    1. Maps the gender values of the web form to the codes of the profile data
+    2. Lets the encoder write the numbers and the one hot encoded gender into one
+       preallocated array
+    '''
+    columns = {'gender': profiles['gender'].map(GENDERS).fillna('O'),
+               'age': profiles['age'],
+               'income': profiles['income'],
+               'customer_since': profiles['customer_since'] if 'customer_since' in profiles else profiles['since']}
+    features = np.empty((len(profiles), len(encoder.feature_names)), dtype='float64')
+    return encoder.transform(columns, out=features)
+
+
+def build_profile_features(gender, age, income, since, encoder=DEFAULT_ENCODER):
+    '''
+    INPUT
+    gender, age, income, since - the values of one customer as entered in the web form
+    encoder - FeatureEncoder of the classifiers
+
+    OUTPUT
+    features - float64 array of shape (1, number of features) for the classifiers
+    '''
+    return encoder.transform_row(get_profile_values(gender, age, income, since))
+
+
+def get_profile_values(gender, age, income, since):
+    '''
+    INPUT
+    gender, age, income, since - the values of one customer as entered in the web form
+
+    OUTPUT
+    values - dictionary of the encoder columns to the values of the customer
+    '''
+    return {'gender': GENDERS.get(gender, 'O'), 'age': age, 'income': income, 'customer_since': since}
+
+
+def parse_numbers(**values):
+    '''
+    INPUT
+    values - query parameter names to their string values, such as age='40'
+
+    OUTPUT
+    numbers - list of the values as floats in the given order, None if any of them is
+              missing, not a number or not finite
+    '''
+    try:
+        numbers = [float(value) for value in values.values()]
+    except ValueError:
+        return None
+    return numbers if np.isfinite(numbers).all() else None
+
+
+def score_features(models, features):
+    '''
+    INPUT
+    models - dictionary of offer type to trained classifier, or of a tuple of offer types
+             to one classifier fitted on all of them
+    features - array returned by build_features (or a dataframe in the training layout)
+
+    OUTPUT
+    scores - dictionary of offer type to a (labels, probs) tuple where probs is the
+             chance of a 'yes' in percent rounded to one decimal
+
+    Runs predict_proba once per model and takes the labels from the probabilities the
+    same way predict does, instead of running every model twice. A multi-output model
+    returns the probabilities of all its offer types from its single call.
+    '''
+    scores = {}
+    for offer, proba, classes in iter_model_proba(models, features):
+        scores[offer] = score_proba(proba, classes)
+    return scores
+
+
+def iter_model_proba(models, features):
+    '''
+    INPUT
+    models - dictionary of offer type (or tuple of offer types) to trained classifier
+    features - array returned by build_features (or a dataframe in the training layout)
+
+    OUTPUT
+    generator of (offer type, 2d array of class probabilities, classes) tuples
+    '''
+    for offers, model in models.items():
+        proba = model.predict_proba(features)
+        if isinstance(offers, tuple):
+            for offer, offer_proba, classes in zip(offers, proba, model.classes_):
+                yield offer, offer_proba, classes
+        else:
+            yield offers, proba, model.classes_
+
+
+def score_proba(proba, classes):
+    '''
+    INPUT
+    proba - 2d array of class probabilities of one offer type
+    classes - classes of the proba columns
+
+    OUTPUT
+    labels - array of the most probable class of every row
+    probs - chance of a 'yes' in percent rounded to one decimal
+    '''
+    classes = list(classes)
+    labels = np.asarray(classes)[proba.argmax(axis=1)]
+    yes = proba[:, classes.index('yes')] if 'yes' in classes else np.zeros(len(proba))
+    return labels, np.round(yes * 100, 1)
+
+
+def score_profiles(models, profiles, encoder=DEFAULT_ENCODER):
+    '''
+    INPUT
+    models - dictionary of offer type to trained classifier
+    profiles - pandas dataframe with gender, age, income and since (or customer_since) columns
+    encoder - FeatureEncoder of the classifiers
+
+    OUTPUT
+    scored - the profiles with an <offer>_label and <offer>_prob column per offer type
+    '''
+    scored = profiles.copy()
+    for offer, (labels, probs) in score_features(models, build_features(profiles, encoder)).items():
+        scored[offer + '_label'] = labels
+        scored[offer + '_prob'] = probs
+    return scored
+
+
+def iter_scored_profiles(models, profiles, batch_size=BATCH_SIZE, encoder=DEFAULT_ENCODER):
+    '''
+    INPUT
+    models - dictionary of offer type to trained classifier
+    profiles - pandas dataframe with gender, age, income and since (or customer_since) columns
+    batch_size - number of profiles scored at a time
+    encoder - FeatureEncoder of the classifiers
+
+    OUTPUT
+    generator of scored profile dataframes, one per batch
+    '''
+    for start in range(0, len(profiles), batch_size):
+        yield score_profiles(models, profiles.iloc[start:start + batch_size], encoder)
+
+
+def check_profiles(profiles):
+    '''
+    INPUT
+    profiles - pandas dataframe of the profiles to score
+
+    OUTPUT
+    missing - list of required columns missing from the profiles
+    '''
+    missing = [column for column in ['gender', 'age', 'income'] if column not in profiles]
+    if 'since' not in profiles and 'customer_since' not in profiles:
+        missing.append('since')
+    return missing
+
+
+def coerce_profiles(profiles):
+    '''
+    INPUT
+    profiles - pandas dataframe of the profiles to score, with the columns of check_profiles
+
+    OUTPUT
+    profiles - copy of the profiles with age, income and since converted to numbers
+    invalid - list of the positions of the profiles with a missing or non numeric age, income or since
+
+    Run before scoring, so bad rows are reported up front instead of failing a batch
+    part way through the scored output. Profiles may give since in either field, where
+    both columns exist customer_since, which build_features reads, takes the value of
+    since in the profiles without one.
+    '''
+    profiles = profiles.copy()
+    for column in ['age', 'income', 'since', 'customer_since']:
+        if column in profiles:
+            profiles[column] = pd.to_numeric(profiles[column], errors='coerce')
+    if 'customer_since' in profiles and 'since' in profiles:
+        profiles['customer_since'] = profiles['customer_since'].fillna(profiles['since'])
+    since = 'customer_since' if 'customer_since' in profiles else 'since'
+    invalid = profiles[['age', 'income', since]].isna().any(axis=1).to_numpy()
+    return profiles, np.flatnonzero(invalid).tolist()
@@ -0,0 +1,128 @@
+import os
+import gc
+import signal
+import socket
+import argparse
+from werkzeug.serving import make_server
+
+from app import create_app
+
+
+def run_worker(app, listener, threads):
+    '''
+    INPUT
+    app - the preloaded Flask app
+    listener - listening socket inherited from the master process
+    threads - serve requests on a thread each when greater than one
+
+    OUTPUT
+    NONE
+
+    Serves requests from the shared listening socket until the worker is terminated.
+    '''
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    host, port = listener.getsockname()[:2]
+    server = make_server(host, port, app, threaded=threads > 1, fd=listener.fileno())
+    server.serve_forever()
+
+
+def serve(app, host, port, workers, threads=8):
+    '''
+    INPUT
+    app - the Flask app returned by create_app
+    host - address to listen on
+    port - port to listen on
+    workers - number of worker processes
+    threads - serve requests on a thread each in every worker when greater than one
+
+    OUTPUT
+    NONE
+
+    This function does the following:
+    1. Opens the listening socket and loads the classifiers and the dashboard once in the
+       master process
+    2. Freezes the loaded objects out of the garbage collector, so the collections in the
+       workers do not write to (and copy) the pages they share with the master
+    3. Forks the workers, which accept connections from the shared socket, and restarts
+       any worker which dies until the master is terminated
+    '''
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(1024)
+    listener.set_inheritable(True)
+
+    app.extensions['starbucks'].preload()
+
+    # Platforms without fork serve from this process
+    if not hasattr(os, 'fork') or workers <= 1:
+        run_worker(app, listener, threads)
+        return
+
+    gc.freeze()
+    children = set()
+    stopping = []
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(app, listener, threads)
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in list(children):
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        spawn()
+    print('Serving on http://{}:{} with {} workers'.format(host, port, workers))
+
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            spawn()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Serve the app with preloaded, forked worker processes',
+                                     epilog='Example: python serve.py --workers 4 --port 3001')
+    parser.add_argument('--host', default='0.0.0.0', help='address to listen on (default: 0.0.0.0)')
+    parser.add_argument('--port', type=int, default=3001, help='port to listen on (default: 3001)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes (default: the number of cpus)')
+    parser.add_argument('--threads', type=int, default=8,
+                        help='serve requests on a thread each in every worker when greater than one (default: 8)')
+    parser.add_argument('--model', dest='model_filepath', default=None,
+                        help='classifiers pickle or compact npz export (default: STARBUCKS_MODEL or ../model/classifiers.pkl)')
+    parser.add_argument('--data', dest='data_filepath', default=None,
+                        help='customer profiles database or parquet (default: STARBUCKS_DATA or ../data/StarbucksOffers.db)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = {}
+    if args.model_filepath:
+        config['STARBUCKS_MODEL'] = args.model_filepath
+    if args.data_filepath:
+        config['STARBUCKS_DATA'] = args.data_filepath
+
+    serve(create_app(config), args.host, args.port, args.workers, args.threads)
+
+
+if __name__ == '__main__':
+    main()
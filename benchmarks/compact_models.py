@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import joblib
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from compact_models import load_compact_models
+from scoring import build_features, iter_model_proba
+
+
+def random_profiles(n, seed=42):
+    '''
+    INPUT
+    n - number of profiles
+    seed - random seed
+
+    OUTPUT
+    profiles - pandas dataframe of random profiles covering the ranges of the web form
+    '''
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame({'gender': rng.choice(['male', 'female', 'other'], n),
+                         'age': rng.randint(18, 102, n),
+                         'income': rng.randint(30, 120, n) * 1000,
+                         'since': rng.randint(0, 1900, n)})
+
+
+def time_call(function, repeats):
+    '''
+    INPUT
+    function - callable without arguments
+    repeats - number of calls
+
+    OUTPUT
+    seconds - median wall time of one call
+    '''
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def main():
+    if len(sys.argv) == 3:
+        model_filepath, export_filepath = sys.argv[1:]
+
+        models = joblib.load(model_filepath)
+        compact_models = load_compact_models(export_filepath)
+
+        single = build_features(random_profiles(1))
+        batch = build_features(random_profiles(10000))
+
+        print('{:>15} {:>12} {:>12} {:>14} {:>14} {:>12}'.format(
+            'offer', 'max |dp|', 'label diff', 'sklearn 1 row', 'numpy 1 row', 'batch speedup'))
+        for offers, model in models.items():
+            sklearn_single = time_call(lambda: model.predict_proba(single), 50)
+            sklearn_batch = time_call(lambda: model.predict_proba(batch), 5)
+            # A multi-output model scores all its offer types with one call, each has its own compact model
+            for offer, proba, classes in iter_model_proba({offers: model}, batch):
+                compact = compact_models[offer]
+                difference = np.abs(proba - compact.predict_proba(batch)).max()
+                mismatches = int((classes[proba.argmax(axis=1)] != compact.predict(batch)).sum())
+
+                numpy_single = time_call(lambda: compact.predict_proba(single), 50)
+                numpy_batch = time_call(lambda: compact.predict_proba(batch), 5)
+
+                print('{:>15} {:>12.2e} {:>12d} {:>12.3f}ms {:>12.3f}ms {:>12.2f}x'.format(
+                    offer, difference, mismatches, sklearn_single * 1000, numpy_single * 1000,
+                    sklearn_batch / numpy_batch))
+            if isinstance(offers, tuple):
+                print('{:>15} one scikit-learn call scores all of {}'.format('', ', '.join(offers)))
+
+    else:
+        print('Please provide the filepath of the classifiers pickle as the first argument '\
+              'and the filepath of the compact models npz file as the second argument. '\
+              '\n\nExample: python compact_models.py ../model/classifiers.pkl ../model/classifiers.npz')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import warnings
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+
+BENCHMARKS_DIRPATH = os.path.dirname(os.path.abspath(__file__))
+for dirname in ['data', 'model', 'app']:
+    sys.path.insert(0, os.path.join(BENCHMARKS_DIRPATH, '..', dirname))
+from generate_data import BASE_CUSTOMERS, generate_data
+from process_data import clean_profile_data, load_transcript_data, create_customer_timeline_state, \
+    complete_customer_profiles, save_data, save_timeline_state, DEMOGRAPHIC_COLUMNS
+from train_classifiers import MODEL_TYPES, SEARCH_STRATEGIES, build_training_data, build_model, save_model
+from feature_encoder import FeatureEncoder, get_encoder_filepath
+from app import create_app
+from instrumentation import RunReport
+
+def time_route(client, paths):
+    '''
+    INPUT
+    client - Flask test client of the app
+    paths - list of paths to request one after the other
+
+    OUTPUT
+    summary - dictionary with the number of requests, the requests per second and the
+              mean and percentile latencies in milliseconds
+    '''
+    latencies = []
+    start = time.perf_counter()
+    for path in paths:
+        request_start = time.perf_counter()
+        response = client.get(path)
+        latencies.append(time.perf_counter() - request_start)
+        if response.status_code != 200:
+            raise RuntimeError('{} answered {}'.format(path, response.status_code))
+    seconds = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+    return {'requests': len(paths), 'requests_per_sec': len(paths) / seconds, 'mean_ms': latencies.mean(),
+            'p50_ms': np.percentile(latencies, 50), 'p95_ms': np.percentile(latencies, 95),
+            'p99_ms': np.percentile(latencies, 99)}
+
+
+def run_benchmark(workdir, n_customers, seed, model_types, search, budget, n_requests):
+    '''
+    INPUT
+    workdir - directory for the generated data, the database and the classifiers
+    n_customers - number of generated customers
+    seed - random seed of the generated data
+    model_types - model types to train per offer type
+    search - hyperparameter search strategy of the training
+    budget - resource budget of the search, see train_classifiers.build_model
+    n_requests - number of timed requests per route
+
+    OUTPUT
+    run - dictionary with the dataset sizes, the measured stages (see instrumentation.RunReport)
+          and the route latencies
+
+    This function does the following:
+    1. Generates a dataset with data/generate_data.py
+    2. Runs the stages of process_data.py, the training of train_classifiers.py and the
+       first requests of the app, measuring each of them
+    3. Times repeated requests of the dashboard and of predictions for random profiles
+    '''
+    report = RunReport('end_to_end')
+    run = {'customers': n_customers, 'seed': seed, 'stages': report.stages}
+    data_dirpath = os.path.join(workdir, 'data')
+    database_filepath = os.path.join(workdir, 'StarbucksOffers.db')
+    model_filepath = os.path.join(workdir, 'classifiers.pkl')
+
+    with report.stage('generate') as stage:
+        run['events'] = generate_data(data_dirpath, n_customers, seed=seed)
+        stage['rows'] = sum(run['events'][name] for name in ['offer received', 'offer viewed',
+                                                             'transaction', 'offer completed'])
+
+    with report.stage('etl_read_profile') as stage:
+        profile = pd.read_json(os.path.join(data_dirpath, 'profile.json'), orient='records', lines=True)
+        portfolio = pd.read_json(os.path.join(data_dirpath, 'portfolio.json'), orient='records', lines=True)
+        profile_clean = clean_profile_data(profile)
+        stage['rows'] = len(profile_clean)
+    with report.stage('etl_load_transcript') as stage:
+        transcript = load_transcript_data(os.path.join(data_dirpath, 'transcript.json'))
+        stage['rows'] = len(transcript)
+    with report.stage('etl_customer_timeline') as stage:
+        customer_totals, offer_state = create_customer_timeline_state(portfolio, transcript)
+        stage['rows'] = len(customer_totals)
+    with report.stage('etl_complete_profiles') as stage:
+        customer_profiles = complete_customer_profiles(customer_totals, profile_clean)
+        stage['rows'] = len(customer_profiles)
+    with report.stage('etl_save') as stage:
+        if os.path.exists(database_filepath):
+            os.remove(database_filepath)
+        save_data(customer_profiles, database_filepath, 'customer_profiles', primary_key='person',
+                  index_columns=DEMOGRAPHIC_COLUMNS)
+        save_timeline_state(customer_totals, offer_state, transcript['time'].max(), database_filepath)
+        stage['rows'] = len(customer_profiles)
+    del profile, transcript, customer_totals, offer_state, customer_profiles
+
+    with report.stage('train_features') as stage:
+        X, targets, encoder = build_training_data(database_filepath)
+        stage['rows'] = len(X)
+    models, best_scores, run['scores'] = {}, {}, {}
+    for model_type in model_types:
+        with report.stage('train_' + model_type) as stage:
+            for offer, Y in targets.items():
+                X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=0.2, random_state=seed)
+                model = build_model(model_type, search, budget)
+                model.fit(X_train, Y_train)
+                score = model.score(X_test, Y_test)
+                run['scores']['{}/{}'.format(offer, model_type)] = score
+                if score > best_scores.get(offer, -1):
+                    best_scores[offer], models[offer] = score, model
+            stage['rows'] = len(X) * len(targets)
+    save_model(models, model_filepath)
+    FeatureEncoder.from_dict(encoder).save(get_encoder_filepath(model_filepath))
+
+    app = create_app({'STARBUCKS_MODEL': model_filepath, 'STARBUCKS_DATA': database_filepath})
+    client = app.test_client()
+    with report.stage('app_first_index'):
+        client.get('/')
+    # Random profiles, so the predictions are computed rather than answered by the prediction cache
+    rng = np.random.RandomState(seed)
+    go_paths = ['/go?gender={}&age={}&income={}&since={}'.format(gender, age, income * 1000, since)
+                for gender, age, income, since in zip(rng.choice(['male', 'female', 'other'], n_requests),
+                                                      rng.randint(18, 102, n_requests), rng.randint(30, 121, n_requests),
+                                                      rng.randint(0, 1900, n_requests))]
+    with report.stage('app_first_go'):
+        client.get(go_paths[0])
+
+    report.print_summary()
+    run['routes'] = {'/': time_route(client, ['/'] * n_requests), '/go': time_route(client, go_paths)}
+    for route, summary in run['routes'].items():
+        print('    {:<28} {:>9.1f} req/s {:>7.2f} ms p50 {:>7.2f} ms p99'.format(
+            'route ' + route, summary['requests_per_sec'], summary['p50_ms'], summary['p99_ms']))
+    return run
+
+
+def compare_results(results, baseline):
+    '''
+    INPUT
+    results - benchmark results of this run
+    baseline - benchmark results of an earlier run
+
+    OUTPUT
+    NONE
+
+    Prints the wall time and peak memory of every stage of the runs of equal size relative
+    to the baseline, above 1 is slower or larger than the baseline.
+    '''
+    baseline_runs = {run['customers']: run for run in baseline['runs']}
+    print('\nCompared with the baseline of {}'.format(baseline['created']))
+    print('{:>10} {:<28} {:>10} {:>10}'.format('customers', 'stage', 'time', 'memory'))
+    for run in results['runs']:
+        if run['customers'] not in baseline_runs:
+            continue
+        stages = {stage['stage']: stage for stage in baseline_runs[run['customers']]['stages']}
+        for stage in run['stages']:
+            before = stages.get(stage['stage'])
+            if before is None:
+                continue
+            memory = stage.get('peak_rss_mb', np.nan) / before.get('peak_rss_mb', np.nan)
+            print('{:>10} {:<28} {:>9.2f}x {:>9.2f}x'.format(run['customers'], stage['stage'],
+                                                             stage['seconds'] / before['seconds'], memory))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the data processing, the training and the app on '
+                                                 'generated datasets of increasing size',
+                                     epilog='Example: python end_to_end.py results.json --scale 1 10 '
+                                            '--baseline previous.json')
+    parser.add_argument('output_filepath', help='JSON file to write the results to')
+    parser.add_argument('--scale', type=float, nargs='+', default=[1],
+                        help='dataset sizes relative to the shipped {} customers (default: 1)'.format(BASE_CUSTOMERS))
+    parser.add_argument('--seed', type=int, default=42, help='random seed of the generated data (default: 42)')
+    parser.add_argument('--model-types', nargs='+', choices=MODEL_TYPES, default=MODEL_TYPES,
+                        help='model types to train (default: all)')
+    parser.add_argument('--search', choices=SEARCH_STRATEGIES, default='halving',
+                        help='hyperparameter search strategy (default: halving)')
+    parser.add_argument('--budget', type=int, default=None, help='resource budget of the search')
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per route (default: 200)')
+    parser.add_argument('--workdir', default=None,
+                        help='directory to keep the generated data, database and classifiers in '
+                             '(default: a temporary directory which is removed)')
+    parser.add_argument('--baseline', default=None, help='results of an earlier run to compare with')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # The data processing warns about pandas chained assignment, which is not of interest here
+    warnings.simplefilter('ignore', pd.errors.SettingWithCopyWarning)
+
+    results = {'created': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+               'platform': platform.platform(), 'cpus': os.cpu_count(),
+               'versions': {'numpy': np.__version__, 'pandas': pd.__version__},
+               'settings': {'seed': args.seed, 'model_types': args.model_types, 'search': args.search,
+                            'budget': args.budget, 'requests': args.requests},
+               'runs': []}
+    workdir = args.workdir or tempfile.mkdtemp(prefix='starbucks-benchmark-')
+    try:
+        for scale in args.scale:
+            n_customers = int(round(BASE_CUSTOMERS * scale))
+            print('Benchmarking {} customers (scale {:g})...'.format(n_customers, scale))
+            run = run_benchmark(os.path.join(workdir, 'scale-{:g}'.format(scale)), n_customers, args.seed,
+                                args.model_types, args.search, args.budget, args.requests)
+            run['scale'] = scale
+            results['runs'].append(run)
+            # Written after every run, so the finished sizes are kept if a larger one fails
+            with open(args.output_filepath, 'w') as file:
+                json.dump(results, file, indent=1, default=float)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            compare_results(results, json.load(file))
+    print('Results saved!\n    RESULTS: {}'.format(args.output_filepath))
+
+
+if __name__ == '__main__':
+    main()
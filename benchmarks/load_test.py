@@ -0,0 +1,86 @@
+import time
+import argparse
+import threading
+import numpy as np
+from urllib.request import urlopen
+from urllib.error import URLError
+
+# Query strings of /go requests, a mix of repeated and distinct demographics
+GO_QUERIES = ['/go?gender={}&age={}&income={}&since={}'.format(gender, age, income, since)
+              for gender in ['male', 'female', 'other']
+              for age in [25, 40, 65]
+              for income in [40000, 70000, 100000]
+              for since in [100, 700]]
+
+
+def run_clients(base_url, paths, n_requests, concurrency):
+    '''
+    INPUT
+    base_url - address of the running app, such as http://127.0.0.1:3001
+    paths - list of paths requested in turn by the clients
+    n_requests - total number of requests
+    concurrency - number of clients sending requests at the same time
+
+    OUTPUT
+    latencies - array of the seconds of every successful request
+    errors - number of failed requests
+    seconds - wall time of all the requests
+    '''
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(n_requests))
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            try:
+                with urlopen(base_url + paths[i % len(paths)], timeout=30) as response:
+                    response.read()
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+            except (URLError, OSError):
+                with lock:
+                    errors[0] += 1
+
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return np.array(latencies), errors[0], time.perf_counter() - start
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Load test the dashboard and the prediction page of a running app',
+                                     epilog='Example: python load_test.py http://127.0.0.1:3001 --requests 2000 --concurrency 16')
+    parser.add_argument('base_url', help='address of the running app')
+    parser.add_argument('--requests', type=int, default=1000, help='requests per page (default: 1000)')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients (default: 8)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    base_url = args.base_url.rstrip('/')
+
+    print('{:>6} {:>10} {:>8} {:>10} {:>10} {:>10}'.format('page', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms'))
+    for page, paths in [('/', ['/']), ('/go', GO_QUERIES)]:
+        # One warm up request per distinct path so the first loads are not measured
+        run_clients(base_url, paths, len(paths), 1)
+        latencies, errors, seconds = run_clients(base_url, paths, args.requests, args.concurrency)
+        if len(latencies) == 0:
+            print('{:>6} all {} requests failed'.format(page, args.requests))
+            continue
+        print('{:>6} {:>10d} {:>8d} {:>10.1f} {:>10.2f} {:>10.2f}'.format(
+            page, len(latencies), errors, len(latencies) / seconds,
+            np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import threading
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from app import create_app
+from asgi import MicroBatcher
+from scoring import build_profile_features, score_features, get_profile_values
+
+
+def random_requests(n, seed=42):
+    '''
+    INPUT
+    n - number of requests
+    seed - random seed
+
+    OUTPUT
+    requests - list of (gender, age, income, since) tuples as sent by the web form
+    '''
+    rng = np.random.RandomState(seed)
+    return [(gender, str(age), str(income * 1000), str(since)) for gender, age, income, since in
+            zip(rng.choice(['male', 'female', 'other'], n), rng.randint(18, 102, n),
+                rng.randint(30, 120, n), rng.randint(0, 1900, n))]
+
+
+def run_per_request(state, requests, concurrency):
+    '''
+    INPUT
+    state - ServingState with the classifiers
+    requests - list of web form tuples
+    concurrency - number of client threads, like the threads of the Flask server
+
+    OUTPUT
+    latencies - array of the seconds of every request
+    seconds - wall time of all the requests
+    '''
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(len(requests)))
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            current = state.get_models()
+            score_features(current['models'], build_profile_features(*requests[i], current['encoder']))
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return np.array(latencies), time.perf_counter() - start
+
+
+def run_micro_batched(state, requests, concurrency, max_batch_size, max_latency):
+    '''
+    INPUT
+    state - ServingState with the classifiers
+    requests - list of web form tuples
+    concurrency - number of concurrent client coroutines
+    max_batch_size - largest number of profiles scored at once
+    max_latency - seconds the first profile of a batch waits for more profiles
+
+    OUTPUT
+    latencies - array of the seconds of every request
+    seconds - wall time of all the requests
+    batches - number of batches scored
+    '''
+    batcher = MicroBatcher(state, max_batch_size, max_latency)
+    latencies = []
+    counter = iter(range(len(requests)))
+
+    async def client():
+        for i in counter:
+            start = time.perf_counter()
+            await batcher.score(get_profile_values(*requests[i]))
+            latencies.append(time.perf_counter() - start)
+
+    async def run():
+        await asyncio.gather(*[client() for _ in range(concurrency)])
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    seconds = time.perf_counter() - start
+    batcher.executor.shutdown()
+    return np.array(latencies), seconds, batcher.batches
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare per request and micro batched scoring of concurrent /go requests',
+                                     epilog='Example: python micro_batching.py ../model/classifiers.pkl --concurrency 64')
+    parser.add_argument('model_filepath', help='classifiers pickle or compact npz export')
+    parser.add_argument('--requests', type=int, default=5000, help='number of requests (default: 5000)')
+    parser.add_argument('--concurrency', type=int, default=32, help='concurrent clients (default: 32)')
+    parser.add_argument('--batch-size', type=int, default=64, help='largest micro batch (default: 64)')
+    parser.add_argument('--latency-ms', type=float, default=5, help='longest wait for a micro batch in ms (default: 5)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    state = create_app({'STARBUCKS_MODEL': args.model_filepath}).extensions['starbucks']
+    state.get_models()
+    requests = random_requests(args.requests)
+
+    print('{:>13} {:>10} {:>10} {:>10} {:>10}'.format('path', 'req/s', 'p50 ms', 'p99 ms', 'batches'))
+    latencies, seconds = run_per_request(state, requests, args.concurrency)
+    print('{:>13} {:>10.1f} {:>10.2f} {:>10.2f} {:>10d}'.format(
+        'per request', len(latencies) / seconds, np.percentile(latencies, 50) * 1000,
+        np.percentile(latencies, 99) * 1000, len(latencies)))
+
+    latencies, seconds, batches = run_micro_batched(state, requests, args.concurrency,
+                                                    args.batch_size, args.latency_ms / 1000)
+    print('{:>13} {:>10.1f} {:>10.2f} {:>10.2f} {:>10d}'.format(
+        'micro batched', len(latencies) / seconds, np.percentile(latencies, 50) * 1000,
+        np.percentile(latencies, 99) * 1000, batches))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'model'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from train_classifiers import (load_data, clean_data, build_model, multi_output_accuracy, FEATURE_COLUMNS,
+                               TARGETS, MULTI_OUTPUT_MODEL_TYPES)
+from scoring import score_features
+
+
+def time_call(function, repeats):
+    '''
+    INPUT
+    function - callable without arguments
+    repeats - number of calls
+
+    OUTPUT
+    seconds - median wall time of one call
+    '''
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def main():
+    if len(sys.argv) in (2, 3):
+        database_filepath = sys.argv[1]
+        search = sys.argv[2] if len(sys.argv) == 3 else 'grid'
+
+        df = load_data(database_filepath)
+        X = clean_data(df[FEATURE_COLUMNS])
+        offers = list(TARGETS)
+        Y = np.column_stack([np.where(df[column] > 0, 'yes', 'no') for column in TARGETS.values()])
+        X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=0.2, random_state=42)
+
+        print('{:>13} {:>13} {:>10} {:>10} {:>13} {:>11} {:>11}'.format(
+            'model', 'setup', 'train s', 'accuracy', 'worst offer', '1 row ms', 'batch ms'))
+        for model_type in MULTI_OUTPUT_MODEL_TYPES:
+            start = time.perf_counter()
+            separate = {}
+            for i, offer in enumerate(offers):
+                separate[offer] = build_model(model_type, search).fit(X_train, Y_train[:, i]).best_estimator_
+            separate_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            multi = build_model(model_type, search, scoring=multi_output_accuracy).fit(X_train, Y_train)
+            multi = {tuple(offers): multi.best_estimator_}
+            multi_seconds = time.perf_counter() - start
+
+            for setup, models, seconds in [('3 models', separate, separate_seconds),
+                                           ('multi-output', multi, multi_seconds)]:
+                scores = score_features(models, X_test)
+                accuracies = [np.mean(scores[offer][0] == Y_test[:, i]) for i, offer in enumerate(offers)]
+                single = time_call(lambda: score_features(models, X_test.iloc[:1]), 50)
+                batch = time_call(lambda: score_features(models, X_test), 10)
+                print('{:>13} {:>13} {:>10.2f} {:>10.4f} {:>13.4f} {:>11.3f} {:>11.3f}'.format(
+                    model_type, setup, seconds, np.mean(accuracies), min(accuracies),
+                    single * 1000, batch * 1000))
+
+    else:
+        print('Please provide the filepath of the starbucks offers database (or the customer_profiles '\
+              'parquet file or directory) as the first argument, optionally followed by the search '\
+              'strategy (grid, halving or random). \n\nExample: python multi_output.py '\
+              '../data/StarbucksOffers.db random')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+from process_data import clean_profile_data, clean_transcript_data, create_customer_profiles
+
+
+def time_profile_build(profile, portfolio, transcript, workers, repeats=3):
+    '''
+    INPUT
+    profile - pandas dataframe containing the cleaned customer profile data
+    portfolio - pandas dataframe containing the offer portfolio data
+    transcript - pandas dataframe containing the cleaned transaction transcript data
+    workers - number of worker processes to build the profiles with
+    repeats - number of timed runs
+
+    OUTPUT
+    best - fastest wall time in seconds over the timed runs
+    '''
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        create_customer_profiles(profile, portfolio, transcript, workers=workers)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    if len(sys.argv) in (4, 5):
+        profile_filepath, portfolio_filepath, transcript_filepath = sys.argv[1:4]
+        max_workers = int(sys.argv[4]) if len(sys.argv) == 5 else os.cpu_count()
+
+        profile = clean_profile_data(pd.read_json(profile_filepath, orient='records', lines=True))
+        portfolio = pd.read_json(portfolio_filepath, orient='records', lines=True)
+        transcript = clean_transcript_data(pd.read_json(transcript_filepath, orient='records', lines=True))
+
+        print('Building customer profiles from {} transcript events'.format(len(transcript)))
+        print('{:>8} {:>10} {:>8}'.format('workers', 'seconds', 'speedup'))
+        baseline = None
+        for workers in range(1, max_workers + 1):
+            elapsed = time_profile_build(profile, portfolio, transcript, workers)
+            baseline = baseline or elapsed
+            print('{:>8} {:>10.3f} {:>8.2f}'.format(workers, elapsed, baseline / elapsed))
+
+    else:
+        print('Please provide the filepaths of the customer profile, offer portfolio '\
+              'and transaction transcript datasets as the first, second and third argument, '\
+              'and optionally the maximum number of workers as the fourth argument. '\
+              '\n\nExample: python profile_workers.py ../data/profile.json '\
+              '../data/portfolio.json ../data/transcript.json 4')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'model'))
+from train_classifiers import (load_data, clean_data, build_model, FEATURE_COLUMNS, TARGETS,
+                               MODEL_TYPES, SEARCH_STRATEGIES)
+
+
+def main():
+    if len(sys.argv) in (2, 3):
+        database_filepath = sys.argv[1]
+        budget = int(sys.argv[2]) if len(sys.argv) == 3 else None
+
+        df = load_data(database_filepath)
+        X = clean_data(df[FEATURE_COLUMNS])
+
+        print('{:>14} {:>13} {:>9} {:>10} {:>10} {:>11}'.format(
+            'offer', 'model', 'search', 'seconds', 'cv score', 'test score'))
+        totals = {search: 0.0 for search in SEARCH_STRATEGIES}
+        for offer, column in TARGETS.items():
+            Y = np.where(df[column] > 0, 'yes', 'no')
+            X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=0.2, random_state=42)
+            for model_type in MODEL_TYPES:
+                for search in SEARCH_STRATEGIES:
+                    model = build_model(model_type, search, budget)
+                    start = time.perf_counter()
+                    model.fit(X_train, Y_train)
+                    seconds = time.perf_counter() - start
+                    totals[search] += seconds
+                    print('{:>14} {:>13} {:>9} {:>10.2f} {:>10.4f} {:>11.4f}'.format(
+                        offer, model_type, search, seconds, model.best_score_, model.score(X_test, Y_test)))
+
+        print('\nTotal seconds: ' + ', '.join('{} {:.2f}'.format(search, seconds)
+                                             for search, seconds in totals.items()))
+
+    else:
+        print('Please provide the filepath of the starbucks offers database (or the customer_profiles '\
+              'parquet file or directory) as the first argument, optionally followed by the resource '\
+              'budget of the halving and random searches. \n\nExample: python search_strategies.py '\
+              '../data/StarbucksOffers.db')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import os
+import sys
+import argparse
+import tempfile
+import warnings
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+from process_data import get_offer_details, load_transcript_data, read_transcript_chunks, \
+    create_customer_profile_df, create_customer_timeline, load_transcript_database, create_customer_timeline_sql
+from instrumentation import RunReport
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the time and memory of the SQL profile engine of '
+                                                 'process_data.py with the per person timeline and the vectorized '
+                                                 'engine, tests/test_process_data.py checks that they match')
+    parser.add_argument('portfolio_filepath')
+    parser.add_argument('transcript_filepath')
+    parser.add_argument('--skip-timeline', action='store_true',
+                        help='leave out the per person timeline loop, which is slow on large transcripts')
+    args = parser.parse_args()
+    # The data processing warns about pandas chained assignment, which is not of interest here
+    warnings.simplefilter('ignore', pd.errors.SettingWithCopyWarning)
+
+    portfolio = pd.read_json(args.portfolio_filepath, orient='records', lines=True)
+    offer_durations, offer_types = get_offer_details(portfolio)
+    report = RunReport('sql_engine')
+
+    work_filepath = os.path.join(tempfile.mkdtemp(prefix='starbucks-sql-'), 'work.db')
+    try:
+        with report.stage('sql_load_transcript_database') as stage:
+            stage['rows'], _ = load_transcript_database(portfolio, read_transcript_chunks(args.transcript_filepath),
+                                                        work_filepath)
+        with report.stage('sql_create_customer_timeline') as stage:
+            stage['rows'] = len(create_customer_timeline_sql(work_filepath, funnel=True)[0])
+    finally:
+        os.remove(work_filepath)
+        os.rmdir(os.path.dirname(work_filepath))
+
+    with report.stage('load_transcript_data') as stage:
+        transcript = load_transcript_data(args.transcript_filepath)
+        stage['rows'] = len(transcript)
+    with report.stage('vectorized_create_customer_timeline') as stage:
+        stage['rows'] = len(create_customer_timeline(transcript, offer_durations, offer_types, funnel=True)[0])
+    if not args.skip_timeline:
+        with report.stage('timeline_create_customer_profiles') as stage:
+            stage['rows'] = len(create_customer_profile_df(transcript, offer_durations, offer_types, 'timeline'))
+
+    report.print_summary()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+# Number of customers of the shipped profile.json, the size of a --scale 1 dataset
+BASE_CUSTOMERS = 17000
+
+# Last hour of the test period, the transcript covers hours 0 to TEST_HOURS
+TEST_HOURS = 714
+
+# Hours at which a new offer is sent to the customers, as in the original transcript
+OFFER_RELEASE_HOURS = [0, 168, 336, 408, 504, 576]
+
+# Offers of the generated portfolio as (offer type, difficulty, reward, duration in days, channels)
+OFFER_TEMPLATES = [('bogo', 10, 10, 7.0, ['email', 'mobile', 'social']),
+                   ('bogo', 10, 10, 5.0, ['web', 'email', 'mobile', 'social']),
+                   ('informational', 0, 0, 4.0, ['web', 'email', 'mobile']),
+                   ('bogo', 5, 5, 7.0, ['web', 'email', 'mobile']),
+                   ('discount', 20, 5, 10.0, ['web', 'email']),
+                   ('discount', 7, 3, 7.0, ['web', 'email', 'mobile', 'social']),
+                   ('discount', 10, 2, 10.0, ['web', 'email', 'mobile', 'social']),
+                   ('informational', 0, 0, 3.0, ['email', 'mobile', 'social']),
+                   ('bogo', 5, 5, 5.0, ['web', 'email', 'mobile', 'social']),
+                   ('discount', 10, 2, 7.0, ['web', 'email', 'mobile'])]
+
+# Share of profiles without demographics (age 118, no gender and income), dropped by process_data.py
+DUMMY_PROFILE_SHARE = 0.128
+
+# Order of the events sharing an hour in the transcript
+EVENT_NAMES = ['offer received', 'offer viewed', 'transaction', 'offer completed']
+
+# Events written to the transcript file at a time
+WRITE_CHUNKSIZE = 200000
+
+
+def generate_ids(rng, n):
+	'''
+	INPUT
+	rng - numpy random generator
+	n - number of ids
+
+	OUTPUT
+	ids - numpy array of n random 32 character hex ids, like the ids of the original data
+	'''
+	raw = rng.bytes(16 * n).hex()
+	return np.array([raw[i * 32:(i + 1) * 32] for i in range(n)], dtype=object)
+
+
+def generate_portfolio(rng, n_offers=len(OFFER_TEMPLATES)):
+	'''
+	INPUT
+	rng - numpy random generator
+	n_offers - number of offers, the templates are repeated for more than ten offers
+
+	OUTPUT
+	portfolio - pandas dataframe with the columns of portfolio.json
+	'''
+	templates = [OFFER_TEMPLATES[i % len(OFFER_TEMPLATES)] for i in range(n_offers)]
+	portfolio = pd.DataFrame(templates, columns=['offer_type', 'difficulty', 'reward', 'duration', 'channels'])
+	portfolio['id'] = generate_ids(rng, n_offers)
+	return portfolio[['reward', 'channels', 'difficulty', 'duration', 'offer_type', 'id']]
+
+
+def generate_profiles(rng, n_customers):
+	'''
+	INPUT
+	rng - numpy random generator
+	n_customers - number of customer profiles
+
+	OUTPUT
+	profile - pandas dataframe with the columns of profile.json
+
+	The demographics follow the shipped profiles: mostly male and female customers, ages
+	around 55, incomes between 30000 and 120000 which grow with the age, and membership
+	dates between 2013 and 2018 weighted towards the recent years.
+	'''
+	dummy = rng.random(n_customers) < DUMMY_PROFILE_SHARE
+	gender = rng.choice(np.array(['M', 'F', 'O'], dtype=object), n_customers, p=[0.572, 0.413, 0.015])
+	age = np.clip(np.rint(rng.normal(54.4, 17.4, n_customers)), 18, 101).astype('int64')
+	income = 42000 + (age - 18) * 450 + rng.normal(0, 18000, n_customers)
+	income = (np.clip(np.rint(income / 1000), 30, 120) * 1000).astype('int64')
+	member_days = np.minimum(rng.exponential(550, n_customers), 1823).astype('int64')
+	became_member_on = (pd.Timestamp('2018-07-26') - pd.to_timedelta(member_days, unit='D')).strftime('%Y%m%d')
+
+	return pd.DataFrame({'gender': np.where(dummy, None, gender),
+	                     'age': np.where(dummy, 118, age),
+	                     'id': generate_ids(rng, n_customers),
+	                     'became_member_on': np.asarray(became_member_on, dtype=object),
+	                     'income': pd.Series(income, dtype='Int64').mask(dummy)})
+
+
+def customer_behaviour(rng, profile):
+	'''
+	INPUT
+	rng - numpy random generator
+	profile - pandas dataframe returned by generate_profiles
+
+	OUTPUT
+	behaviour - dictionary of per customer arrays: the transactions per day, the typical
+	            transaction amount and the probability to act on a viewed offer per offer type
+
+	The propensities depend on the demographics, so the classifiers trained on the
+	generated data have a signal to learn.
+	'''
+	dummy = profile['gender'].isnull().to_numpy()
+	age = np.where(dummy, 55, profile['age'].to_numpy())
+	income = profile['income'].fillna(65000).to_numpy(dtype='float64')
+	female = (profile['gender'] == 'F').to_numpy()
+
+	def sigmoid(x):
+		return 1 / (1 + np.exp(-x))
+
+	n = len(profile)
+	return {'rate': rng.gamma(2.0, 0.12, n),
+	        'amount': 3 + income / 12000 + 3 * female,
+	        'respond': {'bogo': sigmoid(-0.4 + 0.02 * (age - 55) + (income - 65000) / 25000 + 0.5 * female),
+	                    'discount': sigmoid(0.3 - 0.015 * (age - 55) + (income - 65000) / 40000 - 0.3 * female),
+	                    'informational': sigmoid(-0.8 + 0.01 * (age - 55))}}
+
+
+def generate_transcript(rng, profile, portfolio):
+	'''
+	INPUT
+	rng - numpy random generator
+	profile - pandas dataframe returned by generate_profiles
+	portfolio - pandas dataframe returned by generate_portfolio
+
+	OUTPUT
+	events - dictionary of equally long arrays with the person index, event index (see
+	         EVENT_NAMES), time, offer index (-1 for transactions) and amount of every event,
+	         sorted by time
+
+	This function does the following:
+	1. Sends every customer an offer at each release hour with a probability of 0.75
+	2. Lets the customers view an offer within its duration, more likely over more channels
+	3. Draws the everyday transactions of every customer and, for viewed offers, extra
+	   transactions of the customers which act on them
+	4. Completes a bogo or discount offer with the transaction at which the spend since
+	   it was received reaches its difficulty within its duration
+	'''
+	n_customers = len(profile)
+	behaviour = customer_behaviour(rng, profile)
+	difficulty = portfolio['difficulty'].to_numpy(dtype='float64')
+	hours = (portfolio['duration'].to_numpy() * 24).astype('int64')
+	view_probability = 0.35 + 0.12 * portfolio['channels'].apply(len).to_numpy()
+	offer_types = portfolio['offer_type'].to_numpy()
+
+	# Offers received
+	person = np.repeat(np.arange(n_customers), len(OFFER_RELEASE_HOURS))
+	received_time = np.tile(OFFER_RELEASE_HOURS, n_customers)
+	sent = rng.random(len(person)) < 0.75
+	received_person, received_time = person[sent], received_time[sent]
+	received_offer = rng.integers(0, len(portfolio), len(received_person))
+	end_time = np.minimum(received_time + hours[received_offer], TEST_HOURS)
+
+	# Offers viewed, a few hours to days after they were received
+	viewed_time = received_time + rng.exponential(30, len(received_person)).astype('int64')
+	viewed = (rng.random(len(received_person)) < view_probability[received_offer]) & (viewed_time <= end_time)
+
+	# Everyday transactions, and the extra transactions of the customers acting on an offer
+	counts = rng.poisson(behaviour['rate'] * TEST_HOURS / 24)
+	transaction_person = np.repeat(np.arange(n_customers), counts)
+	transaction_time = rng.integers(0, TEST_HOURS + 1, len(transaction_person))
+	transaction_amount = behaviour['amount'][transaction_person] * rng.lognormal(0, 0.6, len(transaction_person))
+
+	respond_probability = np.zeros(len(received_person))
+	for offer_type, probability in behaviour['respond'].items():
+		of_type = offer_types[received_offer] == offer_type
+		respond_probability[of_type] = probability[received_person[of_type]]
+	respond = viewed & (rng.random(len(received_person)) < respond_probability)
+	respond_time = viewed_time[respond] + (rng.random(respond.sum()) * (end_time[respond] - viewed_time[respond] + 1)).astype('int64')
+	respond_amount = np.maximum(difficulty[received_offer[respond]], behaviour['amount'][received_person[respond]]) * \
+		rng.uniform(0.6, 1.4, respond.sum())
+	transaction_person = np.concatenate([transaction_person, received_person[respond]])
+	transaction_time = np.concatenate([transaction_time, respond_time])
+	transaction_amount = np.round(np.concatenate([transaction_amount, respond_amount]), 2)
+
+	# The running spend over the transactions of all customers in person and time order is
+	# increasing, so the transaction completing an offer is found with one binary search
+	key = transaction_person * (TEST_HOURS + 1) + transaction_time
+	order = np.argsort(key, kind='stable')
+	key, transaction_person = key[order], transaction_person[order]
+	transaction_time, transaction_amount = transaction_time[order], transaction_amount[order]
+	spend = np.concatenate([[0], np.cumsum(transaction_amount)])
+
+	offers = np.flatnonzero(difficulty[received_offer] > 0)
+	first = np.searchsorted(key, received_person[offers] * (TEST_HOURS + 1) + received_time[offers], 'left')
+	last = np.searchsorted(key, received_person[offers] * (TEST_HOURS + 1) + end_time[offers], 'right')
+	completing = np.searchsorted(spend, spend[first] + difficulty[received_offer[offers]] - 1e-6, 'left')
+	completed = completing <= last
+	offers, completing = offers[completed], completing[completed] - 1
+
+	events = {'person': np.concatenate([received_person, received_person[viewed], transaction_person,
+	                                    received_person[offers]]),
+	          'event': np.repeat(np.arange(4), [len(received_person), viewed.sum(), len(transaction_person), len(offers)]),
+	          'time': np.concatenate([received_time, viewed_time[viewed], transaction_time, transaction_time[completing]]),
+	          'offer': np.concatenate([received_offer, received_offer[viewed], np.full(len(transaction_person), -1),
+	                                   received_offer[offers]]),
+	          'amount': np.concatenate([np.zeros(len(received_person) + viewed.sum()), transaction_amount,
+	                                    np.zeros(len(offers))])}
+	order = np.lexsort((events['event'], events['time']))
+	return {column: values[order] for column, values in events.items()}
+
+
+def write_transcript(events, profile, portfolio, transcript_filepath):
+	'''
+	INPUT
+	events - dictionary of event arrays returned by generate_transcript
+	profile - pandas dataframe returned by generate_profiles
+	portfolio - pandas dataframe returned by generate_portfolio
+	transcript_filepath - file path of the line delimited transcript json to write
+
+	OUTPUT
+	NONE
+	'''
+	person_ids = profile['id'].to_numpy()
+	offer_ids = portfolio['id'].to_numpy()
+	rewards = portfolio['reward'].to_numpy()
+	templates = ['{{"person": "{}", "event": "offer received", "value": {{"offer id": "{}"}}, "time": {}}}\n',
+	             '{{"person": "{}", "event": "offer viewed", "value": {{"offer id": "{}"}}, "time": {}}}\n',
+	             '{{"person": "{}", "event": "transaction", "value": {{"amount": {:.2f}}}, "time": {}}}\n',
+	             '{{"person": "{}", "event": "offer completed", "value": {{"offer_id": "{}", "reward": {}}}, "time": {}}}\n']
+
+	with open(transcript_filepath, 'w') as file:
+		for start in range(0, len(events['time']), WRITE_CHUNKSIZE):
+			chunk = slice(start, start + WRITE_CHUNKSIZE)
+			lines = []
+			for person, event, time, offer, amount in zip(person_ids[events['person'][chunk]], events['event'][chunk],
+			                                              events['time'][chunk], events['offer'][chunk],
+			                                              events['amount'][chunk]):
+				if event == 2:
+					lines.append(templates[2].format(person, amount, time))
+				elif event == 3:
+					lines.append(templates[3].format(person, offer_ids[offer], rewards[offer], time))
+				else:
+					lines.append(templates[event].format(person, offer_ids[offer], time))
+			file.writelines(lines)
+
+
+def generate_data(output_dirpath, n_customers=BASE_CUSTOMERS, n_offers=len(OFFER_TEMPLATES), seed=42):
+	'''
+	INPUT
+	output_dirpath - directory to write profile.json, portfolio.json and transcript.json to
+	n_customers - number of customer profiles
+	n_offers - number of offers in the portfolio
+	seed - random seed, the same seed and sizes always write the same files
+
+	OUTPUT
+	counts - dictionary with the number of customers, offers and events per event type
+	'''
+	rng = np.random.default_rng(seed)
+	os.makedirs(output_dirpath, exist_ok=True)
+
+	portfolio = generate_portfolio(rng, n_offers)
+	profile = generate_profiles(rng, n_customers)
+	events = generate_transcript(rng, profile, portfolio)
+
+	portfolio.to_json(os.path.join(output_dirpath, 'portfolio.json'), orient='records', lines=True)
+	profile.to_json(os.path.join(output_dirpath, 'profile.json'), orient='records', lines=True)
+	write_transcript(events, profile, portfolio, os.path.join(output_dirpath, 'transcript.json'))
+
+	counts = {'customers': n_customers, 'offers': n_offers}
+	counts.update({name: int(np.sum(events['event'] == i)) for i, name in enumerate(EVENT_NAMES)})
+	return counts
+
+
+def parse_args():
+	parser = argparse.ArgumentParser(description='Generate a synthetic profile, portfolio and transcript dataset',
+	                                 epilog='Example: python generate_data.py ../synthetic --scale 10')
+	parser.add_argument('output_dirpath', help='directory to write profile.json, portfolio.json and transcript.json to')
+	parser.add_argument('--scale', type=float, default=1,
+	                    help='size relative to the shipped {} customers (default: 1)'.format(BASE_CUSTOMERS))
+	parser.add_argument('--customers', type=int, default=None, help='number of customers, overrides --scale')
+	parser.add_argument('--offers', type=int, default=len(OFFER_TEMPLATES),
+	                    help='number of offers in the portfolio (default: {})'.format(len(OFFER_TEMPLATES)))
+	parser.add_argument('--seed', type=int, default=42, help='random seed (default: 42)')
+	return parser.parse_args()
+
+
+def main():
+	args = parse_args()
+	n_customers = args.customers or int(round(BASE_CUSTOMERS * args.scale))
+
+	print('Generating {} customers and {} offers...\n    DIRECTORY: {}'.format(n_customers, args.offers, args.output_dirpath))
+	counts = generate_data(args.output_dirpath, n_customers, args.offers, args.seed)
+	for name in EVENT_NAMES:
+		print('    {}: {} events'.format(name, counts[name]))
+
+	print('Synthetic data saved!')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import platform
+import threading
+import contextlib
+from datetime import datetime
+try:
+	import resource
+except ImportError:
+	resource = None
+
+# Seconds between two samples of the resident memory of the process during a stage
+RSS_INTERVAL = 0.01
+
+# Functions of the slowest stage printed with --profile
+PROFILE_TOP_FUNCTIONS = 15
+
+# Fields of every stage record, any other field is a label of the stage
+STAGE_FIELDS = ['stage', 'rows', 'seconds', 'cpu_seconds', 'peak_rss_mb', 'peak_rss_delta_mb']
+
+
+def get_rss():
+	'''
+	INPUT
+	NONE
+
+	OUTPUT
+	rss - resident memory of this process in bytes, or None where /proc is not available
+	'''
+	try:
+		with open('/proc/self/statm') as file:
+			return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	except (OSError, ValueError):
+		return None
+
+
+def get_cpu_time():
+	'''
+	INPUT
+	NONE
+
+	OUTPUT
+	cpu - user and system CPU seconds of this process and of its child processes which
+	      have exited and been waited for, such as the workers of a process pool shut
+	      down within a stage. Only this process is counted where resource is not
+	      available
+	'''
+	cpu = time.process_time()
+	if resource is not None:
+		children = resource.getrusage(resource.RUSAGE_CHILDREN)
+		cpu += children.ru_utime + children.ru_stime
+	return cpu
+
+
+def get_stage_name(record):
+	'''
+	INPUT
+	record - stage record of a RunReport
+
+	OUTPUT
+	name - name of the stage followed by its labels, such as fit bogo randomforest grid
+	'''
+	return ' '.join([record['stage']] + [str(value) for key, value in record.items() if key not in STAGE_FIELDS])
+
+
+class Stage:
+	'''
+	Context manager measuring one stage of a RunReport: the wall time, the CPU time of the
+	process and its finished children (see get_cpu_time), the peak resident memory above
+	the memory at the start of the stage and, when the stage sets it, the number of rows
+	it handled. The memory is sampled by a background thread, so the peak of a stage is
+	not hidden by an earlier, larger stage like the process maximum would be.
+	'''
+
+	def __init__(self, report, name, labels):
+		'''
+		INPUT
+		report - the RunReport the stage belongs to
+		name - name of the stage
+		labels - dictionary of extra fields of the stage record, such as the offer type
+		'''
+		self.report = report
+		self.record = dict(stage=name, rows=None, **labels)
+		self.profiler = None
+
+	def __enter__(self):
+		self.start_rss = get_rss()
+		self.peak_rss = self.start_rss
+		self.sampling = threading.Event()
+		if self.start_rss is not None:
+			self.sampler = threading.Thread(target=self.sample, daemon=True)
+			self.sampler.start()
+		# Only one profiler can be active, stages nested in a profiled stage are not profiled
+		if self.report.profile and self.report.active == 0:
+			self.profiler = cProfile.Profile()
+			self.profiler.enable()
+		self.report.active += 1
+		self.start_cpu = get_cpu_time()
+		self.start = time.perf_counter()
+		return self.record
+
+	def sample(self):
+		while not self.sampling.wait(RSS_INTERVAL):
+			self.peak_rss = max(self.peak_rss, get_rss())
+
+	def __exit__(self, *exc_info):
+		self.record['seconds'] = time.perf_counter() - self.start
+		self.record['cpu_seconds'] = get_cpu_time() - self.start_cpu
+		self.report.active -= 1
+		if self.profiler is not None:
+			self.profiler.disable()
+		if self.start_rss is not None:
+			self.sampling.set()
+			self.sampler.join()
+			self.peak_rss = max(self.peak_rss, get_rss())
+			self.record['peak_rss_mb'] = self.peak_rss / 1024 ** 2
+			self.record['peak_rss_delta_mb'] = (self.peak_rss - self.start_rss) / 1024 ** 2
+		self.report.add(self.record, self.profiler)
+
+
+class RunReport:
+	'''
+	Stages of one run of a pipeline with their time, memory and row counts. Every stage is
+	a with block, and the report is written as JSON at the end of the run. With profile
+	set, the stages also run under cProfile and the statistics of the slowest stage are
+	kept.
+	'''
+
+	def __init__(self, pipeline, profile=False):
+		'''
+		INPUT
+		pipeline - name of the pipeline, such as process_data
+		profile - run the stages under cProfile to dump the slowest one with save_profile
+		'''
+		self.pipeline = pipeline
+		self.profile = profile
+		self.stages = []
+		self.slowest_profile = None
+		self.active = 0
+		self.started = datetime.now().isoformat(timespec='seconds')
+		self.start = time.perf_counter()
+		self.start_cpu = get_cpu_time()
+
+	def stage(self, name, **labels):
+		'''
+		INPUT
+		name - name of the stage
+		labels - extra fields of the stage record
+
+		OUTPUT
+		stage - context manager yielding the stage record, set its rows to the rows handled
+		'''
+		return Stage(self, name, labels)
+
+	def add(self, record, profiler=None):
+		# Keeps the profile of the slowest stage only, the others are dropped
+		self.stages.append(record)
+		if profiler is not None:
+			if self.slowest_profile is None or record['seconds'] > self.slowest_profile[0]['seconds']:
+				self.slowest_profile = (record, profiler)
+
+	def to_dict(self):
+		'''
+		INPUT
+		NONE
+
+		OUTPUT
+		report - JSON serialisable dictionary of the run and its stages
+		'''
+		slowest = max(self.stages, key=lambda record: record['seconds']) if self.stages else None
+		rss = [record['peak_rss_mb'] for record in self.stages if 'peak_rss_mb' in record]
+		return {'pipeline': self.pipeline, 'argv': sys.argv, 'started': self.started,
+		        'python': platform.python_version(), 'platform': platform.platform(),
+		        'seconds': time.perf_counter() - self.start, 'cpu_seconds': get_cpu_time() - self.start_cpu,
+		        'peak_rss_mb': max(rss) if rss else None,
+		        'slowest_stage': slowest['stage'] if slowest else None,
+		        'stages': self.stages}
+
+	def save(self, report_filepath):
+		'''
+		INPUT
+		report_filepath - JSON file to write the report to
+
+		OUTPUT
+		NONE
+		'''
+		with open(report_filepath, 'w') as file:
+			json.dump(self.to_dict(), file, indent=1, default=float)
+
+	def save_profile(self, profile_filepath):
+		'''
+		INPUT
+		profile_filepath - file to dump the pstats of the slowest stage to, read it with
+		                   python -m pstats or snakeviz
+
+		OUTPUT
+		NONE
+
+		Also prints the functions with the most cumulative time of the slowest stage.
+		'''
+		if self.slowest_profile is None:
+			return
+		record, profiler = self.slowest_profile
+		profiler.dump_stats(profile_filepath)
+		print('Profile of the slowest stage {} ({:.2f}s)\n    PROFILE: {}'.format(
+			get_stage_name(record), record['seconds'], profile_filepath))
+		pstats.Stats(profiler).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+
+	def print_summary(self):
+		'''
+		Prints the time, memory and rows of every stage.
+		'''
+		print('{:<44} {:>10} {:>10} {:>12} {:>10}'.format('stage', 'seconds', 'cpu', 'peak +MB', 'rows'))
+		for record in self.stages:
+			print('{:<44} {:>10.3f} {:>10.3f} {:>12} {:>10}'.format(
+				get_stage_name(record), record['seconds'], record['cpu_seconds'],
+				'{:.1f}'.format(record['peak_rss_delta_mb']) if 'peak_rss_delta_mb' in record else '-',
+				record['rows'] if record['rows'] is not None else '-'))
+
+
+def stage(report, name, **labels):
+	'''
+	INPUT
+	report - RunReport or None
+	name - name of the stage
+	labels - extra fields of the stage record
+
+	OUTPUT
+	stage - the stage of the report, or a context manager which measures nothing for
+	        functions called without a report
+	'''
+	if report is None:
+		return contextlib.nullcontext({})
+	return report.stage(name, **labels)
@@ -1,7 +1,17 @@
+import os
 import sys
+import json
+import sqlite3
+import argparse
+import itertools
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
-from sqlalchemy import create_engine
+from pandas.api.types import union_categoricals
+from sqlalchemy import create_engine, inspect
+
+from instrumentation import RunReport
 
 def create_customer_profile_from_timeline(person,person_transcript,offer_durations,offer_types):
 	'''
@@ -19,7 +29,7 @@ def create_customer_profile_from_timeline(person,person_transcript,offer_duratio
 	'''
 	customer_profile={}
 	customer_profile['person']=person
-	person_transcript=person_transcript.sort_values(['time'])
+	person_transcript=person_transcript.sort_values(['time'],kind='mergesort')
 
 	#Dictionary to keep track of offers active at a given time with value as valid till hour
 	offers_active={}
@@ -132,51 +142,499 @@ def create_customer_profile_from_timeline(person,person_transcript,offer_duratio
 
 	return customer_profile
 
-def create_customer_profiles(profile,portfolio,transcript):
+# Column order of the customer profile created from the transcript timeline
+PROFILE_COLUMNS=['person','#transaction_bogo','transaction_bogo_value','#transaction_discount',\
+		'transaction_discount_value','#transaction_informational','transaction_informational_value',\
+		'#transaction_no_offer','transaction_no_offer_value','completed_offers','#bogos','#discounts',\
+		'bogos_rewards','discounts_rewards','#random_rewards','random_rewards',\
+		'bogos_offered','discounts_offered','informationals_offered']
+
+# Column order of the per person and offer timeline state carried between transcript batches
+OFFER_STATE_COLUMNS=['person','offer_id','offer_expiry','offer_done','view_expiry','last_offer']
+
+# Additive per offer counts and sums of the offer funnel, summed across shards and batches
+FUNNEL_COUNT_COLUMNS=['received','viewed','completed','completed_after_view','rewards',\
+		'attributed_transactions','attributed_spend']
+
+# Columns of the per offer histogram of the hours from receiving an offer to viewing and completing it
+FUNNEL_HOURS_COLUMNS=['offer_id','hours','views','completions']
+
+# Channels an offer can be sent on, each one a 0/1 column of the offer funnel
+OFFER_CHANNELS=['email','mobile','social','web']
+
+# Transcript event types, the event column stores their position as an int8 code
+EVENT_TYPES=['offer received','offer viewed','transaction','offer completed']
+EVENT_DTYPE=pd.CategoricalDtype(EVENT_TYPES)
+
+# Column order of the cleaned transcript
+TRANSCRIPT_COLUMNS=['person','event','time','amount','reward','offer_id_merged']
+
+def decode_amounts(amounts):
 	'''
 	INPUT
-	profile - pandas dataframe containing the customer profile data
-	portfolio - pandas dataframe containing the offer portfolio data
-	transcript - pandas dataframe containing the transaction transcript data
+	amounts - float32 transaction amounts of the compact transcript
+
+	OUTPUT
+	amounts - float64 numpy array of the amounts, missing amounts are 0
+
+	The amounts are whole cents, rounding the float32 values to cents gives back the exact
+	float64 values of the transcript json, so the sums match a float64 transcript.
+	'''
+	return np.round(np.nan_to_num(np.asarray(amounts,dtype='float64')),2)
 
+def get_codes(values):
+	'''
+	INPUT
+	values - pandas series of person or offer ids
 
 	OUTPUT
-	customer_profile_complete - pandas dataframe containing customer profiles 
+	codes - int64 numpy array of the position of every value in uniques, -1 for missing values
+	uniques - object numpy array of the distinct values in sorted order
 
-	The function does the following:
-	1. Creates groups from the transcript dataset by person
-	2. Analyses the person timeline in order to create customer spend profile
-	3. Merges the customer profile with the original profile demographics information
-	4. Computes the offer types most used by count and value
+	Categorical columns of the compact transcript already hold these codes, other columns
+	are factorized.
 	'''
+	if isinstance(values.dtype,pd.CategoricalDtype) and values.cat.categories.is_monotonic_increasing:
+		return values.cat.codes.to_numpy(dtype='int64'),np.asarray(values.cat.categories,dtype='object')
+	codes,uniques=pd.factorize(values,sort=True)
+	return codes.astype('int64'),np.asarray(uniques,dtype='object')
 
-	# Dictionary objects to track the duration and type of various offers
+def get_offer_details(portfolio):
+	'''
+	INPUT
+	portfolio - pandas dataframe containing the offer portfolio data
+
+	OUTPUT
+	offer_durations - dictionary of offer id to offer duration in days
+	offer_types - dictionary of offer id to offer type
+	'''
 	offer_durations=dict(zip(portfolio['id'].values,portfolio['duration'].values))
 	offer_types=dict(zip(portfolio['id'].values,portfolio['offer_type'].values))
+	return offer_durations,offer_types
+
+def create_customer_timeline(transcript,offer_durations,offer_types,offer_state=None,funnel=False):
+	'''
+	INPUT
+	transcript - pandas dataframe containing the cleaned transaction transcript data
+	offer_durations - dictionary of offer id to offer duration in days
+	offer_types - dictionary of offer id to offer type
+	offer_state - optional pandas dataframe with the OFFER_STATE_COLUMNS left by earlier transcript
+	              events of the persons in the transcript
+	funnel - also return the offer funnel counts of the transcript events
+
+
+	OUTPUT
+	customer_profile_df - pandas dataframe with one customer profile per person in the transcript
+	offer_state - pandas dataframe with the OFFER_STATE_COLUMNS after the transcript events
+	offer_funnel - tuple of the per offer FUNNEL_COUNT_COLUMNS and the FUNNEL_HOURS_COLUMNS
+	               histogram, see create_offer_funnel, only returned if funnel is set
+
+	Columnar version of create_customer_profile_from_timeline applied to every person.
+	The function does the following:
+	1. Sorts the transcript once by person and time (ties keep transcript order)
+	2. Forward fills the latest offer received, completed and viewed state within each
+	   person and offer to find the views made while the offer was active and not done
+	3. Forward fills the last effective view within each person to attribute transactions
+	   to the last seen offer which is still valid
+	4. Aggregates all the counts and sums in a single groupby on person
+	5. Keeps the final state of every offer which can still affect events after the transcript
+
+	The offer state is fed in as seed rows placed before the events of each person, so a
+	transcript split in time ordered batches gives the same totals as a single pass.
+	'''
+	events=transcript[['person','time','event','offer_id_merged','amount','reward']]
+	seeded=offer_state is not None and len(offer_state)>0
+	if seeded:
+		seeds=pd.DataFrame({'person':offer_state['person'].to_numpy(),'time':-np.inf,'event':'seed',\
+					'offer_id_merged':offer_state['offer_id'].to_numpy()})
+		for column in OFFER_STATE_COLUMNS[2:]:
+			seeds['seed_'+column]=offer_state[column].to_numpy(dtype='float64')
+		events=pd.concat([seeds,events.astype({'person':'object','event':'object','offer_id_merged':'object'})],\
+					ignore_index=True)
+	events=events.sort_values(['person','time'],kind='mergesort').reset_index(drop=True)
+
+	person_codes,persons=get_codes(events['person'])
+	offer_codes,offers=get_codes(events['offer_id_merged'])
+
+	time=events['time'].to_numpy(dtype='float64')
+	# Event codes in EVENT_TYPES order, seed rows get the next code
+	event=pd.Categorical(events['event'],categories=EVENT_TYPES+['seed']).codes
+	amount=decode_amounts(events['amount'])
+	reward=events['reward'].fillna(0).to_numpy(dtype='float64')
+
+	is_received=event==0
+	is_viewed=event==1
+	is_transaction=event==2
+	is_completed=event==3
+
+	# Offer metadata looked up once per distinct offer instead of once per event
+	durations=np.append(pd.Series(offers).map(offer_durations).to_numpy(dtype='float64'),np.nan)
+	types=np.append(pd.Series(offers).map(offer_types).to_numpy(dtype='object'),'')
+	offer_duration=durations[offer_codes]
+	offer_type=types[offer_codes]
+
+	# Offer state is tracked per person and offer pair
+	pair_key=pd.Series(person_codes.astype('int64')*(len(offers)+1)+offer_codes)
+
+	# Valid till hour of the latest offer received, i.e. the offer is active while time <= expiry
+	expiry=np.where(is_received,time+24*offer_duration,np.nan)
+	# Offer is done if it was completed after it was last received
+	done=np.where(is_received,0.0,np.where(is_completed,1.0,np.nan))
+	if seeded:
+		is_seed=event==len(EVENT_TYPES)
+		expiry=np.where(is_seed,events['seed_offer_expiry'].to_numpy(),expiry)
+		done=np.where(is_seed,events['seed_offer_done'].to_numpy(),done)
+	expiry=pd.Series(expiry).groupby(pair_key).ffill().to_numpy()
+	done=pd.Series(done).groupby(pair_key).ffill().fillna(0).to_numpy()==1
+
+	with np.errstate(invalid='ignore'):
+		effective_view=is_viewed & ~done & (expiry>=time)
+
+	# Valid till hour of every effective view, completed offers count as viewed only if the
+	# last effective view of the offer has not expired
+	view_expiry=np.where(effective_view,expiry,np.nan)
+	last_view=np.where(effective_view,np.arange(len(events)),np.nan)
+	if seeded:
+		view_expiry=np.where(is_seed,events['seed_view_expiry'].to_numpy(),view_expiry)
+		last_view=np.where(is_seed & (events['seed_last_offer'].to_numpy()==1),np.arange(len(events)),last_view)
+	view_expiry_filled=pd.Series(view_expiry).groupby(pair_key).ffill().to_numpy()
+
+	### ASSUMPTION HERE IS THAT A SPEND CAN BE ATTRIBUTED TO THE LAST OFFER SEEN BY USER
+	last_view=pd.Series(last_view).groupby(person_codes).ffill().fillna(-1).to_numpy(dtype='int64')
+	with np.errstate(invalid='ignore'):
+		in_view=is_completed & (view_expiry_filled>=time)
+		attributed=is_transaction & (last_view>=0) & (view_expiry[last_view]>=time)
+	last_offer=np.where(attributed,offer_type[last_view],'')
+
+	columns={}
+	for name in ['bogo','discount','informational']:
+		spend=attributed & (last_offer==name)
+		columns['#transaction_'+name]=spend
+		columns['transaction_'+name+'_value']=np.where(spend,amount,0.0)
+	no_offer=is_transaction & ~attributed
+	columns['#transaction_no_offer']=no_offer
+	columns['transaction_no_offer_value']=np.where(no_offer,amount,0.0)
+	columns['completed_offers']=is_completed
+	for name in ['bogo','discount']:
+		completed=in_view & (offer_type==name)
+		columns['#'+name+'s']=completed
+		columns[name+'s_rewards']=np.where(completed,reward,0.0)
+	random_rewards=is_completed & ~in_view
+	columns['#random_rewards']=random_rewards
+	columns['random_rewards']=np.where(random_rewards,reward,0.0)
+	for name in ['bogo','discount','informational']:
+		columns[name+'s_offered']=is_received & (offer_type==name)
+
+	aggregates=pd.DataFrame(columns).groupby(person_codes).sum()
+	aggregates.insert(0,'person',persons[aggregates.index])
+	customer_profile_df=aggregates[PROFILE_COLUMNS].reset_index(drop=True)
+
+	# Final state of every person and offer pair and the offer behind the last effective view
+	offer_rows=np.flatnonzero(offer_codes>=0)
+	pair_last=pd.Series(offer_rows).groupby(pair_key.to_numpy()[offer_rows]).last().to_numpy()
+	person_last=pd.Series(np.arange(len(events))).groupby(person_codes).last().to_numpy()
+	last_offer_rows=last_view[person_last]
+	last_offer_pairs=set(pair_key.to_numpy()[last_offer_rows[last_offer_rows>=0]])
+	offer_state=pd.DataFrame({'person':persons[person_codes[pair_last]],\
+				'offer_id':offers[offer_codes[pair_last]],\
+				'offer_expiry':expiry[pair_last],\
+				'offer_done':done[pair_last].astype('int64'),\
+				'view_expiry':view_expiry_filled[pair_last],\
+				'last_offer':pair_key.iloc[pair_last].isin(last_offer_pairs).to_numpy().astype('int64')})
+
+	offer_state=prune_offer_state(offer_state,time.max() if len(time)>0 else -np.inf)
+
+	if not funnel:
+		return customer_profile_df,offer_state
+
+	# The same arrays give the funnel of every offer, keyed by offer instead of person
+	offer_funnel=create_offer_funnel(offers,offer_codes,time,expiry-24*offer_duration,is_received,\
+				effective_view,is_completed,in_view,reward,np.where(attributed,offer_codes[last_view],-1),amount)
+	return customer_profile_df,offer_state,offer_funnel
+
+def prune_offer_state(offer_state,watermark):
+	'''
+	INPUT
+	offer_state - pandas dataframe with the OFFER_STATE_COLUMNS
+	watermark - time of the last processed transcript event
+
+	OUTPUT
+	offer_state - the rows which can still affect events from the watermark on
+
+	Offers whose receipt and view both expired before the watermark are dropped. The
+	expired view of a live offer can not affect a later event either, so its view_expiry
+	is cleared and it no longer counts as the last offer. The state is then the same
+	whether the transcript was processed in one pass or in time ordered batches.
+	'''
+	with np.errstate(invalid='ignore'):
+		view_live=(offer_state['view_expiry']>=watermark).to_numpy()
+		live=(offer_state['offer_expiry']>=watermark).to_numpy() | view_live
+	offer_state=offer_state.assign(view_expiry=offer_state['view_expiry'].where(view_live),\
+				last_offer=np.where(view_live,offer_state['last_offer'],0))
+	return offer_state[live].reset_index(drop=True)
+
+def create_offer_funnel(offers,offer_codes,time,received_time,is_received,effective_view,is_completed,\
+			in_view,reward,spend_offer_codes,amount):
+	'''
+	INPUT
+	offers - object numpy array of the distinct offer ids
+	offer_codes - position in offers of the offer of every event, -1 for transactions
+	time - float numpy array of the event times
+	received_time - time the offer of every event was last received, nan if unknown
+	is_received, effective_view, is_completed - boolean numpy arrays of the offer events
+	in_view - boolean numpy array of the completions of an offer viewed in time
+	reward - float numpy array of the rewards of the completions
+	spend_offer_codes - position in offers of the offer every transaction is attributed to, -1 if none
+	amount - float numpy array of the transaction amounts
+
+
+	OUTPUT
+	funnel_counts - pandas dataframe with the offer_id and the FUNNEL_COUNT_COLUMNS of every offer
+	funnel_hours - pandas dataframe with the FUNNEL_HOURS_COLUMNS, the number of effective views
+	               and completions per offer and whole hours since the offer was received
+
+	Only counts and sums are kept, so the funnels of shards or time ordered batches add
+	up to the funnel of the whole transcript and the medians come from the histogram.
+	'''
+	counts=pd.DataFrame({'received':is_received,'viewed':effective_view,'completed':is_completed,\
+				'completed_after_view':in_view,'rewards':np.where(is_completed,reward,0.0)}).groupby(offer_codes).sum()
+	is_spend=spend_offer_codes>=0
+	spend=pd.DataFrame({'attributed_transactions':is_spend,'attributed_spend':np.where(is_spend,amount,0.0)})\
+				.groupby(spend_offer_codes).sum()
+	funnel_counts=counts.join(spend,how='outer').fillna(0)
+	funnel_counts=funnel_counts[funnel_counts.index>=0]
+	funnel_counts.insert(0,'offer_id',offers[funnel_counts.index])
+	funnel_counts=funnel_counts[['offer_id']+FUNNEL_COUNT_COLUMNS].reset_index(drop=True)
+
+	# Completions of offers received before an expired offer state was dropped have no receipt time
+	timed=(effective_view | is_completed) & ~np.isnan(received_time)
+	funnel_hours=pd.DataFrame({'offer':offer_codes[timed],'hours':(time-received_time)[timed],\
+				'views':effective_view[timed],'completions':is_completed[timed]})\
+				.groupby(['offer','hours']).sum().reset_index()
+	funnel_hours.insert(0,'offer_id',offers[funnel_hours['offer'].to_numpy()])
+	return funnel_counts,funnel_hours[FUNNEL_HOURS_COLUMNS]
+
+def combine_offer_funnels(offer_funnels):
+	'''
+	INPUT
+	offer_funnels - list of funnel_counts, funnel_hours tuples of create_offer_funnel
+
+
+	OUTPUT
+	funnel_counts - pandas dataframe with the summed FUNNEL_COUNT_COLUMNS per offer
+	funnel_hours - pandas dataframe with the summed FUNNEL_HOURS_COLUMNS per offer and hours
+	'''
+	funnel_counts=pd.concat([counts for counts,_ in offer_funnels],ignore_index=True)
+	funnel_counts=funnel_counts.groupby('offer_id',sort=True)[FUNNEL_COUNT_COLUMNS].sum().reset_index()
+	funnel_hours=pd.concat([hours for _,hours in offer_funnels],ignore_index=True)
+	funnel_hours=funnel_hours.groupby(['offer_id','hours'],sort=True)[['views','completions']].sum().reset_index()
+	return funnel_counts,funnel_hours[FUNNEL_HOURS_COLUMNS]
+
+def get_histogram_median(values,counts):
+	'''
+	INPUT
+	values - numpy array of the sorted distinct values
+	counts - numpy array of the number of times each value occurs
+
+
+	OUTPUT
+	median - median of the values repeated by their counts, nan if there are none
+	'''
+	cumulative=np.cumsum(counts)
+	if len(cumulative)==0 or cumulative[-1]==0:
+		return np.nan
+	n=cumulative[-1]
+	low,high=np.searchsorted(cumulative,[(n-1)//2+1,n//2+1])
+	return (values[low]+values[high])/2
+
+def summarize_offer_funnel(offer_funnel,portfolio):
+	'''
+	INPUT
+	offer_funnel - funnel_counts, funnel_hours tuple of create_offer_funnel or combine_offer_funnels
+	portfolio - pandas dataframe containing the offer portfolio data
+
 
-	transcript_groups = transcript.groupby(['person'])
+	OUTPUT
+	offer_funnel_df - pandas dataframe with one row per portfolio offer
+
+	The function does the following:
+	1. Joins the funnel counts to the offer type, difficulty, reward, duration and channels
+	   of the portfolio, with a 0/1 column per channel to filter and group the funnel by channel
+	2. Computes the view rate, the completion rate and the completion rate of viewed offers
+	3. Computes the median hours from receiving an offer to viewing and to completing it
+	'''
+	funnel_counts,funnel_hours=offer_funnel
+	offer_funnel_df=pd.DataFrame({'offer_id':portfolio['id'],'offer_type':portfolio['offer_type'],\
+				'difficulty':portfolio['difficulty'],'reward':portfolio['reward'],\
+				'duration':portfolio['duration'],\
+				'channels':portfolio['channels'].apply(lambda channels:','.join(sorted(channels)))})
+	for channel in OFFER_CHANNELS:
+		offer_funnel_df['channel_'+channel]=portfolio['channels'].apply(lambda channels:int(channel in channels))
+	offer_funnel_df=offer_funnel_df.merge(funnel_counts,how='left',on='offer_id')
+	offer_funnel_df[FUNNEL_COUNT_COLUMNS]=offer_funnel_df[FUNNEL_COUNT_COLUMNS].fillna(0)
+	for column in FUNNEL_COUNT_COLUMNS:
+		if column not in ['rewards','attributed_spend']:
+			offer_funnel_df[column]=offer_funnel_df[column].astype('int64')
 
-	customer_profiles=[]
-	
-	# Iterate over each person transcript to create event based profile
-	for person,person_transcript in transcript_groups:
-		customer_profile= create_customer_profile_from_timeline(person,person_transcript,offer_durations,offer_types)
+	with np.errstate(invalid='ignore',divide='ignore'):
+		offer_funnel_df['view_rate']=offer_funnel_df['viewed']/offer_funnel_df['received']
+		offer_funnel_df['completion_rate']=offer_funnel_df['completed']/offer_funnel_df['received']
+		offer_funnel_df['viewed_completion_rate']=offer_funnel_df['completed_after_view']/offer_funnel_df['viewed']
 
-		customer_profiles.append(customer_profile)
+	hours=funnel_hours.groupby('offer_id')
+	for column,name in [('views','median_hours_to_view'),('completions','median_hours_to_complete')]:
+		medians=hours.apply(lambda group:get_histogram_median(group['hours'].to_numpy(),group[column].to_numpy())) \
+					if len(funnel_hours)>0 else pd.Series(dtype='float64')
+		offer_funnel_df[name]=offer_funnel_df['offer_id'].map(medians).astype('float64')
 
-	customer_profile_df=pd.DataFrame(customer_profiles)
+	return offer_funnel_df.sort_values('offer_id',kind='mergesort').reset_index(drop=True)
 
+def create_customer_profiles_vectorized(transcript,offer_durations,offer_types):
+	'''
+	INPUT
+	transcript - pandas dataframe containing the cleaned transaction transcript data
+	offer_durations - dictionary of offer id to offer duration in days
+	offer_types - dictionary of offer id to offer type
+
+
+	OUTPUT
+	customer_profile_df - pandas dataframe with one customer profile per person
+	'''
+	customer_profile_df,_=create_customer_timeline(transcript,offer_durations,offer_types)
+	return customer_profile_df
+
+def create_customer_profile_df(transcript,offer_durations,offer_types,engine='vectorized'):
+	'''
+	INPUT
+	transcript - pandas dataframe containing the cleaned transaction transcript data
+	offer_durations - dictionary of offer id to offer duration in days
+	offer_types - dictionary of offer id to offer type
+	engine - 'vectorized' for the columnar engine or 'timeline' for the per person event loop
+
+
+	OUTPUT
+	customer_profile_df - pandas dataframe with one customer profile per person sorted by person
+	'''
+	if engine=='vectorized':
+		return create_customer_profiles_vectorized(transcript,offer_durations,offer_types)
+	elif engine=='timeline':
+		transcript=transcript.assign(amount=decode_amounts(transcript['amount']))
+		transcript_groups = transcript.groupby(transcript['person'].astype('object'))
+
+		customer_profiles=[]
+
+		# Iterate over each person transcript to create event based profile
+		for person,person_transcript in transcript_groups:
+			customer_profile= create_customer_profile_from_timeline(person,person_transcript,offer_durations,offer_types)
+
+			customer_profiles.append(customer_profile)
+
+		return pd.DataFrame(customer_profiles,columns=PROFILE_COLUMNS)
+	else:
+		raise ValueError('Unknown profile engine: {}'.format(engine))
+
+# Offer dictionaries and engine set once per worker process by _init_profile_worker
+_worker_state={}
+
+def _init_profile_worker(offer_durations,offer_types,engine):
+	_worker_state['offer_durations']=offer_durations
+	_worker_state['offer_types']=offer_types
+	_worker_state['engine']=engine
+
+def _create_shard_profile_df(shard):
+	return create_customer_profile_df(shard,_worker_state['offer_durations'],\
+					_worker_state['offer_types'],_worker_state['engine'])
+
+def _create_shard_timeline(shard):
+	return create_customer_timeline(shard,_worker_state['offer_durations'],_worker_state['offer_types'])
+
+def _create_shard_funnel_timeline(shard):
+	return create_customer_timeline(shard,_worker_state['offer_durations'],_worker_state['offer_types'],funnel=True)
+
+def create_customer_profiles_sharded(transcript,offer_durations,offer_types,engine='vectorized',workers=2,\
+					with_state=False,with_funnel=False):
+	'''
+	INPUT
+	transcript - pandas dataframe containing the cleaned transaction transcript data
+	offer_durations - dictionary of offer id to offer duration in days
+	offer_types - dictionary of offer id to offer type
+	engine - profile engine used by every worker
+	workers - number of worker processes and shards
+	with_state - also return the offer state built by create_customer_timeline
+	with_funnel - also return the offer funnel of create_customer_timeline, needs with_state
+
+
+	OUTPUT
+	customer_profile_df - pandas dataframe with one customer profile per person sorted by person
+	offer_state - pandas dataframe with the offer state, only returned if with_state is set
+	offer_funnel - offer funnel summed over the shards, only returned if with_funnel is set
+
+	The function does the following:
+	1. Hash partitions the transcript by person so every timeline lands in exactly one shard
+	2. Starts a process pool which receives the offer dictionaries once per worker
+	3. Builds the profiles of each shard in parallel
+	4. Merges the shard profiles in person order so the output matches the serial path
+	'''
+	events=transcript[['person','time','event','offer_id_merged','amount','reward']]
+	shard_ids=pd.util.hash_pandas_object(events['person'],index=False).to_numpy()%workers
+	shards=[events[shard_ids==shard] for shard in range(workers)]
+	shards=[shard for shard in shards if len(shard)>0]
+
+	with ProcessPoolExecutor(max_workers=workers,initializer=_init_profile_worker,\
+				initargs=(offer_durations,offer_types,engine)) as executor:
+		if with_funnel:
+			results=list(executor.map(_create_shard_funnel_timeline,shards))
+		elif with_state:
+			results=list(executor.map(_create_shard_timeline,shards))
+		else:
+			results=[(customer_profile_df,None) for customer_profile_df in executor.map(_create_shard_profile_df,shards)]
+
+	if len(results)==0:
+		customer_profile_df=pd.DataFrame(columns=PROFILE_COLUMNS)
+		offer_state=pd.DataFrame(columns=OFFER_STATE_COLUMNS)
+		offer_funnel=(pd.DataFrame(columns=['offer_id']+FUNNEL_COUNT_COLUMNS),pd.DataFrame(columns=FUNNEL_HOURS_COLUMNS))
+	else:
+		customer_profile_df=pd.concat([result[0] for result in results],ignore_index=True)
+		customer_profile_df=customer_profile_df.sort_values('person',kind='mergesort').reset_index(drop=True)
+		if with_state:
+			offer_state=pd.concat([result[1] for result in results],ignore_index=True)
+			offer_state=offer_state.sort_values('person',kind='mergesort').reset_index(drop=True)
+			# Every shard pruned its state at its own last event, which may be before the last event overall
+			offer_state=prune_offer_state(offer_state,transcript['time'].max())
+		if with_funnel:
+			offer_funnel=combine_offer_funnels([result[2] for result in results])
+
+	if with_funnel:
+		return customer_profile_df,offer_state,offer_funnel
+	if with_state:
+		return customer_profile_df,offer_state
+	return customer_profile_df
+
+def complete_customer_profiles(customer_profile_df,profile):
+	'''
+	INPUT
+	customer_profile_df - pandas dataframe with the customer profiles built from the transcript
+	profile - pandas dataframe containing the customer profile data
+
+
+	OUTPUT
+	customer_profile_complete - pandas dataframe containing customer profiles
+
+	The function does the following:
+	1. Merges the customer profile with the original profile demographics information
+	2. Computes the offer types most used by count and value
+	'''
 	# Merge with the original profile dataset to get demographic information
 	customer_profile_complete=customer_profile_df.merge(profile,how='inner',left_on='person',right_on='id')
 	customer_profile_complete=customer_profile_complete.drop(['id'],axis=1)
 
-	
-	# Computes the offer type where spend amount was maximum 
+
+	# Computes the offer type where spend amount was maximum
 	customer_profile_complete['best_offer_value']=customer_profile_complete[['transaction_informational_value',\
 	                                                     'transaction_no_offer_value',\
 	                                                    'transaction_discount_value',\
 	                                                    'transaction_bogo_value']].idxmax(axis=1)
-	# Compute the offer type which was used the most                                                  
+	# Compute the offer type which was used the most
 	customer_profile_complete['best_offer_count']=customer_profile_complete[['#transaction_informational',\
 	                                                     '#transaction_no_offer',\
 	                                                    '#transaction_discount',\
@@ -185,6 +643,406 @@ def create_customer_profiles(profile,portfolio,transcript):
 
 	return customer_profile_complete
 
+def create_customer_profiles(profile,portfolio,transcript,engine='vectorized',workers=1):
+	'''
+	INPUT
+	profile - pandas dataframe containing the customer profile data
+	portfolio - pandas dataframe containing the offer portfolio data
+	transcript - pandas dataframe containing the transaction transcript data
+	engine - 'vectorized' for the columnar engine or 'timeline' for the per person event loop
+	workers - number of processes used to build the profiles, 1 builds them in this process
+
+
+	OUTPUT
+	customer_profile_complete - pandas dataframe containing customer profiles
+
+	The function does the following:
+	1. Creates groups from the transcript dataset by person
+	2. Analyses the person timeline in order to create customer spend profile
+	3. Merges the customer profile with the original profile demographics information
+	4. Computes the offer types most used by count and value
+	'''
+
+	# Dictionary objects to track the duration and type of various offers
+	offer_durations,offer_types=get_offer_details(portfolio)
+
+	if workers>1:
+		customer_profile_df=create_customer_profiles_sharded(transcript,offer_durations,offer_types,engine,workers)
+	else:
+		customer_profile_df=create_customer_profile_df(transcript,offer_durations,offer_types,engine)
+
+	return complete_customer_profiles(customer_profile_df,profile)
+
+def create_customer_timeline_state(portfolio,transcript,workers=1,funnel=False):
+	'''
+	INPUT
+	portfolio - pandas dataframe containing the offer portfolio data
+	transcript - pandas dataframe containing the transaction transcript data
+	workers - number of processes used to build the profiles, 1 builds them in this process
+	funnel - also return the offer funnel built in the same pass
+
+
+	OUTPUT
+	customer_profile_df - pandas dataframe with the running transcript totals of every person
+	offer_state - pandas dataframe with the offer state needed to process later transcript events
+	offer_funnel - funnel_counts, funnel_hours tuple of create_offer_funnel, only returned if
+	               funnel is set, see summarize_offer_funnel for the offer_funnel table
+	'''
+	offer_durations,offer_types=get_offer_details(portfolio)
+
+	if workers>1:
+		return create_customer_profiles_sharded(transcript,offer_durations,offer_types,'vectorized',workers,\
+					with_state=True,with_funnel=funnel)
+	return create_customer_timeline(transcript,offer_durations,offer_types,funnel=funnel)
+
+# Page cache of the SQL engine work database in KiB, larger sorts spill to temporary files
+SQL_CACHE_KIB=262144
+
+# Annotates every transcript event of the SQL engine with the offer state of create_customer_timeline:
+# r orders the events of a person by time (ties keep transcript order), the windows over r forward fill
+# the latest receipt, completion and effective view of each person and offer and of each person
+TIMELINE_SQL='''
+CREATE TABLE timeline AS
+WITH ordered AS (
+	SELECT t.*, o.offer_type, o.duration,
+		ROW_NUMBER() OVER (PARTITION BY t.person ORDER BY t.time, t.pos) AS r
+	FROM transcript t LEFT JOIN offers o ON o.code = t.offer_id),
+state AS (
+	SELECT *,
+		MAX(CASE WHEN event = 0 THEN time END) OVER pair AS received_time,
+		MAX(CASE WHEN event = 0 THEN time + 24 * duration END) OVER pair AS expiry,
+		COALESCE(MAX(CASE WHEN event = 3 THEN r END) OVER pair, 0) >
+			COALESCE(MAX(CASE WHEN event = 0 THEN r END) OVER pair, 0) AS done
+	FROM ordered
+	WINDOW pair AS (PARTITION BY person, offer_id ORDER BY r ROWS UNBOUNDED PRECEDING)),
+views AS (
+	SELECT *, COALESCE(event = 1 AND NOT done AND expiry >= time, 0) AS effective_view FROM state)
+SELECT person, r, event, time, amount, reward, offer_id, offer_type, received_time, expiry, done, effective_view,
+	MAX(CASE WHEN effective_view THEN expiry END) OVER pair AS view_expiry,
+	MAX(CASE WHEN effective_view THEN r END) OVER person_events AS last_view
+FROM views
+WINDOW pair AS (PARTITION BY person, offer_id ORDER BY r ROWS UNBOUNDED PRECEDING),
+	person_events AS (PARTITION BY person ORDER BY r ROWS UNBOUNDED PRECEDING)
+'''
+
+# Joins every transaction to the effective view it is attributed to, the view must not have expired
+ATTRIBUTION_SQL='''
+FROM timeline t LEFT JOIN timeline a
+	ON t.event = 2 AND a.person = t.person AND a.r = t.last_view AND a.expiry >= t.time
+'''
+
+def connect_work_database(work_filepath):
+	'''
+	INPUT
+	work_filepath - file path for the SQLite work database of the SQL engine
+
+	OUTPUT
+	connection - sqlite3 connection in autocommit mode, set up for bulk loads and large sorts
+	'''
+	connection=sqlite3.connect(work_filepath,isolation_level=None)
+	connection.execute('PRAGMA journal_mode=OFF')
+	connection.execute('PRAGMA synchronous=OFF')
+	connection.execute('PRAGMA temp_store=FILE')
+	connection.execute('PRAGMA cache_size=-{}'.format(SQL_CACHE_KIB))
+	return connection
+
+def load_transcript_database(portfolio,transcript_chunks,work_filepath):
+	'''
+	INPUT
+	portfolio - pandas dataframe containing the offer portfolio data
+	transcript_chunks - iterable of cleaned transcript chunks, see read_transcript_chunks
+	work_filepath - file path for the SQLite work database of the SQL engine, replaced if it exists
+
+
+	OUTPUT
+	events - number of transcript events loaded
+	watermark - time of the last transcript event
+
+	Inserts the portfolio and the chunks, one at a time, into the offers and transcript
+	tables, with the position of every event in the transcript to keep the order of events
+	at the same time. Persons and offers are stored as integer codes, which the window
+	functions sort much faster than the id strings, the persons and offers tables map the
+	codes back to the ids.
+	'''
+	if os.path.exists(work_filepath):
+		os.remove(work_filepath)
+	connection=connect_work_database(work_filepath)
+	try:
+		connection.execute('BEGIN')
+		connection.execute('CREATE TABLE offers (code INTEGER PRIMARY KEY, offer_id TEXT, duration REAL, offer_type TEXT)')
+		offer_codes={offer:code for code,offer in enumerate(portfolio['id'])}
+		connection.executemany('INSERT INTO offers VALUES (?, ?, ?, ?)',zip(offer_codes.values(),offer_codes.keys(),\
+					portfolio['duration'].astype('float64').tolist(),portfolio['offer_type'].astype('object')))
+		events,watermark=load_transcript_table(connection,transcript_chunks,offer_codes)
+		connection.execute('COMMIT')
+	finally:
+		connection.close()
+	return events,watermark
+
+def load_transcript_table(connection,transcript_chunks,offer_codes):
+	'''
+	INPUT
+	connection - sqlite3 connection of the SQL engine work database
+	transcript_chunks - iterable of cleaned transcript chunks, see read_transcript_chunks
+	offer_codes - dictionary of offer id to the integer code in the offers table, offers
+	              which are not in the portfolio are added to it and to the table
+
+
+	OUTPUT
+	events - number of transcript events loaded
+	watermark - time of the last transcript event
+	'''
+	connection.execute('CREATE TABLE transcript (pos INTEGER PRIMARY KEY, person INTEGER, event INTEGER, '\
+				'time INTEGER, amount REAL, reward REAL, offer_id INTEGER)')
+	person_codes={}
+	new_offers=[]
+	events=0
+	watermark=-np.inf
+	for chunk in transcript_chunks:
+		persons=[person_codes.setdefault(person,len(person_codes)) for person in chunk['person'].cat.categories]
+		offers=[]
+		for offer in chunk['offer_id_merged'].cat.categories:
+			if offer not in offer_codes:
+				offer_codes[offer]=len(offer_codes)
+				new_offers.append(offer)
+			offers.append(offer_codes[offer])
+		offer_ids=pd.Series(np.array(offers+[-1],dtype='int64')[chunk['offer_id_merged'].cat.codes.to_numpy()])
+		rows=zip(range(events,events+len(chunk)),np.asarray(persons,dtype='int64')[chunk['person'].cat.codes.to_numpy()].tolist(),\
+				chunk['event'].cat.codes.to_numpy().tolist(),chunk['time'].to_numpy().tolist(),\
+				decode_amounts(chunk['amount']).tolist(),chunk['reward'].fillna(0).to_numpy(dtype='float64').tolist(),\
+				offer_ids.astype('object').where(offer_ids>=0,None))
+		connection.executemany('INSERT INTO transcript VALUES (?, ?, ?, ?, ?, ?, ?)',rows)
+		events+=len(chunk)
+		if len(chunk)>0:
+			watermark=max(watermark,float(chunk['time'].max()))
+
+	connection.execute('CREATE TABLE persons (code INTEGER PRIMARY KEY, person TEXT)')
+	connection.executemany('INSERT INTO persons VALUES (?, ?)',((code,person) for person,code in person_codes.items()))
+	connection.executemany('INSERT INTO offers (code, offer_id) VALUES (?, ?)',((offer_codes[offer],offer) for offer in new_offers))
+	# Lets the events of every person be read in time order without sorting them
+	connection.execute('CREATE INDEX ix_transcript_person_time ON transcript (person, time, pos)')
+	return events,watermark
+
+def create_customer_timeline_sql(work_filepath,funnel=False):
+	'''
+	INPUT
+	work_filepath - SQLite work database written by load_transcript_database
+	funnel - also return the offer funnel built in the same pass
+
+
+	OUTPUT
+	customer_profile_df - pandas dataframe with one customer profile per person in the transcript
+	offer_state - pandas dataframe with the OFFER_STATE_COLUMNS after the transcript events
+	offer_funnel - funnel_counts, funnel_hours tuple as create_offer_funnel returns, only
+	               returned if funnel is set
+
+	SQL version of create_customer_timeline, the transcript is never held in memory.
+	The function does the following:
+	1. Annotates every event with the offer state using window functions, see TIMELINE_SQL
+	2. Attributes the transactions with a self join on the last effective view and sums
+	   the customer profiles with a GROUP BY on person
+	3. Keeps the final state of every offer which can still affect events after the transcript
+	SQLite sorts within a page cache of SQL_CACHE_KIB and spills to temporary files, so only
+	the profiles and the offer state have to fit in memory.
+	'''
+	connection=connect_work_database(work_filepath)
+	try:
+		connection.execute('BEGIN')
+		connection.execute('DROP TABLE IF EXISTS timeline')
+		connection.execute(TIMELINE_SQL)
+		connection.execute('CREATE INDEX ix_timeline_person_r ON timeline (person, r)')
+		connection.execute('COMMIT')
+		watermark=connection.execute('SELECT MAX(time) FROM timeline').fetchone()[0]
+
+		def total(condition,value=None):
+			return 'SUM(CASE WHEN {} THEN {} ELSE 0 END)'.format(condition,value or 1)
+
+		attributed='a.r IS NOT NULL'
+		in_view='t.event = 3 AND t.view_expiry >= t.time'
+		columns=[]
+		for name in ['bogo','discount','informational']:
+			spend="{} AND a.offer_type = '{}'".format(attributed,name)
+			columns+=[total(spend),total(spend,'t.amount')]
+		no_offer='t.event = 2 AND a.r IS NULL'
+		columns+=[total(no_offer),total(no_offer,'t.amount'),total('t.event = 3')]
+		for name in ['bogo','discount']:
+			columns.append(total("{} AND t.offer_type = '{}'".format(in_view,name)))
+		for name in ['bogo','discount']:
+			columns.append(total("{} AND t.offer_type = '{}'".format(in_view,name),'t.reward'))
+		random_rewards='t.event = 3 AND NOT COALESCE(t.view_expiry >= t.time, 0)'
+		columns+=[total(random_rewards),total(random_rewards,'t.reward')]
+		for name in ['bogo','discount','informational']:
+			columns.append(total("t.event = 0 AND t.offer_type = '{}'".format(name)))
+		customer_profile_df=pd.read_sql_query('SELECT p.person, c.* FROM (SELECT t.person AS code, {} {} GROUP BY t.person) c '\
+					'JOIN persons p ON p.code = c.code ORDER BY p.person'.format(', '.join(columns),ATTRIBUTION_SQL),connection)
+		customer_profile_df=customer_profile_df.drop(columns='code')
+		customer_profile_df.columns=PROFILE_COLUMNS
+
+		# Final state of every person and offer pair and the offer behind the last effective view
+		offer_state=pd.read_sql_query('''
+			WITH last_offers AS (
+				SELECT v.person, v.offer_id FROM timeline v JOIN (
+					SELECT person, MAX(CASE WHEN effective_view THEN r END) AS r FROM timeline GROUP BY person) l
+				ON v.person = l.person AND v.r = l.r)
+			SELECT p.person, o.offer_id, s.expiry AS offer_expiry, s.done AS offer_done,
+				CASE WHEN s.view_expiry >= :watermark THEN s.view_expiry END AS view_expiry,
+				COALESCE(l.offer_id IS NOT NULL AND s.view_expiry >= :watermark, 0) AS last_offer
+			FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY person, offer_id ORDER BY r DESC) AS k
+				FROM timeline WHERE offer_id IS NOT NULL) s
+			JOIN persons p ON p.code = s.person JOIN offers o ON o.code = s.offer_id
+			LEFT JOIN last_offers l ON l.person = s.person AND l.offer_id = s.offer_id
+			WHERE s.k = 1 AND (s.expiry >= :watermark OR s.view_expiry >= :watermark)
+			ORDER BY p.person, o.offer_id''',connection,params={'watermark':watermark})
+		offer_state=offer_state.astype({'offer_expiry':'float64','offer_done':'int64','view_expiry':'float64',\
+					'last_offer':'int64'})
+
+		if not funnel:
+			return customer_profile_df,offer_state
+
+		funnel_counts=pd.read_sql_query('''
+			SELECT o.offer_id, received, viewed, completed, completed_after_view, rewards,
+				COALESCE(attributed_transactions, 0) AS attributed_transactions,
+				COALESCE(attributed_spend, 0) AS attributed_spend
+			FROM (SELECT offer_id, {}, {}, {}, {}, {} FROM timeline t WHERE offer_id IS NOT NULL GROUP BY offer_id) c
+			LEFT JOIN (SELECT a.offer_id, COUNT(*) AS attributed_transactions, SUM(t.amount) AS attributed_spend
+				{} WHERE a.r IS NOT NULL GROUP BY a.offer_id) s
+			ON s.offer_id = c.offer_id JOIN offers o ON o.code = c.offer_id
+			ORDER BY o.offer_id'''.format(total('t.event = 0')+' AS received',total('t.effective_view')+' AS viewed',\
+					total('t.event = 3')+' AS completed',total(in_view)+' AS completed_after_view',\
+					total('t.event = 3','t.reward')+' AS rewards',ATTRIBUTION_SQL),connection)
+		funnel_hours=pd.read_sql_query('''
+			SELECT o.offer_id, CAST(t.time - t.received_time AS REAL) AS hours, SUM(t.effective_view) AS views,
+				SUM(t.event = 3) AS completions
+			FROM timeline t JOIN offers o ON o.code = t.offer_id
+			WHERE (t.effective_view OR t.event = 3) AND t.received_time IS NOT NULL
+			GROUP BY o.offer_id, hours ORDER BY o.offer_id, hours''',connection)
+		return customer_profile_df,offer_state,(funnel_counts[['offer_id']+FUNNEL_COUNT_COLUMNS],funnel_hours)
+	finally:
+		connection.close()
+
+def combine_customer_totals(customer_totals,customer_profile_df):
+	'''
+	INPUT
+	customer_totals - pandas dataframe with the running transcript totals of some persons
+	customer_profile_df - pandas dataframe with the totals of a new batch of transcript events
+
+
+	OUTPUT
+	customer_totals - pandas dataframe with the summed totals of every person in either input
+	'''
+	frames=[frame[PROFILE_COLUMNS] for frame in [customer_totals,customer_profile_df] if len(frame)>0]
+	if len(frames)<2:
+		return (frames[0] if len(frames)==1 else customer_profile_df[PROFILE_COLUMNS]).reset_index(drop=True)
+	customer_totals=pd.concat(frames,ignore_index=True)
+	customer_totals=customer_totals.groupby('person',sort=True).sum().reset_index()
+	return customer_totals[PROFILE_COLUMNS]
+
+def create_id_categorical(ids):
+	'''
+	INPUT
+	ids - person or offer ids, missing ids as None or NaN
+
+	OUTPUT
+	id_categorical - pandas categorical of the ids with the sorted distinct ids as categories
+
+	The categories are always strings, also when every id is missing, so the categoricals
+	of chunks without any offer id still combine with union_categoricals.
+	'''
+	categories=pd.Index(pd.unique(np.asarray(ids,dtype=object)),dtype=object).dropna().sort_values()
+	return pd.Categorical(ids,categories=categories)
+
+def parse_transcript_lines(lines):
+	'''
+	INPUT
+	lines - list of line delimited json records from the transcript file
+
+	OUTPUT
+	transcript_chunk - pandas dataframe containing the cleaned transcript events of the lines
+
+	The function does the following:
+	1. Parses every record and flattens the value dictionary straight into typed arrays
+	2. Merges the two offer id keys used by the different events into one field
+	3. Stores the events in the compact layout of compact_transcript
+	'''
+	lines=[line for line in lines if line.strip()]
+	persons=[]
+	events=[]
+	offer_ids=[]
+	times=np.empty(len(lines),dtype='int32')
+	amounts=np.full(len(lines),np.nan,dtype='float32')
+	rewards=np.full(len(lines),np.nan,dtype='float32')
+
+	for i,line in enumerate(lines):
+		record=json.loads(line)
+		value=record['value']
+		persons.append(record['person'])
+		events.append(record['event'])
+		times[i]=record['time']
+		# The offer id field uses a different key for offer views and offer completed events
+		offer_ids.append(value.get('offer_id',value.get('offer id')))
+		if 'amount' in value:
+			amounts[i]=value['amount']
+		if 'reward' in value:
+			rewards[i]=value['reward']
+
+	event_codes=pd.Categorical(events,dtype=EVENT_DTYPE)
+	if (event_codes.codes<0).any():
+		raise ValueError('Unknown transcript event types: {}'.format(sorted(set(events)-set(EVENT_TYPES))))
+	return pd.DataFrame({'person':create_id_categorical(persons),'event':event_codes,'time':times,\
+				'amount':amounts,'reward':rewards,'offer_id_merged':create_id_categorical(offer_ids)})
+
+def read_transcript_chunks(transcript_filepath,chunksize=100000):
+	'''
+	INPUT
+	transcript_filepath - file path of the line delimited transcript json
+	chunksize - maximum number of events in each chunk
+
+	OUTPUT
+	generator of pandas dataframes with the cleaned transcript events, one per chunk
+	'''
+	with open(transcript_filepath) as file:
+		while True:
+			lines=list(itertools.islice(file,chunksize))
+			if len(lines)==0:
+				break
+			yield parse_transcript_lines(lines)
+
+def concat_transcript_chunks(chunks):
+	'''
+	INPUT
+	chunks - iterable of cleaned transcript chunks from read_transcript_chunks
+
+	OUTPUT
+	transcript_clean - pandas dataframe with all the events in the layout of compact_transcript
+	'''
+	chunks=list(chunks)
+	if len(chunks)==0:
+		return parse_transcript_lines([])
+
+	transcript_clean=pd.DataFrame({'time':np.concatenate([chunk['time'].to_numpy() for chunk in chunks]),\
+				'amount':np.concatenate([chunk['amount'].to_numpy() for chunk in chunks]),\
+				'reward':np.concatenate([chunk['reward'].to_numpy() for chunk in chunks])})
+	transcript_clean['event']=pd.Categorical.from_codes(np.concatenate([chunk['event'].cat.codes.to_numpy() for chunk in chunks]),\
+				dtype=EVENT_DTYPE)
+	for column in ['person','offer_id_merged']:
+		transcript_clean[column]=union_categoricals([chunk[column].values for chunk in chunks],sort_categories=True)
+
+	return transcript_clean[TRANSCRIPT_COLUMNS]
+
+def load_transcript_data(transcript_filepath,chunksize=100000):
+	'''
+	INPUT
+	transcript_filepath - file path of the line delimited transcript json
+	chunksize - number of events parsed at a time
+
+	OUTPUT
+	transcript_clean - pandas dataframe containing cleaned up transaction transcript data
+
+	Streaming alternative to reading the whole file with pd.read_json followed by
+	clean_transcript_data. Only one chunk of raw records is held in memory at a time and
+	the value dictionaries are never materialised as a column.
+	'''
+	return concat_transcript_chunks(read_transcript_chunks(transcript_filepath,chunksize))
 
 def clean_transcript_data(transcript):
 	'''
@@ -198,6 +1056,7 @@ def clean_transcript_data(transcript):
 	1. Converts the values dictionary to individual dataframe columns
 	2. Combines the new derived values columns with original dataset
 	3. Cleans up the two offer id fields into one
+	4. Drops the raw columns and stores the events compactly, see compact_transcript
 	'''
 
 	transcript_values=transcript['value'].apply(pd.Series )
@@ -209,7 +1068,45 @@ def clean_transcript_data(transcript):
 								transcript_clean['offer id'],transcript_clean['offer_id'])
 
 
-	return transcript_clean
+	return compact_transcript(transcript_clean)
+
+def compact_transcript(transcript):
+	'''
+	INPUT
+	transcript - pandas dataframe with the TRANSCRIPT_COLUMNS of cleaned transcript events
+
+	OUTPUT
+	transcript_compact - pandas dataframe with only the TRANSCRIPT_COLUMNS
+
+	Person and offer ids become categoricals, integer codes into one sorted array of the
+	distinct ids, the event an int8 code of EVENT_TYPES, the time int32 and the amount and
+	reward float32. The value dictionaries and the two raw offer id columns are dropped.
+	'''
+	return pd.DataFrame({'person':create_id_categorical(transcript['person']),\
+				'event':pd.Categorical(transcript['event'],dtype=EVENT_DTYPE),\
+				'time':transcript['time'].to_numpy(dtype='int32'),\
+				'amount':transcript['amount'].to_numpy(dtype='float32'),\
+				'reward':transcript['reward'].to_numpy(dtype='float32'),\
+				'offer_id_merged':create_id_categorical(transcript['offer_id_merged'])})[TRANSCRIPT_COLUMNS]
+
+def get_transcript_memory(transcript):
+	'''
+	INPUT
+	transcript - pandas dataframe returned by compact_transcript or load_transcript_data
+
+	OUTPUT
+	compact_bytes - memory used by the compact transcript
+	object_bytes - memory the same events use as one string object per id and event and
+	               64 bit times, amounts and rewards, as pd.read_json loads them
+	'''
+	compact_bytes=int(transcript.memory_usage(index=False,deep=True).sum())
+	object_bytes=len(transcript)*8*3
+	for column in ['person','event','offer_id_merged']:
+		values=transcript[column].cat
+		sizes=np.array([sys.getsizeof(value) for value in values.categories]+[0])
+		codes=values.codes.to_numpy()
+		object_bytes+=len(codes)*8+int(sizes[codes].sum())
+	return compact_bytes,object_bytes
 
 def clean_profile_data(profile):
 	'''
@@ -235,61 +1132,434 @@ def clean_profile_data(profile):
 
 	return profile_clean
 
-def save_data(df, database_filename,table_name):
+# SQLite column types of the numpy dtype kinds, everything else is stored as TEXT
+SQLITE_TYPES={'b':'INTEGER','i':'INTEGER','u':'INTEGER','f':'REAL'}
+
+# Demographic columns of the customer profiles which the app and the models filter on
+DEMOGRAPHIC_COLUMNS=['gender','age','income','customer_since']
+
+def write_sqlite_table(df, database_filename, table_name, if_exists='replace', primary_key=None, index_columns=()):
+    '''
+    INPUT
+    df - pandas dataframe to be written to SQLite
+    database_filename - file path for the SQLite database
+    table_name - table name to be used for the SQLite table
+    if_exists - what to do if the table exists, 'replace' or 'append'
+    primary_key - optional column name or list of column names for the primary key
+    index_columns - columns which get a single column index
+
+    OUTPUT
+    rows_per_sec - number of rows written per second
+
+    This function does the following:
+    1. Switches the connection to WAL journaling without syncing for the duration of the load
+    2. Creates the table with an explicit schema typed from the dataframe dtypes
+    3. Inserts all the rows with a single executemany inside one transaction
+    4. Creates the indexes after the rows are loaded
+    '''
+    if isinstance(primary_key, str):
+        primary_key = [primary_key]
+
+    columns = ', '.join('"{}" {}'.format(column, SQLITE_TYPES.get(df[column].dtype.kind, 'TEXT'))
+                        for column in df.columns)
+    if primary_key:
+        columns += ', PRIMARY KEY ({})'.format(', '.join('"{}"'.format(column) for column in primary_key))
+    insert = 'INSERT INTO "{}" VALUES ({})'.format(table_name, ', '.join('?' * len(df.columns)))
+
+    start = perf_counter()
+    connection = sqlite3.connect(database_filename, isolation_level=None)
+    try:
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=OFF')
+        connection.execute('BEGIN')
+        if if_exists == 'replace':
+            connection.execute('DROP TABLE IF EXISTS "{}"'.format(table_name))
+        connection.execute('CREATE TABLE IF NOT EXISTS "{}" ({})'.format(table_name, columns))
+        connection.executemany(insert, df.itertuples(index=False, name=None))
+        for column in index_columns:
+            connection.execute('CREATE INDEX IF NOT EXISTS "ix_{0}_{1}" ON "{0}" ("{1}")'.format(table_name, column))
+        connection.execute('COMMIT')
+    except Exception:
+        if connection.in_transaction:
+            connection.execute('ROLLBACK')
+        raise
+    finally:
+        connection.close()
+
+    return len(df) / max(perf_counter() - start, 1e-9)
+
+
+def save_data(df, database_filename,table_name,if_exists='replace',primary_key=None,index_columns=()):
     '''
     INPUT
     df - pandas dataframe to be written to SQLite
     database_filename - file path for the SQLite database
     table_name - table name to be used for the SQLite table
+    if_exists - what to do if the table exists, 'replace' or 'append'
+    primary_key - optional column name or list of column names for the primary key
+    index_columns - columns which get a single column index
 
     OUTPUT
     NONE
     
     This function does the following:
-    1. Create sqlite engine at the specified file path
-    2. Store the dataframe in the sqlite database in specified table
+    1. Store the dataframe in the sqlite database in specified table with write_sqlite_table
+    2. Print the write throughput of the table
+    '''
+    rows_per_sec = write_sqlite_table(df, database_filename, table_name, if_exists, primary_key, index_columns)
+    print('    TABLE: {} ({} rows, {:.0f} rows/sec)'.format(table_name, len(df), rows_per_sec))
+
+
+def save_timeline_state(customer_totals, offer_state, watermark, database_filename):
     '''
+    INPUT
+    customer_totals - pandas dataframe with the running transcript totals of every person
+    offer_state - pandas dataframe with the offer state left by the processed transcript
+    watermark - time of the last processed transcript event
+    database_filename - file path for the SQLite database
+
+    OUTPUT
+    NONE
+
+    Stores the timeline state next to the customer profiles so that later transcript
+    events can be processed with update_customer_profiles.
+    '''
+    save_data(customer_totals, database_filename, 'customer_timeline_totals', primary_key='person')
+    save_data(offer_state, database_filename, 'customer_offer_state', primary_key=['person', 'offer_id'])
+    save_data(pd.DataFrame({'max_time':[float(watermark)]}), database_filename, 'timeline_watermark')
+
+
+def save_offer_funnel(offer_funnel, portfolio, database_filename):
+    '''
+    INPUT
+    offer_funnel - funnel_counts, funnel_hours tuple of create_offer_funnel
+    portfolio - pandas dataframe containing the offer portfolio data
+    database_filename - file path for the SQLite database
+
+    OUTPUT
+    offer_funnel_df - pandas dataframe of the offer_funnel table
+
+    Stores the offer_funnel table of summarize_offer_funnel, indexed on the offer type and
+    the channels, and the hours histogram its medians are computed from, which
+    update_customer_profiles adds the funnel of later transcript events to.
+    '''
+    offer_funnel_df = summarize_offer_funnel(offer_funnel, portfolio)
+    save_data(offer_funnel_df, database_filename, 'offer_funnel', primary_key='offer_id',
+              index_columns=['offer_type'] + ['channel_' + channel for channel in OFFER_CHANNELS])
+    save_data(offer_funnel[1], database_filename, 'offer_funnel_hours', primary_key=['offer_id', 'hours'])
+    return offer_funnel_df
+
+
+def update_customer_profiles(profile, portfolio, transcript, database_filename):
+    '''
+    INPUT
+    profile - pandas dataframe containing the cleaned customer profile data
+    portfolio - pandas dataframe containing the offer portfolio data
+    transcript - pandas dataframe containing new cleaned transcript events
+    database_filename - file path for the SQLite database holding the earlier results
+
+    OUTPUT
+    customer_profiles - pandas dataframe with the updated profiles of the persons in the transcript
+
+    This function does the following:
+    1. Checks that the new events do not predate the events already processed
+    2. Loads the running totals and offer state of the persons in the new events only
+    3. Replays the new events on top of that state with create_customer_timeline
+    4. Replaces the totals, offer state and customer profile rows of those persons
+       in a single transaction
+    5. Drops the offer state of every person which expired before the new watermark and
+       clears the expired views, see prune_offer_state
+    6. Adds the funnel of the new events to the offer_funnel table if the database has one
+    '''
+    offer_durations, offer_types = get_offer_details(portfolio)
+
     engine = create_engine('sqlite:///'+database_filename)
-    df.to_sql(table_name, engine, index=False)  
+    with engine.begin() as connection:
+        if not inspect(connection).has_table('timeline_watermark'):
+            raise ValueError('No timeline state in {}, run a full load first'.format(database_filename))
+        watermark = connection.exec_driver_sql('SELECT max_time FROM timeline_watermark').scalar()
+        if len(transcript) == 0:
+            return complete_customer_profiles(pd.DataFrame(columns=PROFILE_COLUMNS), profile)
+        if transcript['time'].min() < watermark:
+            raise ValueError('Transcript events at time {} are older than the processed events up to time {}'
+                             .format(transcript['time'].min(), watermark))
+
+        persons = pd.unique(transcript['person'].astype('object'))
+        connection.exec_driver_sql('CREATE TEMP TABLE affected_persons (person TEXT PRIMARY KEY)')
+        connection.exec_driver_sql('INSERT INTO affected_persons (person) VALUES (?)', [(person,) for person in persons])
+
+        offer_state = pd.read_sql_query('SELECT s.* FROM customer_offer_state s '\
+                                        'JOIN affected_persons a ON s.person = a.person', connection)
+        customer_totals = pd.read_sql_query('SELECT t.* FROM customer_timeline_totals t '\
+                                            'JOIN affected_persons a ON t.person = a.person', connection)
+
+        with_funnel = inspect(connection).has_table('offer_funnel_hours')
+        results = create_customer_timeline(transcript, offer_durations, offer_types, offer_state, funnel=with_funnel)
+        customer_profile_df, offer_state = results[:2]
+        customer_totals = combine_customer_totals(customer_totals, customer_profile_df)
+        customer_profiles = complete_customer_profiles(customer_totals, profile)
+
+        for table_name, df in [('customer_timeline_totals', customer_totals), ('customer_offer_state', offer_state),
+                               ('customer_profiles', customer_profiles)]:
+            connection.exec_driver_sql('DELETE FROM {} WHERE person IN (SELECT person FROM affected_persons)'
+                                       .format(table_name))
+            df.to_sql(table_name, connection, index=False, if_exists='append')
+
+        if with_funnel:
+            offer_funnel = combine_offer_funnels([(pd.read_sql_table('offer_funnel', connection),
+                                                   pd.read_sql_table('offer_funnel_hours', connection)), results[2]])
+            for table_name, df in [('offer_funnel', summarize_offer_funnel(offer_funnel, portfolio)),
+                                   ('offer_funnel_hours', offer_funnel[1])]:
+                connection.exec_driver_sql('DELETE FROM {}'.format(table_name))
+                df.to_sql(table_name, connection, index=False, if_exists='append')
+
+        watermark = float(max(watermark, transcript['time'].max()))
+        connection.exec_driver_sql('UPDATE timeline_watermark SET max_time = ?', (watermark,))
+        # Offers of persons outside the batch may have expired before the new watermark as well,
+        # see prune_offer_state
+        connection.exec_driver_sql('DELETE FROM customer_offer_state WHERE COALESCE(offer_expiry >= ?, 0) = 0 '
+                                   'AND COALESCE(view_expiry >= ?, 0) = 0', (watermark, watermark))
+        connection.exec_driver_sql('UPDATE customer_offer_state SET view_expiry = NULL, last_offer = 0 '
+                                   'WHERE view_expiry < ?', (watermark,))
+        connection.exec_driver_sql('DROP TABLE affected_persons')
+
+    return customer_profiles
+
+
+def save_parquet(customer_profiles, transcript, parquet_dirpath, append=False):
+    '''
+    INPUT
+    customer_profiles - pandas dataframe with the customer profiles
+    transcript - pandas dataframe with the cleaned transcript events
+    parquet_dirpath - directory for the parquet files
+    append - add the transcript as a new part instead of replacing the earlier parts
+
+    OUTPUT
+    NONE
+
+    This function does the following:
+    1. Writes the customer profiles to customer_profiles.parquet
+    2. Writes the transcript as a part of the transcript parquet dataset directory, which
+       pd.read_parquet reads back as one dataframe
+    '''
+    transcript_dirpath = os.path.join(parquet_dirpath, 'transcript')
+    os.makedirs(transcript_dirpath, exist_ok=True)
+
+    parts = sorted(name for name in os.listdir(transcript_dirpath) if name.endswith('.parquet'))
+    if not append:
+        for name in parts:
+            os.remove(os.path.join(transcript_dirpath, name))
+        parts = []
+
+    customer_profiles.to_parquet(os.path.join(parquet_dirpath, 'customer_profiles.parquet'), index=False)
+    transcript.to_parquet(os.path.join(transcript_dirpath, 'part-{:05d}.parquet'.format(len(parts))), index=False)
+
+
+def parse_args(args):
+    '''
+    INPUT
+    args - list of command line arguments
+
+    OUTPUT
+    options - argparse namespace with the file paths and the processing options
+    '''
+    parser = argparse.ArgumentParser(
+        description='Please provide the filepaths of the customer profile, offer portfolio '\
+              'and trasaction transcript datasets as the first,second and third argument '\
+              'respectively, as well as the filepath of the database to save the cleaned data '\
+              'to as the fourth argument.',
+        epilog='Example: python process_data.py profile.json portfolio.json transcript.json '\
+              'StarbucksOffers.db')
+    parser.add_argument('profile_filepath')
+    parser.add_argument('portfolio_filepath')
+    parser.add_argument('transcript_filepath')
+    parser.add_argument('database_filepath')
+    parser.add_argument('--chunksize', type=int, default=100000,
+                        help='number of transcript events parsed at a time (default: 100000)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='treat the transcript as new events and only update the affected customer '\
+                             'profiles of an existing database')
+    parser.add_argument('--parquet-dir', dest='parquet_dirpath',
+                        help='also write the customer profiles and cleaned transcript as parquet files '\
+                             'to this directory')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes used to build the customer profiles (default: 1)')
+    parser.add_argument('--engine', choices=['vectorized', 'sql'], default='vectorized',
+                        help='build the customer profiles in memory with pandas, or with window functions in '\
+                             'a SQLite work database next to the database for transcripts larger than memory '\
+                             '(default: vectorized)')
+    parser.add_argument('--offer-funnel', action='store_true',
+                        help='also write the per offer funnel to the offer_funnel table in the same pass '\
+                             'over the transcript, later --incremental runs keep it up to date')
+    parser.add_argument('--report', dest='report_filepath',
+                        help='write the time, CPU time, peak memory and rows of every stage to this JSON file')
+    parser.add_argument('--profile', dest='pstats_filepath',
+                        help='run the stages under cProfile and dump the statistics of the slowest one to this file')
+    options = parser.parse_args(args)
+    if options.engine == 'sql' and (options.incremental or options.parquet_dirpath or options.workers > 1):
+        parser.error('--engine sql builds a full load in one process, it does not combine with --incremental, '\
+                     '--parquet-dir or --workers')
+    return options
+
+
+def finish_report(report, options):
+    '''
+    INPUT
+    report - RunReport of the run
+    options - argparse namespace returned by parse_args
+
+    OUTPUT
+    NONE
+
+    Prints the stage summary, writes the JSON report with --report and the statistics of
+    the slowest stage with --profile.
+    '''
+    report.print_summary()
+    if options.report_filepath:
+        report.save(options.report_filepath)
+        print('Run report saved!\n    REPORT: {}'.format(options.report_filepath))
+    if options.pstats_filepath:
+        report.save_profile(options.pstats_filepath)
+
+
+def save_full_load(results, customer_profiles, portfolio, watermark, report, options):
+    '''
+    INPUT
+    results - customer totals, offer state and, with --offer-funnel, the offer funnel of the transcript
+    customer_profiles - pandas dataframe containing customer profiles
+    portfolio - pandas dataframe containing the offer portfolio data
+    watermark - time of the last transcript event
+    report - RunReport of the run
+    options - argparse namespace returned by parse_args
+
+    OUTPUT
+    NONE
+
+    Saves the customer profiles, the timeline state and with --offer-funnel the offer funnel.
+    '''
+    customer_totals, offer_state = results[:2]
+    print('Saving data...\n    DATABASE: {}'.format(options.database_filepath))
+    with report.stage('save_data', table='customer_profiles') as stage:
+        save_data(customer_profiles, options.database_filepath,'customer_profiles',primary_key='person',
+                  index_columns=DEMOGRAPHIC_COLUMNS)
+        stage['rows'] = len(customer_profiles)
+    with report.stage('save_timeline_state') as stage:
+        save_timeline_state(customer_totals, offer_state, watermark, options.database_filepath)
+        stage['rows'] = len(customer_totals) + len(offer_state)
+    if options.offer_funnel:
+        with report.stage('save_data', table='offer_funnel') as stage:
+            stage['rows'] = len(save_offer_funnel(results[2], portfolio, options.database_filepath))
+
+
+def create_customer_profiles_sql(profile_clean, portfolio, report, options):
+    '''
+    INPUT
+    profile_clean - pandas dataframe containing the cleaned customer profile data
+    portfolio - pandas dataframe containing the offer portfolio data
+    report - RunReport of the run
+    options - argparse namespace returned by parse_args
+
+    OUTPUT
+    NONE
+
+    Full load of --engine sql. The transcript is streamed into a work database next to the
+    database, which is removed once the profiles are saved.
+    '''
+    work_filepath = options.database_filepath + '.work'
+    print('Loading transaction transcript data into a work database...\n    WORK DATABASE: {}'.format(work_filepath))
+    try:
+        with report.stage('load_transcript_database') as stage:
+            stage['rows'], watermark = load_transcript_database(
+                portfolio, read_transcript_chunks(options.transcript_filepath, options.chunksize), work_filepath)
+
+        print('Combining datasets to create customer profiles...')
+        with report.stage('create_customer_profiles', engine='sql') as stage:
+            results = create_customer_timeline_sql(work_filepath, funnel=options.offer_funnel)
+            customer_profiles = complete_customer_profiles(results[0], profile_clean)
+            stage['rows'] = len(customer_profiles)
+    finally:
+        if os.path.exists(work_filepath):
+            os.remove(work_filepath)
+
+    save_full_load(results, customer_profiles, portfolio, watermark, report, options)
+    print('Cleaned data saved to database!')
 
 
 def main():
-    if len(sys.argv) == 5:
+    options = parse_args(sys.argv[1:])
+    report = RunReport('process_data', profile=options.pstats_filepath is not None)
 
-        profile_filepath, portfolio_filepath, transcript_filepath ,database_filepath = sys.argv[1:]
+    profile_filepath, portfolio_filepath, transcript_filepath ,database_filepath = options.profile_filepath,\
+        options.portfolio_filepath, options.transcript_filepath, options.database_filepath
 
-        print('Loading data...\n    CUSTOMER PROFILES: {}\n    OFFER PORTFOLIO: {}\n    TRANSACTIONS: {}'
-              .format(profile_filepath, portfolio_filepath, transcript_filepath))
+    print('Loading data...\n    CUSTOMER PROFILES: {}\n    OFFER PORTFOLIO: {}\n    TRANSACTIONS: {}'
+          .format(profile_filepath, portfolio_filepath, transcript_filepath))
 
+    with report.stage('read_json', file='profile') as stage:
         profile= pd.read_json(profile_filepath, orient='records', lines=True)
+        stage['rows'] = len(profile)
+    with report.stage('read_json', file='portfolio') as stage:
         portfolio= pd.read_json(portfolio_filepath, orient='records', lines=True)
-        transcript= pd.read_json(transcript_filepath, orient='records', lines=True)
+        stage['rows'] = len(portfolio)
 
-        #The portfolio dataset does not require any cleanup. 
+    #The portfolio dataset does not require any cleanup. 
 
 
-        print('Cleaning customer profile data...')
+    print('Cleaning customer profile data...')
+    with report.stage('clean_profile_data') as stage:
         profile_clean = clean_profile_data(profile)
-        
-        print('Cleaning transaction transcript data...')
-        transcript_clean = clean_transcript_data(transcript)
+        stage['rows'] = len(profile_clean)
+    
+    if options.engine == 'sql':
+        create_customer_profiles_sql(profile_clean, portfolio, report, options)
+        finish_report(report, options)
+        return
 
-        print('Combining datasets to create customer profiles...')
-        customer_profiles= create_customer_profiles(profile_clean,portfolio,transcript_clean)
+    print('Loading and cleaning transaction transcript data...')
+    # Streams the transcript json through the cleaning of clean_transcript_data
+    with report.stage('load_transcript_data') as stage:
+        transcript_clean = load_transcript_data(transcript_filepath, options.chunksize)
+        stage['rows'] = len(transcript_clean)
+    compact_bytes, object_bytes = get_transcript_memory(transcript_clean)
+    print('    TRANSCRIPT: {} events in {:.1f} MB ({:.1f} MB as strings and 64 bit numbers)'
+          .format(len(transcript_clean), compact_bytes / 1024**2, object_bytes / 1024**2))
+
+    if options.incremental:
+        print('Updating customer profiles of new transcript events...\n    DATABASE: {}'.format(database_filepath))
+        with report.stage('update_customer_profiles') as stage:
+            customer_profiles= update_customer_profiles(profile_clean,portfolio,transcript_clean,database_filepath)
+            stage['rows'] = len(customer_profiles)
+
+        if options.parquet_dirpath:
+            print('Saving parquet files...\n    DIRECTORY: {}'.format(options.parquet_dirpath))
+            with report.stage('save_parquet') as stage:
+                engine = create_engine('sqlite:///'+database_filepath)
+                save_parquet(pd.read_sql_table('customer_profiles', engine), transcript_clean,
+                             options.parquet_dirpath, append=True)
+                stage['rows'] = len(transcript_clean)
+
+        print('Updated {} customer profiles!'.format(len(customer_profiles)))
+        finish_report(report, options)
+        return
 
-        print('Saving data...\n    DATABASE: {}'.format(database_filepath))
-        save_data(customer_profiles, database_filepath,'customer_profiles')
-        
-        print('Cleaned data saved to database!')
+    print('Combining datasets to create customer profiles...')
+    with report.stage('create_customer_profiles') as stage:
+        results= create_customer_timeline_state(portfolio,transcript_clean,workers=options.workers,
+                                                funnel=options.offer_funnel)
+        customer_profiles= complete_customer_profiles(results[0],profile_clean)
+        stage['rows'] = len(customer_profiles)
+
+    save_full_load(results, customer_profiles, portfolio, transcript_clean['time'].max(), report, options)
+
+    if options.parquet_dirpath:
+        print('Saving parquet files...\n    DIRECTORY: {}'.format(options.parquet_dirpath))
+        with report.stage('save_parquet') as stage:
+            save_parquet(customer_profiles, transcript_clean, options.parquet_dirpath)
+            stage['rows'] = len(customer_profiles) + len(transcript_clean)
     
-    else:
-        print('Please provide the filepaths of the customer profile, offer portfolio '\
-              'and trasaction transcript datasets as the first,second and third argument '\
-              'respectively, as well as the filepath of the database to save the cleaned data '\
-              'to as the fourth argument. \n\nExample: python process_data.py '\
-              'profile.json portfolio.json transcript.json '\
-              'StarbucksOffers.db')
+    print('Cleaned data saved to database!')
+    finish_report(report, options)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,149 @@
+import sys
+import pickle
+import numpy as np
+
+from sklearn.pipeline import Pipeline
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.tree import DecisionTreeClassifier
+from sklearn.linear_model import LogisticRegression
+
+
+def get_estimator(model):
+	'''
+	INPUT
+	model - fitted search, Pipeline or classifier as saved by train_classifiers.py
+
+	OUTPUT
+	estimator - the fitted classifier which makes the predictions
+
+	This function does the following:
+	1. Unwraps the best estimator of a grid, halving or randomized search
+	2. Unwraps the final step of a pipeline which has no other steps
+	'''
+	if hasattr(model, 'best_estimator_'):
+		model = model.best_estimator_
+	if isinstance(model, Pipeline):
+		if len(model.steps) != 1:
+			raise ValueError('Only pipelines with a single classifier step can be exported')
+		model = model.steps[-1][1]
+	return model
+
+
+def export_trees(trees, output=0, n_classes=None):
+	'''
+	INPUT
+	trees - list of fitted DecisionTreeClassifier
+	output - target column to export of trees fitted on several targets
+	n_classes - number of classes of that target, all the classes of the node values if not given
+
+	OUTPUT
+	arrays - dictionary of the node arrays of all the trees flattened into one set of arrays
+
+	The node ids of every tree are shifted by the number of nodes of the trees before it,
+	so the children arrays index straight into the flattened arrays. Leaves keep -1 as
+	their children and the class counts of every node are normalised to probabilities.
+	'''
+	roots, left, right, feature, threshold, proba = [], [], [], [], [], []
+	offset = 0
+	for tree in trees:
+		nodes = tree.tree_
+		roots.append(offset)
+		left.append(np.where(nodes.children_left >= 0, nodes.children_left + offset, -1))
+		right.append(np.where(nodes.children_right >= 0, nodes.children_right + offset, -1))
+		feature.append(np.maximum(nodes.feature, 0))
+		threshold.append(nodes.threshold)
+		value = nodes.value[:, output, :n_classes]
+		proba.append(value / value.sum(axis=1, keepdims=True))
+		offset += nodes.node_count
+
+	return {'kind': np.array('trees'),
+	        'roots': np.array(roots, dtype='int64'),
+	        'left': np.concatenate(left).astype('int64'),
+	        'right': np.concatenate(right).astype('int64'),
+	        'feature': np.concatenate(feature).astype('int64'),
+	        'threshold': np.concatenate(threshold).astype('float64'),
+	        'proba': np.concatenate(proba).astype('float64'),
+	        'depth': np.array(max(tree.get_depth() for tree in trees), dtype='int64')}
+
+
+def export_model(model, output=None):
+	'''
+	INPUT
+	model - fitted GridSearchCV, Pipeline or classifier as saved by train_classifiers.py
+	output - target column to export of a model fitted on several offer types
+
+	OUTPUT
+	arrays - dictionary of numpy arrays which describe the model for the numpy predictor
+	'''
+	estimator = get_estimator(model)
+	classes = estimator.classes_ if output is None else estimator.classes_[output]
+
+	if isinstance(estimator, RandomForestClassifier):
+		arrays = export_trees(estimator.estimators_, output or 0, len(classes))
+	elif isinstance(estimator, DecisionTreeClassifier):
+		arrays = export_trees([estimator], output or 0, len(classes))
+	elif output is not None:
+		raise ValueError('Can not export a {} model fitted on several targets'.format(type(estimator).__name__))
+	elif isinstance(estimator, LogisticRegression):
+		arrays = {'kind': np.array('linear'),
+		          'coef': estimator.coef_.astype('float64'),
+		          'intercept': estimator.intercept_.astype('float64')}
+	else:
+		raise ValueError('Can not export a {} model'.format(type(estimator).__name__))
+
+	arrays['classes'] = np.asarray(classes).astype('U')
+	arrays['features'] = np.asarray(estimator.feature_names_in_).astype('U')
+	return arrays
+
+
+def export_models(models, export_filepath):
+	'''
+	INPUT
+	models - dictionary of offer type to fitted model as saved by train_classifiers.py
+	export_filepath - file path of the .npz file with the compact models
+
+	OUTPUT
+	NONE
+
+	This function does the following:
+	1. Extracts the best estimator of every model into plain numpy arrays, a model fitted on
+	   a tuple of offer types is exported once per offer type
+	2. Stores the arrays of all models in one uncompressed npz file keyed by offer type
+	'''
+	exports = {}
+	for offers, model in models.items():
+		if isinstance(offers, tuple):
+			for output, offer in enumerate(offers):
+				exports[offer] = export_model(model, output)
+		else:
+			exports[offers] = export_model(model)
+
+	arrays = {}
+	for offer, model_arrays in exports.items():
+		for key, value in model_arrays.items():
+			arrays['{}/{}'.format(offer, key)] = value
+
+	np.savez(export_filepath, **arrays)
+
+
+def main():
+	if len(sys.argv) == 3:
+		model_filepath, export_filepath = sys.argv[1:]
+
+		print('Loading model...\n    MODEL: {}'.format(model_filepath))
+		with open(model_filepath, 'rb') as file:
+			models = pickle.load(file)
+
+		print('Exporting compact models...\n    EXPORT: {}'.format(export_filepath))
+		export_models(models, export_filepath)
+
+		print('Compact models saved!')
+
+	else:
+		print('Please provide the filepath of the classifiers pickle as the first argument '\
+		      'and the filepath of the compact models npz file to save as the second argument. '\
+		      '\n\nExample: python export_models.py classifiers.pkl classifiers.npz')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,161 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+
+
+# Bump when the encoding of the cached arrays changes so old caches are rebuilt
+CACHE_VERSION = 2
+
+# Bytes read at a time while hashing the source files
+HASH_CHUNKSIZE = 1 << 20
+
+
+def get_source_files(data_filepath):
+	'''
+	INPUT
+	data_filepath - SQLite database, parquet file or parquet directory written by process_data.py
+
+	OUTPUT
+	filepaths - files whose content makes up the customer profiles of the source
+
+	The write ahead log of a SQLite database holds committed rows which are not yet in the
+	database file, so it is part of the content when it exists.
+	'''
+	if os.path.isdir(data_filepath):
+		return [os.path.join(data_filepath, 'customer_profiles.parquet')]
+	filepaths = [data_filepath]
+	if os.path.exists(data_filepath + '-wal'):
+		filepaths.append(data_filepath + '-wal')
+	return filepaths
+
+
+def get_file_stats(filepaths):
+	'''
+	INPUT
+	filepaths - list of file paths
+
+	OUTPUT
+	stats - dictionary of file path to [size, modification time in ns]
+	'''
+	return {filepath: [os.stat(filepath).st_size, os.stat(filepath).st_mtime_ns] for filepath in filepaths}
+
+
+def hash_files(filepaths):
+	'''
+	INPUT
+	filepaths - list of file paths
+
+	OUTPUT
+	digest - sha256 hex digest of the content of all the files
+	'''
+	digest = hashlib.sha256()
+	for filepath in filepaths:
+		with open(filepath, 'rb') as file:
+			for chunk in iter(lambda: file.read(HASH_CHUNKSIZE), b''):
+				digest.update(chunk)
+	return digest.hexdigest()
+
+
+def write_cache(cache_entry_dirpath, X, targets, meta):
+	'''
+	INPUT
+	cache_entry_dirpath - directory of the cache entry of one source
+	X - pandas dataframe of the encoded features
+	targets - dictionary of offer type to target values
+	meta - dictionary with the fingerprint of the source and the information returned
+	       with the arrays
+
+	OUTPUT
+	NONE
+
+	The arrays are written to a temporary directory next to the entry which then replaces
+	the old entry, so a reader never sees the arrays of one source version with the
+	fingerprint of another.
+	'''
+	parent_dirpath = os.path.dirname(cache_entry_dirpath)
+	os.makedirs(parent_dirpath, exist_ok=True)
+	tmp_dirpath = tempfile.mkdtemp(dir=parent_dirpath)
+
+	np.save(os.path.join(tmp_dirpath, 'X.npy'), X.to_numpy(dtype='float64'))
+	np.save(os.path.join(tmp_dirpath, 'Y.npy'), np.column_stack(list(targets.values())))
+	meta = dict(meta, columns=list(X.columns), offers=list(targets), rows=len(X))
+	with open(os.path.join(tmp_dirpath, 'meta.json'), 'w') as file:
+		json.dump(meta, file, indent=1)
+
+	shutil.rmtree(cache_entry_dirpath, ignore_errors=True)
+	os.replace(tmp_dirpath, cache_entry_dirpath)
+
+
+def read_cache(cache_entry_dirpath, meta):
+	'''
+	INPUT
+	cache_entry_dirpath - directory of the cache entry of one source
+	meta - dictionary read from the meta.json of the entry
+
+	OUTPUT
+	X - pandas dataframe of the encoded features backed by the memory mapped array
+	targets - dictionary of offer type to the memory mapped target values
+	info - the JSON serialisable information stored with the arrays
+	'''
+	X = np.load(os.path.join(cache_entry_dirpath, 'X.npy'), mmap_mode='r')
+	Y = np.load(os.path.join(cache_entry_dirpath, 'Y.npy'), mmap_mode='r')
+	X = pd.DataFrame(X, columns=meta['columns'], copy=False)
+	return X, {offer: Y[:, i] for i, offer in enumerate(meta['offers'])}, meta['info']
+
+
+def load_cached_features(data_filepath, cache_dirpath, build_features):
+	'''
+	INPUT
+	data_filepath - SQLite database, parquet file or parquet directory written by process_data.py
+	cache_dirpath - directory of the feature cache
+	build_features - function taking data_filepath and returning the encoded features, the
+	                 dictionary of offer type to target values and JSON serialisable
+	                 information stored with them (such as the fitted encoder)
+
+	OUTPUT
+	X - pandas dataframe of the encoded features
+	targets - dictionary of offer type to target values
+	info - the information returned by build_features
+	hit - True when the arrays came from the cache
+
+	This function does the following:
+	1. Looks up the cache entry of the source, keyed by its absolute path
+	2. Uses the entry straight away when the size and modification time of the source files
+	   are unchanged
+	3. Otherwise hashes the content of the source files and still uses the entry when the
+	   content is unchanged, recording the new file stats
+	4. Otherwise builds the features and targets and stores them as .npy files which later
+	   runs memory map
+	'''
+	filepaths = get_source_files(data_filepath)
+	source_key = hashlib.sha1(os.path.abspath(data_filepath).encode()).hexdigest()[:16]
+	cache_entry_dirpath = os.path.join(cache_dirpath, source_key)
+	meta_filepath = os.path.join(cache_entry_dirpath, 'meta.json')
+
+	meta = None
+	if os.path.exists(meta_filepath):
+		with open(meta_filepath) as file:
+			meta = json.load(file)
+		if meta.get('version') != CACHE_VERSION:
+			meta = None
+
+	stats = get_file_stats(filepaths)
+	if meta is not None and meta['stats'] == stats:
+		return read_cache(cache_entry_dirpath, meta) + (True,)
+
+	content_hash = hash_files(filepaths)
+	if meta is not None and meta['sha256'] == content_hash:
+		meta['stats'] = stats
+		with open(meta_filepath, 'w') as file:
+			json.dump(meta, file, indent=1)
+		return read_cache(cache_entry_dirpath, meta) + (True,)
+
+	X, targets, info = build_features(data_filepath)
+	write_cache(cache_entry_dirpath, X, targets,
+	            {'version': CACHE_VERSION, 'source': os.path.abspath(data_filepath),
+	             'stats': stats, 'sha256': content_hash, 'info': info})
+	return X, targets, info, False
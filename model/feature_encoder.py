@@ -0,0 +1,172 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+
+class FeatureEncoder:
+	'''
+	One hot encoder of the customer demographics fitted on the training data. It lays out
+	the features the same way as clean_data did with pd.get_dummies(drop_first=True): the
+	numeric columns in their order, followed by a column per category of every categorical
+	column except its first (sorted) category. The fitted layout is saved next to the
+	classifiers so the app encodes requests exactly like the training data.
+	'''
+
+	def __init__(self, numeric_columns=None, categories=None):
+		'''
+		INPUT
+		numeric_columns - list of the numeric columns, taken as they are
+		categories - dictionary of categorical column to its sorted list of categories
+		'''
+		self.numeric_columns = list(numeric_columns or [])
+		self.categories = {column: list(values) for column, values in (categories or {}).items()}
+
+	@property
+	def feature_names(self):
+		'''
+		OUTPUT
+		names - list of the encoded feature columns in the order of the encoded arrays
+		'''
+		names = list(self.numeric_columns)
+		for column, values in self.categories.items():
+			names.extend('{}_{}'.format(column, value) for value in values[1:])
+		return names
+
+	def fit(self, df):
+		'''
+		INPUT
+		df - pandas dataframe of the training demographics
+
+		OUTPUT
+		self - the encoder with the numeric columns and the categories of df
+		'''
+		self.numeric_columns = list(df.select_dtypes(include=['float', 'int']).columns)
+		self.categories = {column: sorted(df[column].dropna().unique())
+		                   for column in df.select_dtypes(include=['object']).columns}
+		return self
+
+	def transform(self, df, out=None):
+		'''
+		INPUT
+		df - pandas dataframe (or dictionary of columns) with the numeric and categorical
+		     columns of the encoder
+		out - optional preallocated float64 array of shape (rows, number of features),
+		      required when df is a dictionary
+
+		OUTPUT
+		out - float64 array of the encoded features, unknown categories encode as the first one
+
+		Every column is written straight into its slot of the output array, without building
+		intermediate dummy frames.
+		'''
+		if out is None:
+			out = np.empty((len(df), len(self.feature_names)), dtype='float64')
+		j = 0
+		for column in self.numeric_columns:
+			out[:, j] = pd.to_numeric(df[column], errors='coerce')
+			j += 1
+		for column, values in self.categories.items():
+			column_values = np.asarray(df[column])
+			for value in values[1:]:
+				np.equal(column_values, value, out=out[:, j], casting='unsafe')
+				j += 1
+		return out
+
+	def transform_frame(self, df):
+		'''
+		INPUT
+		df - pandas dataframe with the numeric and categorical columns of the encoder
+
+		OUTPUT
+		features - pandas dataframe of the encoded features with the feature names as columns
+		'''
+		return pd.DataFrame(self.transform(df), columns=self.feature_names, index=df.index, copy=False)
+
+	def transform_row(self, values, out=None):
+		'''
+		INPUT
+		values - dictionary of column to the value of one customer
+		out - optional preallocated float64 array of shape (1, number of features)
+
+		OUTPUT
+		out - float64 array of shape (1, number of features) with the encoded customer
+
+		Encodes a single customer with plain python conversions, numbers which do not parse
+		become NaN like pd.to_numeric(errors='coerce').
+		'''
+		if out is None:
+			out = np.empty((1, len(self.feature_names)), dtype='float64')
+		row = out[0]
+		j = 0
+		for column in self.numeric_columns:
+			try:
+				row[j] = float(values[column])
+			except (TypeError, ValueError):
+				row[j] = np.nan
+			j += 1
+		for column, categories in self.categories.items():
+			value = values[column]
+			for category in categories[1:]:
+				row[j] = value == category
+				j += 1
+		return out
+
+	def check_models(self, models):
+		'''
+		INPUT
+		models - dictionary of offer type (or tuple of offer types) to trained classifier
+
+		OUTPUT
+		NONE
+
+		Raises a ValueError when a classifier was trained on another feature layout than
+		the one of the encoder.
+		'''
+		for offers, model in models.items():
+			names = getattr(model, 'feature_names_in_', None)
+			if names is not None and list(names) != self.feature_names:
+				raise ValueError('Classifier for {} expects the features {} but the encoder produces {}'
+				                 .format(offers, list(names), self.feature_names))
+
+	def to_dict(self):
+		return {'numeric_columns': self.numeric_columns, 'categories': self.categories,
+		        'feature_names': self.feature_names}
+
+	@classmethod
+	def from_dict(cls, state):
+		return cls(state['numeric_columns'], state['categories'])
+
+	def save(self, encoder_filepath):
+		'''
+		INPUT
+		encoder_filepath - file path of the JSON file to store the fitted encoder in
+
+		OUTPUT
+		NONE
+		'''
+		with open(encoder_filepath, 'w') as file:
+			json.dump(self.to_dict(), file, indent=1)
+
+	@classmethod
+	def load(cls, encoder_filepath):
+		'''
+		INPUT
+		encoder_filepath - JSON file written by save
+
+		OUTPUT
+		encoder - the fitted FeatureEncoder
+		'''
+		with open(encoder_filepath) as file:
+			return cls.from_dict(json.load(file))
+
+
+def get_encoder_filepath(model_filepath):
+	'''
+	INPUT
+	model_filepath - file path of the classifiers pickle or of their compact npz export
+
+	OUTPUT
+	encoder_filepath - file path of the fitted encoder saved next to the classifiers
+	'''
+	return os.path.splitext(model_filepath)[0] + '.encoder.json'
@@ -1,4 +1,11 @@
+import os
 import sys
+import time
+import json
+import argparse
+import tempfile
+import collections
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import pandas as pd
 import numpy as np
 
@@ -11,8 +18,57 @@ from sklearn.tree import DecisionTreeClassifier
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import classification_report
 from sklearn.model_selection import GridSearchCV
+from sklearn.model_selection import ParameterGrid, StratifiedKFold
+from sklearn.model_selection import RandomizedSearchCV
+from sklearn.experimental import enable_halving_search_cv # noqa: F401
+from sklearn.model_selection import HalvingGridSearchCV
 import pickle
 
+from export_models import export_models
+from feature_cache import load_cached_features
+from feature_encoder import FeatureEncoder, get_encoder_filepath
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+from instrumentation import RunReport, stage
+
+
+# Customer profile columns used for training, the demographic features and the offer response counts
+FEATURE_COLUMNS=['gender','age','income','customer_since']
+TARGET_COLUMNS=['#bogos','#discounts','#transaction_informational']
+
+# Offer types with the customer profile column whose positive values mark a response
+TARGETS={'bogo':'#bogos','discount':'#discounts','informational':'#transaction_informational'}
+
+# Model types tried for every offer type
+MODEL_TYPES=['decisiontree','randomforest','lr']
+
+# Model types which fit all offer types at once with the sklearn native multi-output support
+MULTI_OUTPUT_MODEL_TYPES=['decisiontree','randomforest']
+
+# Hyperparameter search strategies of build_model
+SEARCH_STRATEGIES=['grid','halving','random']
+
+def load_data(data_filepath):
+	'''
+	INPUT
+	data_filepath - SQLite database, parquet file or parquet directory written by process_data.py
+
+	OUTPUT
+	df - pandas dataframe with the feature and target columns of the customer profiles
+
+	This function does the following:
+	1. Reads only the feature and target columns of the customer profiles
+	2. Memory maps the parquet file when the columnar storage is used
+	'''
+	columns=FEATURE_COLUMNS+TARGET_COLUMNS
+	if os.path.isdir(data_filepath):
+		data_filepath=os.path.join(data_filepath,'customer_profiles.parquet')
+	if data_filepath.endswith('.parquet'):
+		return pd.read_parquet(data_filepath,columns=columns,memory_map=True)
+
+	engine = create_engine('sqlite:///'+data_filepath)
+	query='SELECT {} FROM customer_profiles'.format(', '.join('"{}"'.format(column) for column in columns))
+	return pd.read_sql_query(query,engine)
 
 def clean_data(df):
 	'''
@@ -24,29 +80,40 @@ def clean_data(df):
 
 	This function does the following:
 	1. Figures out numeric and categorical columns from the dataframe
-	2. Performs one hot encoding for the categorical variables and adds them to dataframe
+	2. Performs one hot encoding for the categorical variables, see FeatureEncoder
 	'''
-	num_vars = df.select_dtypes(include=['float', 'int']).columns
-	#for col in num_vars:
-	#    df[col].fillna((df[col].mean()), inplace=True)
-	    
-	cat_vars = df.select_dtypes(include=['object']).copy().columns
-	for var in  cat_vars:
-	    # for each cat add dummy var, drop original column
-	    df = pd.concat([df.drop(var, axis=1), pd.get_dummies(df[var], prefix=var, prefix_sep='_', drop_first=True)], axis=1)
-	return df
+	return FeatureEncoder().fit(df).transform_frame(df)
 
-def build_model(model_type='randomforest'):
+def build_training_data(data_filepath,report=None):
 	'''
 	INPUT
-	model_type - sklearn model type to be used
+	data_filepath - SQLite database, parquet file or parquet directory written by process_data.py
+	report - optional RunReport to record the loading and the encoding in
 
 	OUTPUT
-	cv - Gridsearchcv model on a pipeline testing different parameters
+	X - pandas dataframe of the encoded demographic features
+	targets - dictionary of offer type to the 'yes'/'no' response of every customer
+	encoder - dictionary of the FeatureEncoder fitted on the demographics
+	'''
+	with stage(report,'load_data') as record:
+		df = load_data(data_filepath)
+		record['rows'] = len(df)
+	# The encoding of clean_data, with the fitted encoder kept for the app
+	with stage(report,'clean_data') as record:
+		encoder = FeatureEncoder().fit(df[FEATURE_COLUMNS])
+		X = encoder.transform_frame(df[FEATURE_COLUMNS])
+		targets={offer:np.where(df[column]>0,'yes','no') for offer,column in TARGETS.items()}
+		record['rows'] = len(X)
+	return X, targets, encoder.to_dict()
+
+def get_model_parameters(model_type='randomforest'):
+	'''
+	INPUT
+	model_type - sklearn model type to be used
 
-	This function does the following:
-	1. Create a pipeline with the classifier as specified in model_type
-	2. Initialize a parameter grid for gridsearchcv for specific model_type
+	OUTPUT
+	pipeline - pipeline with the classifier as specified in model_type
+	parameters - parameter grid to search for the specific model_type
 	'''
 
 	if model_type=='decisiontree':
@@ -65,13 +132,55 @@ def build_model(model_type='randomforest'):
 	    clf= LogisticRegression(random_state=42)
 	    parameters = {
 	    }
+	else:
+	    raise ValueError('Unknown model type: {}'.format(model_type))
 	    
 	pipeline = Pipeline([
 	    ('clf', clf)
 	])
 
+	return pipeline, parameters
 
-	cv = GridSearchCV(pipeline, param_grid=parameters,n_jobs=-1,cv=3)
+def build_model(model_type='randomforest',search='grid',budget=None,scoring=None):
+	'''
+	INPUT
+	model_type - sklearn model type to be used
+	search - search strategy, one of SEARCH_STRATEGIES
+	budget - resource budget of the search: the number of sampled candidates for 'random',
+	         the maximum number of trees (forests) or training samples (trees) for 'halving'
+	scoring - scorer of the search, the accuracy of the classifier if not given
+
+	OUTPUT
+	cv - Gridsearchcv model (or the halving / randomized search) on a pipeline testing different parameters
+
+	This function does the following:
+	1. Create a pipeline with the classifier as specified in model_type
+	2. Initialize a parameter grid for the search for specific model_type
+	3. Wraps the pipeline in the exhaustive grid search, a successive halving search which
+	   drops the worst two thirds of the candidates after every round with a growing
+	   resource, or a randomized search over a fixed number of candidates
+	'''
+	pipeline, parameters = get_model_parameters(model_type)
+
+	if search not in SEARCH_STRATEGIES:
+	    raise ValueError('Unknown search strategy: {}'.format(search))
+
+	# A model without parameters to tune has nothing to search over
+	if search=='grid' or len(ParameterGrid(parameters))<=1:
+	    cv = GridSearchCV(pipeline, param_grid=parameters,scoring=scoring,n_jobs=-1,cv=3)
+	elif search=='halving':
+	    if model_type=='randomforest':
+	        # The forest grows from a single tree to budget trees, every round on all samples
+	        cv = HalvingGridSearchCV(pipeline, param_grid=parameters,resource='clf__n_estimators',\
+	                                 min_resources='smallest',max_resources=budget or 100,\
+	                                 factor=3,scoring=scoring,cv=3,n_jobs=-1,random_state=42)
+	    else:
+	        cv = HalvingGridSearchCV(pipeline, param_grid=parameters,resource='n_samples',\
+	                                 max_resources=budget or 'auto',factor=3,scoring=scoring,\
+	                                 cv=3,n_jobs=-1,random_state=42)
+	else:
+	    cv = RandomizedSearchCV(pipeline, param_distributions=parameters,n_iter=budget or 10,\
+	                            scoring=scoring,cv=3,n_jobs=-1,random_state=42)
 	return cv
 
 
@@ -112,11 +221,15 @@ def save_model(model, model_filepath):
 	with open(model_filepath, 'wb') as file:
 	    pickle.dump(model, file)
 
-def get_model_for_target(X,Y):
+def get_model_for_target(X,Y,search='grid',budget=None,report=None,offer=None):
 	'''
 	INPUT
 	X - Independent attributes to be used in classifer
 	Y - Target value for the classifier
+	search - search strategy of build_model
+	budget - resource budget of the search, see build_model
+	report - optional RunReport to record the search of every model type in
+	offer - offer type of the target, labels the searches in the report
 
 	OUTPUT
 	best_model - sklearn model to be used for classification
@@ -128,56 +241,379 @@ def get_model_for_target(X,Y):
 	X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=0.2)
 	score_max = -1
 	best_model = None
-	for model_type in ['decisiontree','randomforest','lr']:
-		model = build_model(model_type)
+	for model_type in MODEL_TYPES:
+		model = build_model(model_type,search,budget)
 
-		model.fit(X_train, Y_train)
+		with stage(report,'fit',offer=offer,model_type=model_type,search=search) as record:
+			model.fit(X_train, Y_train)
+			record['rows'] = len(X_train)
 
 		score= evaluate_model(model, X_test, Y_test)
 
 		if score>score_max:
+			score_max=score
 			best_model=model
 
 	return best_model
 
-def main():
-	if len(sys.argv) == 3:
-		database_filepath, model_filepath = sys.argv[1:]
-		print('Loading data...\n    DATABASE: {}'.format(database_filepath))
+def multi_output_accuracy(estimator,X,Y):
+	'''
+	INPUT
+	estimator - classifier fitted on all offer types at once
+	X - Independent attributes to be used in classifer
+	Y - 2d array of the target values, one column per offer type
+
+	OUTPUT
+	score - accuracy averaged over the offer types
+	'''
+	return np.mean(estimator.predict(X)==Y)
+
+def evaluate_multi_output_model(model, X_test, Y_test, offers):
+	'''
+	INPUT
+	model - the classifier model fitted on all offer types at once
+	X_test - test set of users
+	Y_test - 2d array of the actual user responses, one column per offer type
+	offers - offer types of the Y_test columns
+
+	OUTPUT
+	score - accuracy averaged over the offer types
+
+	Prints the accuracy and the classification report of every offer type
+	'''
+	Y_pred = model.predict(X_test)
+	for i, offer in enumerate(offers):
+		print('{}: {}'.format(offer, np.mean(Y_pred[:,i]==Y_test[:,i])))
+		print(classification_report(Y_test[:,i], Y_pred[:,i]))
+
+	return np.mean(Y_pred==Y_test)
+
+def get_multi_output_model(X,Y,offers,search='grid',budget=None,report=None):
+	'''
+	INPUT
+	X - Independent attributes to be used in classifer
+	Y - 2d array of the target values, one column per offer type
+	offers - offer types of the Y columns
+	search - search strategy of build_model
+	budget - resource budget of the search, see build_model
+	report - optional RunReport to record the search of every model type in
 
+	OUTPUT
+	best_model - sklearn pipeline fitted on all offer types at once
 
-		engine = create_engine('sqlite:///'+database_filepath)
-		df = pd.read_sql_table('customer_profiles',engine)
+	This function does the following:
+	1. Splits the given data into train and test sets once for all offer types
+	2. Searches the tree and forest models which natively predict several targets, scoring
+	   the candidates by their accuracy averaged over the offer types
+	3. Returns the best pipeline itself, its predict_proba gives one probability array per
+	   offer type
+	'''
+	X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=0.2)
+	score_max = -1
+	best_model = None
+	for model_type in MULTI_OUTPUT_MODEL_TYPES:
+		model = build_model(model_type,search,budget,scoring=multi_output_accuracy)
 
+		with stage(report,'fit',offer='multi-output',model_type=model_type,search=search) as record:
+			model.fit(X_train, Y_train)
+			record['rows'] = len(X_train)
 
-		demographics= df[['gender','age','income','customer_since']]
-		X = clean_data(demographics)
+		score= evaluate_multi_output_model(model, X_test, Y_test, offers)
 
-		print('Building model for bogo offer ....\n')
-		bogo= np.where(df['#bogos']>0,'yes','no')
-		bogo_model= get_model_for_target(X,bogo)
+		if score>score_max:
+			score_max=score
+			best_model=model
 
-		print('Building model for discount offer ....\n')
-		discount= np.where(df['#discounts']>0,'yes','no')
-		discount_model= get_model_for_target(X,discount)
+	# The search object refers to the scorer of this script, the pipeline unpickles anywhere
+	return best_model.best_estimator_
 
-		print('Building model for informational offer ....\n')
-		informational= np.where(df['#transaction_informational']>0,'yes','no')
-		informational_model= get_model_for_target(X,informational)
+# Memory mapped training arrays opened once per worker process
+_worker_arrays={}
 
-		model = {'bogo':bogo_model,'discount':discount_model,'informational':informational_model}
+def _load_array(filepath):
+	if filepath not in _worker_arrays:
+		_worker_arrays[filepath]=np.load(filepath,mmap_mode='r')
+	return _worker_arrays[filepath]
 
-		print('Saving model...\n    MODEL: {}'.format(model_filepath))
-		save_model(model, model_filepath)
+def _job_data(arrays,rows,columns):
+	X=_load_array(arrays[0])
+	Y=_load_array(arrays[1])
+	if rows is not None:
+		X=X[rows]
+		Y=Y[rows]
+	return pd.DataFrame(np.asarray(X),columns=columns),np.asarray(Y)
+
+def run_training_job(job):
+	'''
+	INPUT
+	job - dictionary describing one fit: model type, parameters, the .npy files and rows
+	      to fit and score on, and whether the fitted model is returned
 
-		print('Trained model saved!')
+	OUTPUT
+	result - dictionary with the job, its score, the fit and score seconds and the
+	         fitted model for refit jobs
+
+	The arrays are memory mapped from the .npy files written by train_models_parallel,
+	so every job in a worker process reads the same pages instead of receiving a copy.
+	'''
+	start=time.perf_counter()
+	pipeline,_=get_model_parameters(job['model_type'])
+	pipeline.set_params(**job['parameters'])
 
+	X_fit,Y_fit=_job_data(job['fit'],job['fit_rows'],job['columns'])
+	pipeline.fit(X_fit,Y_fit)
+	X_score,Y_score=_job_data(job['score'],job['score_rows'],job['columns'])
+	score=pipeline.score(X_score,Y_score)
+
+	return {'job':job,'score':score,'seconds':time.perf_counter()-start,\
+	        'model':pipeline if job['refit'] else None}
+
+def estimate_job_memory(model_type,n_rows,n_columns):
+	'''
+	INPUT
+	model_type - sklearn model type to be used
+	n_rows - number of rows the job fits on
+	n_columns - number of features
+
+	OUTPUT
+	memory - rough upper bound of the bytes a job holds while it runs
+
+	The fold copy of the data is held as float64 and as the float32 copy sklearn makes, and
+	a fully grown tree has at most two nodes of about 80 bytes per training row.
+	'''
+	memory=n_rows*n_columns*12
+	if model_type=='decisiontree':
+		memory+=n_rows*160
+	elif model_type=='randomforest':
+		memory+=n_rows*160*100
+	return memory
+
+def run_jobs(jobs,n_jobs,memory_budget=None):
+	'''
+	INPUT
+	jobs - list of job dictionaries for run_training_job
+	n_jobs - maximum number of jobs running at the same time
+	memory_budget - optional maximum of the summed memory estimates of the running jobs
+
+	OUTPUT
+	results - list of the job results in completion order
+
+	All jobs run on one process pool. A job only starts while the running jobs leave room
+	for its memory estimate in the budget, a single job always runs even if it is larger.
+	'''
+	pending=collections.deque(sorted(jobs,key=lambda job:job['memory'],reverse=True))
+	running={}
+	results=[]
+	with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+		while pending or running:
+			while pending and len(running)<n_jobs:
+				memory=sum(job['memory'] for job in running.values())
+				if running and memory_budget is not None and memory+pending[0]['memory']>memory_budget:
+					break
+				job=pending.popleft()
+				running[executor.submit(run_training_job,job)]=job
+			done,_=wait(running,return_when=FIRST_COMPLETED)
+			for future in done:
+				running.pop(future)
+				results.append(future.result())
+	return results
+
+def train_models_parallel(X,targets,n_jobs=None,memory_budget=None):
+	'''
+	INPUT
+	X - Independent attributes to be used in classifer
+	targets - dictionary of offer type to target values for the classifier
+	n_jobs - number of worker processes, all the cpus if not given
+	memory_budget - optional maximum of the summed memory estimates of the running jobs
+
+	OUTPUT
+	models - dictionary of offer type to the best fitted pipeline
+	timings - list of dictionaries with the target, model type, parameters, fold, score
+	          and seconds of every job
+
+	This function does the following:
+	1. Splits the data once into train and test sets and saves them as .npy files which
+	   every job memory maps
+	2. Builds one job per target, model type, parameter combination and cross validation
+	   fold (the same folds GridSearchCV(cv=3) uses) and runs them on one process pool
+	3. Refits the best parameters of every target and model type on the training set
+	4. Picks the model type with the best test set score for every target
+	'''
+	n_jobs=n_jobs or os.cpu_count()
+	columns=list(X.columns)
+	train_rows,test_rows=train_test_split(np.arange(len(X)),test_size=0.2)
+	X_values=X.to_numpy(dtype='float64')
+
+	with tempfile.TemporaryDirectory() as arrays_dirpath:
+		def save_array(name,values):
+			filepath=os.path.join(arrays_dirpath,name+'.npy')
+			np.save(filepath,values)
+			return filepath
+
+		X_train=save_array('X_train',X_values[train_rows])
+		X_test=save_array('X_test',X_values[test_rows])
+
+		jobs=[]
+		splits={}
+		for target,Y in targets.items():
+			Y=np.asarray(Y)
+			splits[target]=(save_array(target+'_train',Y[train_rows]),save_array(target+'_test',Y[test_rows]))
+			folds=list(StratifiedKFold(n_splits=3).split(X_values[train_rows],Y[train_rows]))
+			for model_type in MODEL_TYPES:
+				_,parameters=get_model_parameters(model_type)
+				for candidate,candidate_parameters in enumerate(ParameterGrid(parameters)):
+					for fold,(fit_rows,score_rows) in enumerate(folds):
+						jobs.append({'target':target,'model_type':model_type,'parameters':candidate_parameters,\
+						             'candidate':candidate,'fold':fold,'columns':columns,'refit':False,\
+						             'fit':(X_train,splits[target][0]),'fit_rows':fit_rows,\
+						             'score':(X_train,splits[target][0]),'score_rows':score_rows,\
+						             'memory':estimate_job_memory(model_type,len(fit_rows),len(columns))})
+
+		print('Running {} cross validation jobs on {} processes...'.format(len(jobs),n_jobs))
+		results=run_jobs(jobs,n_jobs,memory_budget)
+
+		# Mean fold score of every candidate, the first best candidate wins as in GridSearchCV
+		cv_scores=collections.defaultdict(list)
+		for result in results:
+			job=result['job']
+			cv_scores[(job['target'],job['model_type'],job['candidate'])].append(result['score'])
+		refit_jobs=[]
+		for target in targets:
+			for model_type in MODEL_TYPES:
+				_,parameters=get_model_parameters(model_type)
+				candidates=list(ParameterGrid(parameters))
+				means=[np.mean(cv_scores[(target,model_type,candidate)]) for candidate in range(len(candidates))]
+				best=int(np.argmax(means))
+				refit_jobs.append({'target':target,'model_type':model_type,'parameters':candidates[best],\
+				                   'candidate':best,'fold':None,'cv_score':means[best],'columns':columns,\
+				                   'refit':True,'fit':(X_train,splits[target][0]),'fit_rows':None,\
+				                   'score':(X_test,splits[target][1]),'score_rows':None,\
+				                   'memory':estimate_job_memory(model_type,len(train_rows),len(columns))})
+
+		print('Refitting {} best candidates...'.format(len(refit_jobs)))
+		refit_results=run_jobs(refit_jobs,n_jobs,memory_budget)
+
+	models={}
+	best_scores={}
+	refit_results.sort(key=lambda result:(list(targets).index(result['job']['target']),\
+	                                      MODEL_TYPES.index(result['job']['model_type'])))
+	for result in refit_results:
+		job=result['job']
+		print('{} {}: cv score {:.4f}, test score {:.4f}, parameters {}'.format(job['target'],job['model_type'],\
+		      job['cv_score'],result['score'],job['parameters']))
+		if result['score']>best_scores.get(job['target'],-1):
+			best_scores[job['target']]=result['score']
+			models[job['target']]=result['model']
+
+	timings=[{'target':result['job']['target'],'model_type':result['job']['model_type'],\
+	          'parameters':result['job']['parameters'],'fold':result['job']['fold'],\
+	          'score':result['score'],'seconds':result['seconds']} for result in results+refit_results]
+	return models,timings
+
+def print_timings(timings):
+	'''
+	INPUT
+	timings - list of job timings returned by train_models_parallel
+
+	OUTPUT
+	NONE
+
+	Prints the number of jobs and the summed and slowest job seconds per target and model type
+	'''
+	timings=pd.DataFrame(timings)
+	summary=timings.groupby(['target','model_type'])['seconds'].agg(['count','sum','max'])
+	summary.columns=['jobs','total seconds','slowest job seconds']
+	print(summary.round(3).to_string())
+
+def parse_args():
+	parser=argparse.ArgumentParser(description='Train the offer classifiers on the customer profiles',\
+	                               epilog='Example: python train_classifiers.py ../data/StarbucksOffers.db classifiers.pkl')
+	parser.add_argument('database_filepath',help='starbucks offers database (or the customer_profiles parquet file or directory)')
+	parser.add_argument('model_filepath',help='pickle file to save the model to')
+	parser.add_argument('--parallel',action='store_true',\
+	                    help='run the model selection of all targets and model types on one process pool')
+	parser.add_argument('--n-jobs',type=int,default=None,help='number of worker processes of --parallel (default: all cpus)')
+	parser.add_argument('--memory-budget',type=float,default=None,\
+	                    help='maximum estimated memory in MB of the jobs running at the same time with --parallel')
+	parser.add_argument('--multi-output',action='store_true',\
+	                    help='fit one model on all offer types at once instead of one model per offer type')
+	parser.add_argument('--search',choices=SEARCH_STRATEGIES,default='grid',\
+	                    help='hyperparameter search strategy (default: the exhaustive grid search)')
+	parser.add_argument('--budget',type=int,default=None,\
+	                    help='candidates sampled by the random search, or the maximum number of trees (forests) '\
+	                         'or samples (trees) of the halving search')
+	parser.add_argument('--feature-cache',dest='cache_dirpath',default=None,\
+	                    help='directory to cache the encoded features and targets in, reused while the data is unchanged')
+	parser.add_argument('--timings',dest='timings_filepath',default=None,\
+	                    help='JSON file to write the per job timings of --parallel to')
+	parser.add_argument('--report',dest='report_filepath',default=None,\
+	                    help='JSON file to write the time, CPU time, peak memory and rows of every stage to')
+	parser.add_argument('--profile',dest='pstats_filepath',default=None,\
+	                    help='run the stages under cProfile and dump the statistics of the slowest one to this file')
+	args=parser.parse_args()
+	if args.parallel and args.multi_output:
+		parser.error('--parallel and --multi-output can not be combined')
+	if args.parallel and args.search!='grid':
+		parser.error('--parallel runs the exhaustive grid search, --search {} is only available without it'.format(args.search))
+	return args
+
+def main():
+	args=parse_args()
+	report=RunReport('train_classifiers',profile=args.pstats_filepath is not None)
+	database_filepath,model_filepath=args.database_filepath,args.model_filepath
+	print('Loading data...\n    DATABASE: {}'.format(database_filepath))
+	if args.cache_dirpath:
+		with report.stage('load_cached_features') as record:
+			X, targets, encoder, hit = load_cached_features(database_filepath,args.cache_dirpath,build_training_data)
+			record['rows']=len(X)
+		print('    FEATURE CACHE: {} ({})'.format(args.cache_dirpath,'hit' if hit else 'rebuilt'))
 	else:
-		print('Please provide the filepath of the starbucks offers database '\
-		      'as the first argument and the filepath of the pickle file to '\
-		      'save the model to as the second argument. \n\nExample: python '\
-		      'train_classifier.py ../data/StarbucksOffers.db classifiers.pkl')
+		X, targets, encoder = build_training_data(database_filepath,report)
+	encoder = FeatureEncoder.from_dict(encoder)
+
+	if args.parallel:
+		memory_budget=args.memory_budget*1024**2 if args.memory_budget else None
+		# The searches run in worker processes, their fits are timed per job in timings
+		with report.stage('train_models_parallel') as record:
+			model,timings=train_models_parallel(X,targets,args.n_jobs,memory_budget)
+			record['rows']=len(X)
+		print_timings(timings)
+		if args.timings_filepath:
+			with open(args.timings_filepath,'w') as file:
+				json.dump(timings,file,indent=1,default=str)
+	elif args.multi_output:
+		print('Building model for {} offers ....\n'.format(', '.join(targets)))
+		Y=np.column_stack(list(targets.values()))
+		# The tuple key tells the app that one model predicts all these offer types
+		model={tuple(targets):get_multi_output_model(X,Y,list(targets),args.search,args.budget,report)}
+	else:
+		model={}
+		for offer,Y in targets.items():
+			print('Building model for {} offer ....\n'.format(offer))
+			model[offer]=get_model_for_target(X,Y,args.search,args.budget,report,offer)
+
+	print('Saving model...\n    MODEL: {}'.format(model_filepath))
+	with report.stage('save_model'):
+		save_model(model, model_filepath)
+
+	export_filepath=os.path.splitext(model_filepath)[0]+'.npz'
+	print('Exporting compact models...\n    EXPORT: {}'.format(export_filepath))
+	with report.stage('export_models'):
+		export_models(model, export_filepath)
+
+	encoder_filepath=get_encoder_filepath(model_filepath)
+	print('Saving feature encoder...\n    ENCODER: {}'.format(encoder_filepath))
+	encoder.save(encoder_filepath)
+
+	print('Trained model saved!')
+
+	report.print_summary()
+	if args.report_filepath:
+		report.save(args.report_filepath)
+		print('Run report saved!\n    REPORT: {}'.format(args.report_filepath))
+	if args.pstats_filepath:
+		report.save_profile(args.pstats_filepath)
 
 
 if __name__ == '__main__':
-	main()
\ No newline at end of file
+	main()
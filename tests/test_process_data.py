@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import sqlite3
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+DATA_DIRPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+sys.path.insert(0, DATA_DIRPATH)
+from process_data import get_offer_details, load_transcript_data, read_transcript_chunks, create_customer_profile_df, \
+    create_customer_timeline, load_transcript_database, create_customer_timeline_sql, \
+    create_customer_profiles_sharded, create_customer_timeline_state, summarize_offer_funnel
+from generate_data import generate_data
+import process_data
+
+# Events of the fixed slice of the shipped transcript the engines are compared on
+TRANSCRIPT_EVENTS = 30000
+
+# Events of every chunk of the chunked load test, its transactions fill whole chunks
+CHUNKSIZE = 20
+
+# Size and seed of the generated dataset used where the transcript is not shipped
+GENERATED_CUSTOMERS = 800
+GENERATED_SEED = 7
+
+# Worker processes of the sharded builder tests, each one builds one shard
+SHARD_WORKERS = 3
+
+# Number of time ordered batches the transcript is split in for the incremental load test
+INCREMENTAL_BATCHES = 3
+
+# Tables written by a full load with --offer-funnel and the columns identifying their rows
+TIMELINE_TABLES = {'customer_profiles': ['person'], 'customer_timeline_totals': ['person'],
+                   'customer_offer_state': ['person', 'offer_id'], 'timeline_watermark': ['max_time'],
+                   'offer_funnel': ['offer_id'], 'offer_funnel_hours': ['offer_id', 'hours']}
+
+
+@pytest.fixture(scope='module')
+def timeline_files(tmp_path_factory):
+    '''
+    OUTPUT
+    filepaths - dictionary of profile, portfolio and transcript to their json files, the
+                transcript is the first TRANSCRIPT_EVENTS events of data/transcript.json, or
+                a seeded generated dataset when the transcript is not shipped
+    '''
+    dirpath = tmp_path_factory.mktemp('timeline')
+    filepaths = {name: os.path.join(DATA_DIRPATH, name + '.json') for name in ['profile', 'portfolio', 'transcript']}
+    if os.path.exists(filepaths['transcript']):
+        with open(filepaths['transcript']) as file:
+            lines = list(itertools.islice(file, TRANSCRIPT_EVENTS))
+        filepaths['transcript'] = str(dirpath / 'transcript.json')
+        with open(filepaths['transcript'], 'w') as file:
+            file.writelines(lines)
+    else:
+        generate_data(str(dirpath), GENERATED_CUSTOMERS, seed=GENERATED_SEED)
+        filepaths = {name: str(dirpath / (name + '.json')) for name in filepaths}
+    return filepaths
+
+
+@pytest.fixture(scope='module')
+def timeline_data(timeline_files):
+    '''
+    OUTPUT
+    portfolio - pandas dataframe containing the offer portfolio data
+    transcript_filepath - line delimited json file of the transcript events
+    transcript - cleaned transcript of timeline_files
+    '''
+    portfolio = pd.read_json(timeline_files['portfolio'], orient='records', lines=True)
+    return portfolio, timeline_files['transcript'], load_transcript_data(timeline_files['transcript'])
+
+
+def split_transcript(transcript_filepath, dirpath, batches):
+    '''
+    INPUT
+    transcript_filepath - line delimited json file of the transcript events
+    dirpath - directory to write the batches to
+    batches - number of batches
+
+    OUTPUT
+    batch_filepaths - transcript files of the batches, every batch holds the events of a
+                      range of times after the times of the batch before it
+    '''
+    with open(transcript_filepath) as file:
+        lines = file.readlines()
+    times = np.array([json.loads(line)['time'] for line in lines])
+    batch_filepaths = []
+    for i, batch_times in enumerate(np.array_split(np.unique(times), batches)):
+        batch_filepaths.append(str(dirpath / 'transcript_{}.json'.format(i)))
+        with open(batch_filepaths[-1], 'w') as file:
+            file.writelines(line for line, in_batch in zip(lines, np.isin(times, batch_times)) if in_batch)
+    return batch_filepaths
+
+
+def run_process_data(monkeypatch, filepaths, transcript_filepath, database_filepath, *options):
+    # Runs process_data.py as from the command line
+    monkeypatch.setattr(sys, 'argv', ['process_data.py', filepaths['profile'], filepaths['portfolio'],
+                                      transcript_filepath, database_filepath] + list(options))
+    process_data.main()
+
+
+def read_table(database_filepath, table_name):
+    with sqlite3.connect(database_filepath) as connection:
+        return pd.read_sql_query('SELECT * FROM {}'.format(table_name), connection)
+
+
+def sort_frame(frame, keys):
+    '''
+    INPUT
+    frame - pandas dataframe of one engine
+    keys - columns identifying a row
+
+    OUTPUT
+    frame - the dataframe sorted by the keys with a fresh index and the keys as strings
+    '''
+    frame = frame.assign(**{key: frame[key].astype(str) for key in keys})
+    return frame.sort_values(keys, kind='mergesort').reset_index(drop=True)
+
+
+def test_vectorized_engine_matches_timeline(timeline_data):
+    portfolio, _, transcript = timeline_data
+    offer_durations, offer_types = get_offer_details(portfolio)
+
+    expected = create_customer_profile_df(transcript, offer_durations, offer_types, 'timeline')
+    actual = create_customer_profile_df(transcript, offer_durations, offer_types, 'vectorized')
+
+    assert len(expected) == transcript['person'].nunique()
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+def test_sql_engine_matches_vectorized(timeline_data, tmp_path):
+    portfolio, transcript_filepath, transcript = timeline_data
+    offer_durations, offer_types = get_offer_details(portfolio)
+
+    work_filepath = str(tmp_path / 'work.db')
+    load_transcript_database(portfolio, read_transcript_chunks(transcript_filepath), work_filepath)
+    actual_profiles, actual_state, actual_funnel = create_customer_timeline_sql(work_filepath, funnel=True)
+    profiles, offer_state, offer_funnel = create_customer_timeline(transcript, offer_durations, offer_types,
+                                                                   funnel=True)
+
+    checks = [(profiles, actual_profiles, ['person']),
+              (offer_state, actual_state, ['person', 'offer_id']),
+              (offer_funnel[0], actual_funnel[0], ['offer_id']),
+              (offer_funnel[1], actual_funnel[1], ['offer_id', 'hours'])]
+    for expected, actual, keys in checks:
+        pd.testing.assert_frame_equal(sort_frame(actual, keys), sort_frame(expected, keys), check_dtype=False)
+
+
+def test_chunked_load_with_transaction_only_chunks(tmp_path):
+    records = [{'person': 'p{}'.format(i % 5), 'event': 'offer received', 'time': i,
+                'value': {'offer id': 'o{}'.format(i % 3)}} for i in range(CHUNKSIZE)]
+    records += [{'person': 'p{}'.format(i % 5), 'event': 'transaction', 'time': CHUNKSIZE + i,
+                 'value': {'amount': 1.5}} for i in range(CHUNKSIZE * 5 // 2)]
+    transcript_filepath = str(tmp_path / 'transcript.json')
+    with open(transcript_filepath, 'w') as file:
+        file.writelines(json.dumps(record) + '\n' for record in records)
+
+    expected = load_transcript_data(transcript_filepath, chunksize=len(records))
+    actual = load_transcript_data(transcript_filepath, chunksize=CHUNKSIZE)
+
+    assert list(actual['offer_id_merged'].cat.categories) == ['o0', 'o1', 'o2']
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_incremental_batches_match_full_load(timeline_files, tmp_path, monkeypatch):
+    full_filepath = str(tmp_path / 'full.db')
+    run_process_data(monkeypatch, timeline_files, timeline_files['transcript'], full_filepath, '--offer-funnel')
+
+    incremental_filepath = str(tmp_path / 'incremental.db')
+    batch_filepaths = split_transcript(timeline_files['transcript'], tmp_path, INCREMENTAL_BATCHES)
+    run_process_data(monkeypatch, timeline_files, batch_filepaths[0], incremental_filepath, '--offer-funnel')
+    for batch_filepath in batch_filepaths[1:]:
+        run_process_data(monkeypatch, timeline_files, batch_filepath, incremental_filepath, '--incremental')
+
+    for table_name, keys in TIMELINE_TABLES.items():
+        expected = sort_frame(read_table(full_filepath, table_name), keys)
+        actual = sort_frame(read_table(incremental_filepath, table_name), keys)
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False, obj=table_name)
+
+
+def test_sharded_profiles_match_serial(timeline_data):
+    portfolio, _, transcript = timeline_data
+    offer_durations, offer_types = get_offer_details(portfolio)
+
+    expected = create_customer_profile_df(transcript, offer_durations, offer_types)
+    actual = create_customer_profiles_sharded(transcript, offer_durations, offer_types, workers=SHARD_WORKERS)
+    pd.testing.assert_frame_equal(sort_frame(actual, ['person']), sort_frame(expected, ['person']), check_dtype=False)
+
+    expected_profiles, expected_state = create_customer_timeline_state(portfolio, transcript)
+    actual_profiles, actual_state = create_customer_timeline_state(portfolio, transcript, workers=SHARD_WORKERS)
+    pd.testing.assert_frame_equal(sort_frame(actual_profiles, ['person']), sort_frame(expected_profiles, ['person']),
+                                  check_dtype=False)
+    pd.testing.assert_frame_equal(sort_frame(actual_state, ['person', 'offer_id']),
+                                  sort_frame(expected_state, ['person', 'offer_id']), check_dtype=False)
+
+
+def test_offer_funnel_adds_up_across_shards_and_batches(timeline_files, timeline_data, tmp_path, monkeypatch):
+    portfolio, _, transcript = timeline_data
+    offer_durations, offer_types = get_offer_details(portfolio)
+    funnel_counts, funnel_hours = create_customer_timeline(transcript, offer_durations, offer_types, funnel=True)[2]
+
+    sharded_counts, sharded_hours = create_customer_timeline_state(portfolio, transcript, workers=SHARD_WORKERS,
+                                                                   funnel=True)[2]
+    pd.testing.assert_frame_equal(sort_frame(sharded_counts, ['offer_id']), sort_frame(funnel_counts, ['offer_id']),
+                                  check_dtype=False)
+    pd.testing.assert_frame_equal(sort_frame(sharded_hours, ['offer_id', 'hours']),
+                                  sort_frame(funnel_hours, ['offer_id', 'hours']), check_dtype=False)
+
+    # A sharded full load of the first batch with the funnel of the later batches added to it
+    database_filepath = str(tmp_path / 'funnel.db')
+    batch_filepaths = split_transcript(timeline_files['transcript'], tmp_path, INCREMENTAL_BATCHES)
+    run_process_data(monkeypatch, timeline_files, batch_filepaths[0], database_filepath, '--offer-funnel',
+                     '--workers', str(SHARD_WORKERS))
+    for batch_filepath in batch_filepaths[1:]:
+        run_process_data(monkeypatch, timeline_files, batch_filepath, database_filepath, '--incremental')
+
+    expected = summarize_offer_funnel((funnel_counts, funnel_hours), portfolio)
+    pd.testing.assert_frame_equal(sort_frame(read_table(database_filepath, 'offer_funnel'), ['offer_id']),
+                                  sort_frame(expected, ['offer_id']), check_dtype=False)
+    actual_hours = read_table(database_filepath, 'offer_funnel_hours')
+    pd.testing.assert_frame_equal(sort_frame(actual_hours, ['offer_id', 'hours']),
+                                  sort_frame(funnel_hours, ['offer_id', 'hours']), check_dtype=False)